@@ -1,16 +1,157 @@
 # ai_models/base_model.py
 from abc import ABC, abstractmethod
+from typing import Iterator, Union
+import asyncio
+import inspect
 import logging
 
 # Configura un logger específico para los modelos de IA
 logger = logging.getLogger(__name__)
 
+# Códigos HTTP que indican un fallo transitorio del proveedor (se reintentan).
+RETRYABLE_STATUS_CODES = frozenset({408, 409, 425, 429, 500, 502, 503, 504, 529})
+# Excepciones sin código HTTP (conexión, timeouts, errores gRPC de Google) que también son transitorias.
+_RETRYABLE_ERROR_NAMES = ('Connection', 'Timeout', 'ServiceUnavailable', 'ResourceExhausted',
+                          'DeadlineExceeded', 'InternalServerError', 'Overloaded')
+
+# Tipos de error de `ModelResult.error_kind`.
+ERROR_PROVIDER = 'provider'        # la API del proveedor devolvió un error
+ERROR_TIMEOUT = 'timeout'          # no respondió dentro del plazo
+ERROR_UNAVAILABLE = 'unavailable'  # circuito abierto, sin huecos o pool saturado
+ERROR_CONFIG = 'config'            # el conector no se pudo inicializar
+ERROR_INTERNAL = 'internal'        # fallo de la propia aplicación
+
+def estimate_tokens(text):
+    """Estimación rápida de tokens (~4 caracteres por token); admite una lista de mensajes."""
+    if isinstance(text, list):
+        return sum(estimate_tokens(message['content']) for message in text)
+    return max(1, len(text) // 4) if text else 0
+
+def to_messages(prompt):
+    """
+    Mensajes {'role': 'user' | 'assistant', 'content'} de un prompt. Los conectores aceptan un
+    texto (un único mensaje 'user') o una lista de mensajes ya construida (modo Conversación).
+    """
+    if isinstance(prompt, list):
+        return prompt
+    return [{"role": "user", "content": prompt}]
+
+def prompt_text(prompt):
+    """Texto del prompt o, si es una lista de mensajes, el del último (lo que se debe contestar)."""
+    if isinstance(prompt, list):
+        return prompt[-1]['content'] if prompt else ''
+    return prompt
+
+class ModelResult:
+    """
+    Resultado de una consulta a un modelo.
+
+    `text` es la respuesta o, si `error_kind` no es None, el mensaje de error. Los conectores
+    rellenan el uso de tokens y el motivo de fin con lo que devuelve cada SDK; la aplicación
+    añade las latencias (total y hasta el primer token), si se sirvió desde la caché (y, si
+    fue por un prompt parecido, `semantic_match` con ese prompt y su similitud) y si se
+    compartió la llamada de otra petición idéntica en curso (`coalesced`).
+    """
+    __slots__ = ('text', 'error_kind', 'latency', 'first_token_latency', 'input_tokens', 'output_tokens',
+                 'finish_reason', 'cached', 'coalesced', 'semantic_match')
+
+    def __init__(self, text='', error_kind=None, latency=None, first_token_latency=None,
+                 input_tokens=None, output_tokens=None, finish_reason=None, cached=False, coalesced=False,
+                 semantic_match=None):
+        self.text = text or ''
+        self.error_kind = error_kind
+        self.latency = latency
+        self.first_token_latency = first_token_latency
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.finish_reason = finish_reason
+        self.cached = cached
+        self.coalesced = coalesced
+        self.semantic_match = semantic_match
+
+    @classmethod
+    def failure(cls, message, error_kind=ERROR_PROVIDER, **kwargs):
+        return cls(message, error_kind, **kwargs)
+
+    @classmethod
+    def from_meta(cls, text, meta):
+        """Reconstruye un resultado a partir de su texto y su `meta()` (p. ej. el progreso guardado de un trabajo)."""
+        return cls(text, meta.get('error_kind'), meta.get('total_sec'), meta.get('first_token_sec'),
+                   meta.get('input_tokens'), meta.get('output_tokens'), meta.get('finish_reason'),
+                   meta.get('cached', False), meta.get('coalesced', False), meta.get('semantic_match'))
+
+    @property
+    def ok(self):
+        return self.error_kind is None
+
+    @property
+    def tokens_per_second(self):
+        """Tokens de salida por segundo de latencia total (None si no se conocen)."""
+        if not self.output_tokens or not self.latency or self.cached:
+            return None
+        return self.output_tokens / self.latency
+
+    def meta(self):
+        """Todo salvo el texto, con los nombres de campo de las respuestas JSON."""
+        tokens_per_second = self.tokens_per_second
+        return {
+            'error_kind': self.error_kind,
+            'total_sec': round(self.latency, 3) if self.latency is not None else None,
+            'first_token_sec': round(self.first_token_latency, 3) if self.first_token_latency is not None else None,
+            'input_tokens': self.input_tokens,
+            'output_tokens': self.output_tokens,
+            'tokens_per_sec': round(tokens_per_second, 1) if tokens_per_second is not None else None,
+            'finish_reason': self.finish_reason,
+            'cached': self.cached,
+            'coalesced': self.coalesced,
+            'semantic_match': self.semantic_match,
+        }
+
+    def __repr__(self):
+        return f"ModelResult({self.text[:40]!r}, error_kind={self.error_kind!r})"
+
+class ProviderError(Exception):
+    """
+    Error transitorio de un proveedor (429, 5xx, fallo de conexión).
+    Los conectores lo lanzan en lugar de devolver el texto de error para que
+    `services.provider_limits` pueda reintentar y alimentar el circuit breaker.
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def _error_status_code(error):
+    """Código HTTP de una excepción de cualquiera de los SDK, si lo tiene."""
+    for attr in ('status_code', 'http_status', 'code'):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(error, 'response', None)
+    value = getattr(response, 'status_code', None)
+    return value if isinstance(value, int) else None
+
+def _error_retry_after(error):
+    """Segundos indicados en la cabecera Retry-After (solo la forma numérica)."""
+    headers = getattr(error, 'headers', None) or getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get('retry-after')))
+    except (TypeError, ValueError):
+        return None
+
 class AIModel(ABC):
     """
     Clase base abstracta mejorada para todos los modelos de IA.
     Define una estructura robusta que incluye inicialización, validación y consulta.
     """
 
+    # Clientes HTTP compartidos por host (services.http_pool.HTTPPools); la aplicación lo asigna
+    # al arrancar. Sin él, cada SDK crea su propio pool de conexiones con sus valores por defecto.
+    http_pools = None
+
     def __init__(self, config):
         """
         Constructor que recibe la configuración y la valida.
@@ -18,6 +159,7 @@ class AIModel(ABC):
         self.config = config
         self.name = config.get('name', 'Modelo Desconocido')
         self.initialization_error = None
+        self._shared_http_clients = {'sync': [], 'async': []}
         
         try:
             self._validate_config()
@@ -45,19 +187,125 @@ class AIModel(ABC):
         """
         pass
     @abstractmethod
-    def query(self, prompt: str, options: dict = None) -> str:
+    def query(self, prompt: str, options: dict = None) -> 'ModelResult':
         """
         Método abstracto para realizar una consulta, ahora con parámetros opcionales.
+        Devuelve un `ModelResult`; los errores se indican con `error_kind`, no con el texto.
 
         Args:
-            prompt (str): La pregunta o prompt.
+            prompt (str | list): La pregunta o prompt, o una lista de mensajes (ver `to_messages`).
             options (dict, optional): Un diccionario con parámetros como 'temperature' o 'max_tokens'.
         """
         if self.initialization_error:
-            return self.initialization_error
+            return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
         
         if not prompt:
-            return "Error: El prompt no puede estar vacío."
+            return ModelResult.failure("Error: El prompt no puede estar vacío.", ERROR_INTERNAL)
             
         logger.info(f"Enviando prompt a {self.name} con opciones: {options}")
 
+    def query_stream(self, prompt: str, options: dict = None) -> Iterator[Union[str, 'ModelResult']]:
+        """
+        Realiza una consulta devolviendo la respuesta en fragmentos a medida que llegan.
+
+        Los fragmentos de texto son `str`. El último elemento puede ser un `ModelResult`
+        con el uso de tokens y el motivo de fin; si no hubo fragmentos, ese resultado lleva
+        el texto completo o el error.
+
+        La implementación por defecto no transmite nada: llama a `query()` y entrega
+        su resultado. Los conectores cuyo SDK soporta streaming deben sobrescribir este método.
+
+        Args:
+            prompt (str): La pregunta o prompt.
+            options (dict, optional): Un diccionario con parámetros como 'temperature' o 'max_tokens'.
+        """
+        yield self.query(prompt, options)
+
+    def _result(self, text, input_tokens=None, output_tokens=None, finish_reason=None):
+        """Construye el `ModelResult` de una respuesta correcta a partir de los campos del SDK."""
+        if finish_reason is not None:
+            # Los SDK usan enums (Gemini, Mistral) o cadenas (OpenAI, Anthropic).
+            finish_reason = str(getattr(finish_reason, 'name', finish_reason)).lower()
+        return ModelResult(text, input_tokens=input_tokens, output_tokens=output_tokens,
+                           finish_reason=finish_reason)
+
+    def _raise_if_retryable(self, error, error_message):
+        """
+        Relanza como `ProviderError` los errores transitorios (429, 5xx, conexión);
+        el resto se devuelven como texto de error, como hasta ahora.
+        """
+        status_code = _error_status_code(error)
+        if status_code is not None:
+            retryable = status_code in RETRYABLE_STATUS_CODES
+        else:
+            retryable = any(name in type(error).__name__ for name in _RETRYABLE_ERROR_NAMES)
+        if retryable:
+            raise ProviderError(error_message, status_code, _error_retry_after(error)) from error
+
+    async def aquery(self, prompt: str, options: dict = None) -> 'ModelResult':
+        """
+        Versión asíncrona de `query()`.
+
+        Los conectores la implementan con el cliente asíncrono de su SDK, de modo que
+        una llamada en curso solo cuesta una corrutina. Los clientes asíncronos quedan
+        ligados al bucle de eventos en el que se usan por primera vez, por lo que deben
+        llamarse siempre desde el mismo bucle (ver `services.async_runtime`).
+        La implementación por defecto ejecuta `query()` en un hilo auxiliar.
+        """
+        return await asyncio.to_thread(self.query, prompt, options)
+
+    def warmup(self):
+        """
+        Abre de antemano la conexión con el proveedor (DNS, TCP y TLS) con una llamada barata
+        que no genera texto, para que la primera consulta no pague ese coste. El registro de
+        modelos la llama al precalentar si PREWARM_CONNECTIONS está activo.
+        La implementación por defecto no hace nada.
+        """
+        pass
+
+    def _shared_http_client(self, base_url, client_class):
+        """
+        Cliente httpx compartido con los demás conectores del mismo host, con los ajustes de
+        'transport' del proveedor. `client_class` es la clase de cliente httpx (síncrona o
+        asíncrona) que espera el SDK. None si la aplicación no usa pools compartidos.
+        """
+        if self.http_pools is None:
+            return None
+        client = self.http_pools.acquire(base_url, self.config.get('transport'), client_class)
+        self._shared_http_clients['async' if hasattr(client, 'aclose') else 'sync'].append(client)
+        return client
+
+    def _http_client_options(self, base_url, client_class):
+        """Argumentos `http_client` y `timeout` para los SDK que aceptan un cliente httpx propio."""
+        client = self._shared_http_client(base_url, client_class)
+        return {'http_client': client, 'timeout': client.timeout} if client is not None else {}
+
+    def close(self):
+        """
+        Libera el cliente síncrono del SDK (conexiones HTTP abiertas).
+        El registro de modelos lo llama cuando sustituye una instancia. Los clientes
+        compartidos no se cierran aquí: se devuelven al pool, que cierra el último.
+        """
+        if self._shared_http_clients['sync']:
+            for client in self._shared_http_clients['sync']:
+                self.http_pools.release(client)
+            self._shared_http_clients['sync'] = []
+            return
+        client = getattr(self, 'client', None)
+        close = getattr(client, 'close', None)
+        if callable(close):
+            close()
+
+    async def aclose(self):
+        """Libera el cliente asíncrono del SDK, si el conector tiene uno."""
+        if self._shared_http_clients['async']:
+            for client in self._shared_http_clients['async']:
+                await self.http_pools.arelease(client)
+            self._shared_http_clients['async'] = []
+            return
+        client = getattr(self, 'async_client', None)
+        close = getattr(client, 'close', None)
+        if callable(close):
+            result = close()
+            if inspect.isawaitable(result):
+                await result
@@ -1,7 +1,10 @@
 # ai_models/claude.py
 import os
 import anthropic
-from .base_model import AIModel, logger
+from .base_model import AIModel, ModelResult, ERROR_CONFIG, logger, to_messages
+
+# Host por defecto del SDK (sin 'base_url' ni ANTHROPIC_BASE_URL); identifica su pool de conexiones.
+ANTHROPIC_API_URL = 'https://api.anthropic.com'
 
 class ClaudeModel(AIModel):
     """
@@ -18,29 +21,84 @@ class ClaudeModel(AIModel):
         api_key = os.getenv(api_key_env_var)
         if not api_key:
             raise ValueError(f"La variable de entorno '{api_key_env_var}' no está configurada.")
-        self.client = anthropic.Anthropic(api_key=api_key)
+        # 'base_url' (opcional) apunta el conector a otra URL, p. ej. el proveedor simulado de benchmarks/.
+        # Los reintentos los hace services.provider_limits; los del SDK se sumarían a los suyos.
+        # Las conexiones HTTP se comparten con los demás conectores del mismo host (services.http_pool).
+        base_url = self.config.get('base_url')
+        pool_url = base_url or os.getenv('ANTHROPIC_BASE_URL', ANTHROPIC_API_URL)
+        self.client = anthropic.Anthropic(api_key=api_key, base_url=base_url, max_retries=0,
+                                          **self._http_client_options(pool_url, anthropic.DefaultHttpxClient))
+        self.async_client = anthropic.AsyncAnthropic(
+            api_key=api_key, base_url=base_url, max_retries=0,
+            **self._http_client_options(pool_url, anthropic.DefaultAsyncHttpxClient))
 
-class ClaudeModel(AIModel):
-    # ... (_validate_config y _initialize_model no cambian) ...
+    def warmup(self):
+        """Abre la conexión con una consulta de metadatos que no consume tokens."""
+        if not self.initialization_error:
+            self.client.models.list(limit=1)
+
+    def _build_api_params(self, prompt: str, options: dict = None) -> dict:
+        """Parámetros para la API de Anthropic."""
+        options = options or {}
+        api_params = {
+            'model': self.config['model_name_api'],
+            'max_tokens': options.get('max_tokens', 2048), # Valor por defecto si no se proporciona
+            'messages': to_messages(prompt)
+        }
+        if 'temperature' in options:
+            api_params['temperature'] = options['temperature']
+        return api_params
 
-    def query(self, prompt: str, options: dict = None) -> str:
+    def _message_result(self, message) -> ModelResult:
+        """Texto, uso de tokens y motivo de fin de un mensaje de Anthropic."""
+        return self._result(message.content[0].text, message.usage.input_tokens,
+                            message.usage.output_tokens, message.stop_reason)
+
+    def query(self, prompt: str, options: dict = None) -> ModelResult:
         super().query(prompt, options)
-        if self.initialization_error: return self.initialization_error
+        if self.initialization_error: return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
 
         try:
-            # Parámetros para la API de Anthropic
-            api_params = {
-                'model': self.config['model_name_api'],
-                'max_tokens': options.get('max_tokens', 2048), # Valor por defecto si no se proporciona
-                'messages': [{"role": "user", "content": prompt}]
-            }
-            if options and 'temperature' in options:
-                api_params['temperature'] = options['temperature']
-
-            message = self.client.messages.create(**api_params)
+            message = self.client.messages.create(**self._build_api_params(prompt, options))
             logger.info(f"Respuesta recibida de {self.name}.")
-            return message.content[0].text
+            return self._message_result(message)
+        except Exception as e:
+            error_message = f"Error al consultar la API de Anthropic ({self.name}): {e}"
+            logger.error(error_message)
+            self._raise_if_retryable(e, error_message)
+            return ModelResult.failure(error_message)
+
+    async def aquery(self, prompt: str, options: dict = None) -> ModelResult:
+        super().query(prompt, options)
+        if self.initialization_error: return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+
+        try:
+            message = await self.async_client.messages.create(**self._build_api_params(prompt, options))
+            logger.info(f"Respuesta recibida de {self.name}.")
+            return self._message_result(message)
+        except Exception as e:
+            error_message = f"Error al consultar la API de Anthropic ({self.name}): {e}"
+            logger.error(error_message)
+            self._raise_if_retryable(e, error_message)
+            return ModelResult.failure(error_message)
+
+    def query_stream(self, prompt: str, options: dict = None):
+        """Transmite la respuesta de Claude fragmento a fragmento."""
+        super().query(prompt, options)
+        if self.initialization_error:
+            yield ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+            return
+
+        try:
+            with self.client.messages.stream(**self._build_api_params(prompt, options)) as stream:
+                for text in stream.text_stream:
+                    yield text
+                final_message = stream.get_final_message()
+            logger.info(f"Streaming completado para {self.name}.")
+            yield self._result('', final_message.usage.input_tokens, final_message.usage.output_tokens,
+                               final_message.stop_reason)
         except Exception as e:
             error_message = f"Error al consultar la API de Anthropic ({self.name}): {e}"
             logger.error(error_message)
-            return error_message
+            self._raise_if_retryable(e, error_message)
+            yield ModelResult.failure(error_message)
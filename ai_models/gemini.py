@@ -1,7 +1,7 @@
 # ai_models/gemini.py
 import os
 import google.generativeai as genai
-from .base_model import AIModel, logger
+from .base_model import AIModel, ModelResult, ERROR_CONFIG, logger
 
 class GeminiModel(AIModel):
     """
@@ -25,26 +25,101 @@ class GeminiModel(AIModel):
         genai.configure(api_key=api_key)
         self.model = genai.GenerativeModel(self.config['model_name_api'])
     
-    def query(self, prompt: str, options: dict = None) -> str:
+    def warmup(self):
+        """Abre la conexión con una consulta de metadatos que no consume tokens."""
+        if not self.initialization_error:
+            genai.get_model(self.config['model_name_api'])
+
+    def _build_contents(self, prompt):
+        """Gemini llama 'model' al rol del asistente y usa 'parts' en lugar de 'content'."""
+        if not isinstance(prompt, list):
+            return prompt
+        return [{'role': 'model' if m['role'] == 'assistant' else 'user', 'parts': [m['content']]} for m in prompt]
+
+    def _build_generation_config(self, options: dict = None):
+        """Traduce las opciones genéricas a la configuración de generación de Gemini."""
+        generation_config = {}
+        if options:
+            if 'temperature' in options:
+                generation_config['temperature'] = options['temperature']
+            if 'max_tokens' in options:
+                generation_config['max_output_tokens'] = options['max_tokens']
+        return generation_config if generation_config else None
+
+    def _chunk_text(self, chunk):
+        """
+        Texto de un fragmento del stream. No usa `chunk.text`, que lanza `ValueError` con los
+        fragmentos sin partes de texto (el de fin o el de seguridad); esos devuelven ''.
+        """
+        candidates = chunk.candidates
+        if not candidates:
+            return ''
+        return ''.join(getattr(part, 'text', '') or '' for part in candidates[0].content.parts)
+
+    def _response_result(self, response, text) -> ModelResult:
+        """Uso de tokens (usage_metadata) y motivo de fin de una respuesta de Gemini."""
+        usage = getattr(response, 'usage_metadata', None)
+        candidates = getattr(response, 'candidates', None)
+        return self._result(text, getattr(usage, 'prompt_token_count', None),
+                            getattr(usage, 'candidates_token_count', None),
+                            candidates[0].finish_reason if candidates else None)
+
+    def query(self, prompt: str, options: dict = None) -> ModelResult:
         super().query(prompt, options)
-        if self.initialization_error: return self.initialization_error
+        if self.initialization_error: return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
             
         try:
-            # Configuración de generación con los nuevos parámetros
-            generation_config = {}
-            if options:
-                if 'temperature' in options:
-                    generation_config['temperature'] = options['temperature']
-                if 'max_tokens' in options:
-                    generation_config['max_output_tokens'] = options['max_tokens']
-
             response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config if generation_config else None
+                self._build_contents(prompt),
+                generation_config=self._build_generation_config(options)
+            )
+            logger.info(f"Respuesta recibida de {self.name}.")
+            return self._response_result(response, response.text)
+        except Exception as e:
+            error_message = f"Error al consultar la API de Gemini ({self.name}): {e}"
+            logger.error(error_message)
+            self._raise_if_retryable(e, error_message)
+            return ModelResult.failure(error_message)
+
+    async def aquery(self, prompt: str, options: dict = None) -> ModelResult:
+        super().query(prompt, options)
+        if self.initialization_error: return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+
+        try:
+            response = await self.model.generate_content_async(
+                self._build_contents(prompt),
+                generation_config=self._build_generation_config(options)
             )
             logger.info(f"Respuesta recibida de {self.name}.")
-            return response.text
+            return self._response_result(response, response.text)
+        except Exception as e:
+            error_message = f"Error al consultar la API de Gemini ({self.name}): {e}"
+            logger.error(error_message)
+            self._raise_if_retryable(e, error_message)
+            return ModelResult.failure(error_message)
+
+    def query_stream(self, prompt: str, options: dict = None):
+        """Transmite la respuesta de Gemini fragmento a fragmento."""
+        super().query(prompt, options)
+        if self.initialization_error:
+            yield ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+            return
+
+        try:
+            response = self.model.generate_content(
+                self._build_contents(prompt),
+                generation_config=self._build_generation_config(options),
+                stream=True
+            )
+            for chunk in response:
+                text = self._chunk_text(chunk)
+                if text:
+                    yield text
+            logger.info(f"Streaming completado para {self.name}.")
+            # Tras consumir el stream, la respuesta agregada trae el uso de tokens y el motivo de fin.
+            yield self._response_result(response, '')
         except Exception as e:
             error_message = f"Error al consultar la API de Gemini ({self.name}): {e}"
             logger.error(error_message)
-            return error_message
+            self._raise_if_retryable(e, error_message)
+            yield ModelResult.failure(error_message)
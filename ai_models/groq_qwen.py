@@ -0,0 +1,112 @@
+# ai_models/groq_qwen.py
+import os
+from groq import Groq, AsyncGroq, DefaultHttpxClient, DefaultAsyncHttpxClient
+from .base_model import AIModel, ModelResult, ERROR_CONFIG, logger, to_messages
+
+# Host por defecto del SDK (sin 'base_url' ni GROQ_BASE_URL); identifica su pool de conexiones.
+GROQ_API_URL = 'https://api.groq.com'
+
+class GroqQwenModel(AIModel):
+    """
+    Conector para la API de Groq, adaptado a la nueva clase base.
+    """
+
+    def _validate_config(self):
+        super()._validate_config()
+        if 'api_key_env' not in self.config or 'model_name_api' not in self.config:
+            raise ValueError("La configuración de Groq debe contener 'api_key_env' y 'model_name_api'.")
+
+    def _initialize_model(self):
+        api_key_env_var = self.config['api_key_env']
+        api_key = os.getenv(api_key_env_var)
+        if not api_key:
+            raise ValueError(f"La variable de entorno '{api_key_env_var}' no está configurada.")
+        # 'base_url' (opcional) apunta el conector a otra URL, p. ej. el proveedor simulado de benchmarks/.
+        # Los reintentos los hace services.provider_limits; los del SDK se sumarían a los suyos.
+        # Las conexiones HTTP se comparten con los demás conectores del mismo host (services.http_pool).
+        base_url = self.config.get('base_url')
+        pool_url = base_url or os.getenv('GROQ_BASE_URL', GROQ_API_URL)
+        self.client = Groq(api_key=api_key, base_url=base_url, max_retries=0,
+                           **self._http_client_options(pool_url, DefaultHttpxClient))
+        self.async_client = AsyncGroq(api_key=api_key, base_url=base_url, max_retries=0,
+                                      **self._http_client_options(pool_url, DefaultAsyncHttpxClient))
+
+    def warmup(self):
+        """Abre la conexión con una consulta de metadatos que no consume tokens."""
+        if not self.initialization_error:
+            self.client.models.list()
+
+    def _build_api_params(self, prompt: str, options: dict = None) -> dict:
+        """Parámetros para la API compatible con OpenAI."""
+        api_params = {
+            'model': self.config['model_name_api'],
+            'messages': to_messages(prompt)
+        }
+        if options:
+            if 'temperature' in options:
+                api_params['temperature'] = options['temperature']
+            if 'max_tokens' in options:
+                api_params['max_tokens'] = options['max_tokens']
+        return api_params
+
+    def _completion_result(self, chat_completion) -> ModelResult:
+        """Texto, uso de tokens y motivo de fin de una respuesta compatible con OpenAI."""
+        choice = chat_completion.choices[0]
+        usage = chat_completion.usage
+        return self._result(choice.message.content, getattr(usage, 'prompt_tokens', None),
+                            getattr(usage, 'completion_tokens', None), choice.finish_reason)
+
+    def query(self, prompt: str, options: dict = None) -> ModelResult:
+        super().query(prompt, options)
+        if self.initialization_error: return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+
+        try:
+            chat_completion = self.client.chat.completions.create(**self._build_api_params(prompt, options))
+            logger.info(f"Respuesta recibida de {self.name}.")
+            return self._completion_result(chat_completion)
+        except Exception as e:
+            error_message = f"Error al consultar la API de Groq ({self.name}): {e}"
+            logger.error(error_message)
+            self._raise_if_retryable(e, error_message)
+            return ModelResult.failure(error_message)
+
+    async def aquery(self, prompt: str, options: dict = None) -> ModelResult:
+        super().query(prompt, options)
+        if self.initialization_error: return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+
+        try:
+            chat_completion = await self.async_client.chat.completions.create(**self._build_api_params(prompt, options))
+            logger.info(f"Respuesta recibida de {self.name}.")
+            return self._completion_result(chat_completion)
+        except Exception as e:
+            error_message = f"Error al consultar la API de Groq ({self.name}): {e}"
+            logger.error(error_message)
+            self._raise_if_retryable(e, error_message)
+            return ModelResult.failure(error_message)
+
+    def query_stream(self, prompt: str, options: dict = None):
+        """Transmite la respuesta de Groq fragmento a fragmento."""
+        super().query(prompt, options)
+        if self.initialization_error:
+            yield ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+            return
+
+        try:
+            stream = self.client.chat.completions.create(**self._build_api_params(prompt, options),
+                                                         stream=True)
+            # Groq informa del uso de tokens en el campo x_groq del último fragmento.
+            usage = finish_reason = None
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                usage = getattr(getattr(chunk, 'x_groq', None), 'usage', None) or usage
+            logger.info(f"Streaming completado para {self.name}.")
+            yield self._result('', getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None),
+                               finish_reason)
+        except Exception as e:
+            error_message = f"Error al consultar la API de Groq ({self.name}): {e}"
+            logger.error(error_message)
+            self._raise_if_retryable(e, error_message)
+            yield ModelResult.failure(error_message)
@@ -1,9 +1,43 @@
 # ai_models/mistral.py
 import os
+import httpx
 # Usamos MistralClient porque es la clase correcta para la versión 0.4.2 de la librería
 from mistralai.client import MistralClient
+from mistralai.async_client import MistralAsyncClient
+from mistralai.client_base import ClientBase
+from mistralai.constants import ENDPOINT
+from mistralai.files import FilesAsyncClient
+from mistralai.jobs import JobsAsyncClient
 from mistralai.models.chat_completion import ChatMessage
-from .base_model import AIModel, logger
+from .base_model import AIModel, ModelResult, ERROR_CONFIG, logger, to_messages
+
+class _PooledMistralClient(MistralClient):
+    """
+    MistralClient sobre un cliente httpx compartido. La versión 0.4 del SDK no acepta uno
+    propio, así que se sustituye el que crea (aún sin conexiones).
+    """
+
+    def __init__(self, http_client, **kwargs):
+        super().__init__(**kwargs)
+        self._client.close()
+        self._client = http_client
+
+    def __del__(self):
+        # El cliente compartido lo cierra services.http_pool cuando lo suelta el último conector.
+        pass
+
+class _PooledMistralAsyncClient(MistralAsyncClient):
+    """
+    Versión asíncrona de `_PooledMistralClient`. El `AsyncClient` que crea el SDK solo se
+    cierra con `await`, así que no se llega a crear: se repite su constructor con el cliente
+    compartido en su lugar.
+    """
+
+    def __init__(self, http_client, api_key=None, endpoint=ENDPOINT, max_retries=5, timeout=120):
+        ClientBase.__init__(self, endpoint, api_key, max_retries, timeout)
+        self._client = http_client
+        self.files = FilesAsyncClient(self)
+        self.jobs = JobsAsyncClient(self)
 
 class MistralModel(AIModel):
     """
@@ -25,36 +59,111 @@ class MistralModel(AIModel):
             raise ValueError(f"La variable de entorno '{api_key_env_var}' no está configurada.")
         
         # Usamos la clase MistralClient
-        self.client = MistralClient(api_key=api_key)
+        # 'base_url' (opcional) apunta el conector a otra URL, p. ej. el proveedor simulado de benchmarks/.
+        # Los reintentos los hace services.provider_limits; los del SDK se sumarían a los suyos.
+        endpoint = self.config.get('base_url') or ENDPOINT
+        shared_client = self._shared_http_client(endpoint, httpx.Client)
+        if shared_client is None:
+            self.client = MistralClient(api_key=api_key, max_retries=0, endpoint=endpoint)
+            self.async_client = MistralAsyncClient(api_key=api_key, max_retries=0, endpoint=endpoint)
+        else:
+            # Conexiones compartidas con los demás conectores del mismo host (services.http_pool).
+            self.client = _PooledMistralClient(shared_client, api_key=api_key, max_retries=0, endpoint=endpoint)
+            self.async_client = _PooledMistralAsyncClient(self._shared_http_client(endpoint, httpx.AsyncClient),
+                                                          api_key=api_key, max_retries=0, endpoint=endpoint)
+
+    def warmup(self):
+        """Abre la conexión con una consulta de metadatos que no consume tokens."""
+        if not self.initialization_error:
+            self.client.list_models()
 
-    def query(self, prompt: str, options: dict = None) -> str:
+    def _build_api_params(self, prompt: str, options: dict = None) -> dict:
+        """Construye los parámetros de la llamada a partir de las opciones genéricas."""
+        # En esta versión, sí es necesario usar ChatMessage
+        messages = [ChatMessage(role=m['role'], content=m['content']) for m in to_messages(prompt)]
+
+        api_params = {
+            'model': self.config['model_name_api'],
+            'messages': messages
+        }
+        if options:
+            if 'temperature' in options:
+                api_params['temperature'] = min(max(options['temperature'], 0.0), 1.0)
+            if 'max_tokens' in options:
+                api_params['max_tokens'] = options['max_tokens']
+        return api_params
+
+    def _chat_result(self, chat_response) -> ModelResult:
+        """Texto, uso de tokens y motivo de fin de una respuesta de Mistral."""
+        choice = chat_response.choices[0]
+        usage = chat_response.usage
+        return self._result(choice.message.content, getattr(usage, 'prompt_tokens', None),
+                            getattr(usage, 'completion_tokens', None), choice.finish_reason)
+
+    def query(self, prompt: str, options: dict = None) -> ModelResult:
         """
         Envía un prompt a la API de Mistral y devuelve la respuesta.
         """
         super().query(prompt, options)
         if self.initialization_error:
-            return self.initialization_error
+            return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
             
         try:
-            # En esta versión, sí es necesario usar ChatMessage
-            messages = [ChatMessage(role="user", content=prompt)]
-
-            api_params = {
-                'model': self.config['model_name_api'],
-                'messages': messages
-            }
-            if options:
-                if 'temperature' in options:
-                    api_params['temperature'] = min(max(options['temperature'], 0.0), 1.0)
-                if 'max_tokens' in options:
-                    api_params['max_tokens'] = options['max_tokens']
-            
-            chat_response = self.client.chat(**api_params)
+            chat_response = self.client.chat(**self._build_api_params(prompt, options))
             
             logger.info(f"Respuesta recibida de {self.name}.")
-            return chat_response.choices[0].message.content
+            return self._chat_result(chat_response)
+
+        except Exception as e:
+            error_message = f"Error al consultar la API de Mistral ({self.name}): {str(e)}"
+            logger.error(error_message)
+            self._raise_if_retryable(e, error_message)
+            return ModelResult.failure(error_message)
+
+    async def aquery(self, prompt: str, options: dict = None) -> ModelResult:
+        """
+        Versión asíncrona de `query()` usando `MistralAsyncClient`.
+        """
+        super().query(prompt, options)
+        if self.initialization_error:
+            return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+
+        try:
+            chat_response = await self.async_client.chat(**self._build_api_params(prompt, options))
+
+            logger.info(f"Respuesta recibida de {self.name}.")
+            return self._chat_result(chat_response)
+
+        except Exception as e:
+            error_message = f"Error al consultar la API de Mistral ({self.name}): {str(e)}"
+            logger.error(error_message)
+            self._raise_if_retryable(e, error_message)
+            return ModelResult.failure(error_message)
+
+    def query_stream(self, prompt: str, options: dict = None):
+        """
+        Transmite la respuesta de Mistral fragmento a fragmento con `chat_stream`.
+        """
+        super().query(prompt, options)
+        if self.initialization_error:
+            yield ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+            return
+
+        try:
+            # El último fragmento trae el uso de tokens y el motivo de fin.
+            usage = finish_reason = None
+            for chunk in self.client.chat_stream(**self._build_api_params(prompt, options)):
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                usage = chunk.usage or usage
+            logger.info(f"Streaming completado para {self.name}.")
+            yield self._result('', getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None),
+                               finish_reason)
 
         except Exception as e:
             error_message = f"Error al consultar la API de Mistral ({self.name}): {str(e)}"
             logger.error(error_message)
-            return error_message
+            self._raise_if_retryable(e, error_message)
+            yield ModelResult.failure(error_message)
@@ -1,45 +1,180 @@
 # ai_models/mock.py
 import time
-from .base_model import AIModel, logger
+import math
+import random
+import asyncio
+from .base_model import AIModel, ModelResult, ERROR_CONFIG, estimate_tokens, logger, prompt_text
+
+# Distribuciones de latencia admitidas en 'latency_distribution'.
+LATENCY_DISTRIBUTIONS = ('fixed', 'normal', 'longtail')
+
+# Valores por defecto: reproducen el comportamiento original (2 s fijos, primer token a los 0,2 s).
+MOCK_DEFAULTS = {
+    'latency_distribution': 'fixed',
+    'latency_sec': 2.0,        # fija, media (normal) o mediana (longtail)
+    'latency_stddev': 0.5,     # desviación típica de 'normal'
+    'latency_sigma': 1.0,      # sigma de la lognormal de 'longtail' (más alto = cola más larga)
+    'first_token_sec': 0.2,    # solo streaming
+    'error_rate': 0.0,         # fracción de llamadas que fallan
+    'error_status': 500,       # código HTTP simulado (429/5xx se reintentan como los reales)
+    'timeout_rate': 0.0,       # fracción de llamadas que se quedan colgadas
+    'timeout_sec': 300.0,      # cuánto se quedan colgadas
+    'response_chars': None,    # tamaño de la respuesta (None = texto corto por defecto)
+    'seed': None,
+}
+
+_FILLER = " Texto de relleno para simular una respuesta larga."
+
+class _SimulatedProviderError(Exception):
+    """Error simulado con código HTTP, tratado igual que el de un SDK real."""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
 
 class MockModel(AIModel):
     """
     Un modelo de IA falso para fines de desarrollo y pruebas.
+
+    Se configura desde su entrada de models.json (ver `MOCK_DEFAULTS`): distribución de
+    latencia, tasas de error y de timeout y tamaño de la respuesta, de modo que sirve
+    para medir la sobrecarga de la propia aplicación y su comportamiento bajo carga.
     """
 
     def _validate_config(self):
         """
-        No se necesita una validación especial para el modelo mock.
+        Comprueba los parámetros de simulación opcionales.
         """
         super()._validate_config()
+        self.settings = settings = {**MOCK_DEFAULTS, **{k: v for k, v in self.config.items() if k in MOCK_DEFAULTS}}
+        if settings['latency_distribution'] not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"'latency_distribution' debe ser una de {LATENCY_DISTRIBUTIONS}.")
+        for key in ('latency_sec', 'latency_stddev', 'latency_sigma', 'first_token_sec', 'timeout_sec'):
+            if not isinstance(settings[key], (int, float)) or settings[key] < 0:
+                raise ValueError(f"'{key}' debe ser un número no negativo.")
+        for key in ('error_rate', 'timeout_rate'):
+            if not isinstance(settings[key], (int, float)) or not 0 <= settings[key] <= 1:
+                raise ValueError(f"'{key}' debe estar entre 0 y 1.")
+        if settings['error_rate'] + settings['timeout_rate'] > 1:
+            raise ValueError("'error_rate' + 'timeout_rate' no puede superar 1.")
+        if settings['response_chars'] is not None and (not isinstance(settings['response_chars'], int)
+                                                       or settings['response_chars'] <= 0):
+            raise ValueError("'response_chars' debe ser un entero positivo.")
 
     def _initialize_model(self):
         """
-        No se requiere inicialización para el modelo mock.
+        No hay cliente que preparar: solo el generador aleatorio de la simulación.
         """
-        pass
+        self._random = random.Random(self.settings['seed'])
 
     # CORRECCIÓN AQUÍ: Añadimos `options: dict = None` para que acepte los nuevos parámetros
-    def query(self, prompt: str, options: dict = None) -> str:
+    def query(self, prompt: str, options: dict = None) -> ModelResult:
         """
         Simula una llamada a una API de IA.
         """
         # La llamada a super() ahora necesita los `options`
-        super().query(prompt, options) 
+        super().query(prompt, options)
         if self.initialization_error:
-            return self.initialization_error
+            return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
 
-        logger.info(f"Mock AI recibiendo prompt: '{prompt[:30]}...' con opciones: {options}")
+        logger.info(f"Mock AI recibiendo prompt: '{prompt_text(prompt)[:30]}...' con opciones: {options}")
 
         # Simulamos un retraso como si fuera una llamada de red real
-        time.sleep(2)
+        outcome, delay = self._plan()
+        time.sleep(delay)
+
+        logger.info("Mock AI devolviendo respuesta.")
+        return self._finish(prompt, outcome)
+
+    async def aquery(self, prompt: str, options: dict = None) -> ModelResult:
+        """
+        Versión asíncrona: el retraso simulado no ocupa ningún hilo.
+        """
+        super().query(prompt, options)
+        if self.initialization_error:
+            return ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+
+        outcome, delay = self._plan()
+        await asyncio.sleep(delay)
+
+        logger.info("Mock AI devolviendo respuesta.")
+        return self._finish(prompt, outcome)
+
+    def query_stream(self, prompt: str, options: dict = None):
+        """
+        Simula una respuesta en streaming: un primer token rápido y luego
+        el resto del texto palabra a palabra hasta completar la latencia simulada.
+        """
+        super().query(prompt, options)
+        if self.initialization_error:
+            yield ModelResult.failure(self.initialization_error, ERROR_CONFIG)
+            return
+
+        outcome, delay = self._plan()
+        if outcome != 'ok':
+            # Los errores llegan antes del primer fragmento, como un 5xx real.
+            time.sleep(delay)
+            yield self._finish(prompt, outcome)
+            return
+
+        start = time.time()
+        first_token = min(self.settings['first_token_sec'], delay)
+        response = self._build_response(prompt)
+        words = response.split(' ')
+        chunk_delay = (delay - first_token) / max(len(words) - 1, 1)
+        for i, word in enumerate(words):
+            # Se duerme hasta el instante previsto del fragmento para no acumular error con muchos fragmentos.
+            remaining = start + first_token + i * chunk_delay - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+            yield word if i == 0 else ' ' + word
 
+        logger.info("Mock AI streaming completado.")
+        yield self._mock_result(prompt, response, text='')
+
+    def _plan(self):
+        """Decide el desenlace de una llamada: ('ok' | 'error' | 'timeout', segundos de espera)."""
+        roll = self._random.random()
+        if roll < self.settings['timeout_rate']:
+            return 'timeout', self.settings['timeout_sec']
+        outcome = 'error' if roll < self.settings['timeout_rate'] + self.settings['error_rate'] else 'ok'
+        return outcome, self._sample_latency()
+
+    def _sample_latency(self) -> float:
+        latency = self.settings['latency_sec']
+        distribution = self.settings['latency_distribution']
+        if distribution == 'normal':
+            return max(0.0, self._random.gauss(latency, self.settings['latency_stddev']))
+        if distribution == 'longtail' and latency > 0:
+            # Lognormal con mediana `latency_sec`: casi todas rápidas y unas pocas muy lentas.
+            return self._random.lognormvariate(math.log(latency), self.settings['latency_sigma'])
+        return latency
+
+    def _finish(self, prompt: str, outcome: str) -> ModelResult:
+        """Resultado de la llamada simulada; los errores pasan por el mismo camino que los de un SDK."""
+        if outcome == 'error':
+            error_message = f"Error simulado de {self.name} (HTTP {self.settings['error_status']})."
+            logger.error(error_message)
+            self._raise_if_retryable(_SimulatedProviderError(error_message, self.settings['error_status']),
+                                     error_message)
+            return ModelResult.failure(error_message)
+        return self._mock_result(prompt, self._build_response(prompt))
+
+    def _mock_result(self, prompt: str, response: str, text: str = None) -> ModelResult:
+        """Uso de tokens estimado, para que las métricas de rendimiento tengan datos en pruebas."""
+        return self._result(response if text is None else text, estimate_tokens(prompt),
+                            estimate_tokens(response), 'stop')
+
+    def _build_response(self, prompt: str) -> str:
         response = (
             f"Soy {self.name}, un modelo de prueba. "
             "He recibido tu prompt que empezaba con:\n\n"
-            f"'{prompt[:100]}...'\n\n"
+            f"'{prompt_text(prompt)[:100]}...'\n\n"
             "Mi única función es devolver este texto para verificar que la aplicación funciona correctamente."
         )
-
-        logger.info("Mock AI devolviendo respuesta.")
-        return response
+        size = self.settings['response_chars']
+        if size is None:
+            return response
+        if len(response) < size:
+            response += _FILLER * ((size - len(response)) // len(_FILLER) + 1)
+        return response[:size]
@@ -0,0 +1,80 @@
+# analytics_report.py
+# Informe de analítica sobre el histórico de comparaciones guardado en results/.
+#
+# Lee todos los registros del modo Comparar (también las salidas de batch_runner.py bajo
+# results/) y calcula, de forma vectorizada, la similitud entre las respuestas de cada
+# comparación, las proporciones de longitud y latencia y los grupos de acuerdo. Resume por
+# modelo (tasa de acuerdo con la mayoría y de respuestas aisladas) y por par de modelos.
+#
+# Uso:
+#   python analytics_report.py --results-dir results --threshold 0.5 -o informe.json
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+from services.analytics import DEFAULT_AGREEMENT_THRESHOLD, ResponseBatch, history_report
+from services.history_index import iter_result_records
+
+
+def load_batch(results_dir, since=None, models=None):
+    """Lee los registros de Comparar de `results_dir` en un `ResponseBatch`."""
+    batch = ResponseBatch()
+    for record in iter_result_records(results_dir):
+        if since and str(record.get('timestamp', '')) < since:
+            continue
+        batch.add_record(record, models)
+    return batch
+
+
+def print_report(report, file=sys.stdout):
+    print(f"Comparaciones: {report['comparisons']}  Respuestas: {report['responses']}  "
+          f"Umbral de acuerdo: {report['threshold']}  Consenso medio: {report['mean_consensus']}", file=file)
+    print(file=file)
+    print(f"{'Modelo':<32} {'Resp.':>7} {'Long.':>7} {'Lat.':>7} {'Acuerdo':>8} {'Aislada':>8}", file=file)
+    for name, stats in sorted(report['models'].items()):
+        print(f"{name[:32]:<32} {stats['responses']:>7} {_fmt(stats['mean_length_ratio']):>7} "
+              f"{_fmt(stats['mean_latency_ratio']):>7} {_fmt(stats['agreement_rate']):>8} "
+              f"{_fmt(stats['outlier_rate']):>8}", file=file)
+    print(file=file)
+    print(f"{'Par de modelos':<58} {'Comp.':>7} {'Simil.':>7} {'Acuerdo':>8}", file=file)
+    for pair in report['pairs']:
+        names = ' / '.join(pair['models'])
+        print(f"{names[:58]:<58} {pair['comparisons']:>7} {_fmt(pair['mean_similarity']):>7} "
+              f"{_fmt(pair['agreement_rate']):>8}", file=file)
+
+
+def _fmt(value):
+    return '-' if value is None else f"{value:.3f}"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analítica de similitud y acuerdo sobre el histórico de comparaciones.")
+    parser.add_argument('--results-dir', default='results', help="Directorio de resultados.")
+    parser.add_argument('--threshold', type=float,
+                        default=float(os.getenv('ANALYTICS_AGREEMENT_THRESHOLD', DEFAULT_AGREEMENT_THRESHOLD)),
+                        help="Similitud coseno mínima para considerar que dos respuestas coinciden.")
+    parser.add_argument('--since', help="Solo registros con timestamp igual o posterior (ej: 2024-05-01).")
+    parser.add_argument('--models', help="Limitar a estos modelos, separados por comas.")
+    parser.add_argument('-o', '--output', help="Guardar además el informe completo en JSON.")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    args = parse_args()
+    started = time.perf_counter()
+    models = {name.strip() for name in args.models.split(',')} if args.models else None
+    batch = load_batch(args.results_dir, args.since, models)
+    loaded = time.perf_counter()
+    report = history_report(batch, args.threshold)
+    report['timings'] = {'load_sec': round(loaded - started, 3), 'analyze_sec': round(time.perf_counter() - loaded, 3)}
+    print_report(report)
+    print(f"\nLectura: {report['timings']['load_sec']} s  Análisis: {report['timings']['analyze_sec']} s")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -1,22 +1,48 @@
 # app.py
+import time
+_BOOT_START = time.perf_counter()  # coste de las importaciones de la aplicación (se registra al arrancar)
 import os
 import json
 import logging
 import threading
-import time
+import queue
+import atexit
+import signal
+import socket
+import sys
+import asyncio
 from datetime import datetime
-from collections import defaultdict
-from importlib import import_module
-from functools import lru_cache, wraps
-from flask import Flask, render_template, request, jsonify, Response
+from functools import wraps
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g, send_file
 from dotenv import load_dotenv
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 import concurrent.futures
-from werkzeug.security import check_password_hash
 from waitress import serve
 # MODIFICADO: Importaciones de Babel y request
 from flask_babel import Babel, _
+from ai_models.base_model import (AIModel, ModelResult, ProviderError, ERROR_INTERNAL, ERROR_PROVIDER, ERROR_TIMEOUT,
+                                  ERROR_UNAVAILABLE, prompt_text)
+from services.auth import CredentialStore
+from services.executor import ModelCallExecutor, PoolSaturatedError
+from services.async_runtime import AsyncRuntime
+from services.response_cache import ResponseCache, is_cacheable, make_cache_key
+from services.semantic_cache import DEFAULT_SEMANTIC_THRESHOLD, SemanticCache, semantic_scope, semantic_threshold
+from services.model_registry import ModelRegistry
+from services.metrics import Metrics
+from services.tracing import Tracer
+from services.results_store import ResultsStore
+from services.history_index import HistoryIndex
+from services.provider_limits import ProviderLimits, ProviderUnavailableError, estimate_request_tokens, provider_name
+from services.comparisons import ComparisonTracker
+from services.analytics import comparison_analytics
+from services.conversation_context import ConversationContext, context_settings
+from services.http_pool import HTTPPools
+from services.singleflight import SingleFlight, should_coalesce
+from services.jobs import JobQueue, JobQueueFull, JobCancelled, JobLost
+from services.sweeps import SweepScheduler, expand_grid, read_sweep, summarize, sweep_grid, sweep_row, write_sweep
+from services.rate_limit_storage import SQLiteStorage  # registra el esquema sqlite:// en limits
+from services.workers import WORKER_FD_ENV, WORKER_ID_ENV, WorkerBoard, WorkerSupervisor
 
 # --- Configuración Inicial ---
 load_dotenv()
@@ -46,32 +72,48 @@ babel = Babel(app, locale_selector=get_locale)
 logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
+logger.info(f"Importaciones de la aplicación: {time.perf_counter() - _BOOT_START:.2f} s "
+            "(los SDK de los proveedores se importan al precalentar).")
+
+# --- Modo multiproceso ---
+# Con WEB_WORKERS > 1, `python app.py` hace de supervisor: abre el puerto y lanza ese número de
+# procesos trabajadores (este mismo script) que lo comparten. Cada trabajador precalienta sus
+# propios clientes; métricas y límites de peticiones se comparten mediante SQLite locales.
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', 1))
+WORKER_ID = os.getenv(WORKER_ID_ENV)
+WORKER_STATE_PATH = os.getenv('WORKER_STATE_PATH', 'cache/workers.sqlite3')
+if __name__ == '__main__' and WEB_WORKERS > 1 and WORKER_ID is None:
+    WorkerBoard.reset(WORKER_STATE_PATH)
+    supervisor = WorkerSupervisor(WEB_WORKERS, host='0.0.0.0', port=int(os.getenv('PORT', 3556)))
+    sys.exit(supervisor.run())
 
 # Configurar Rate Limiting
+# RATELIMIT_ENABLED=false solo para pruebas de carga (ver benchmarks/).
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() != 'false'
+# En memoria con un solo proceso; con trabajadores, un SQLite local compartido por todos.
+# RATELIMIT_STORAGE_URI admite cualquier backend de `limits` (p. ej. redis://...).
 limiter = Limiter(
     app=app,
     key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"]
+    default_limits=["200 per day", "50 per hour"],
+    storage_uri=os.getenv('RATELIMIT_STORAGE_URI') or (
+        f"sqlite:///{os.getenv('RATELIMIT_SQLITE_PATH', 'cache/ratelimit.sqlite3')}"
+        if WORKER_ID is not None else 'memory://')
 )
 
 # --- LÓGICA DE AUTENTICACIÓN ---
 
-def load_users():
-    """Carga los usuarios desde users.json."""
-    try:
-        with open('users.json', 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        logger.error("Error: 'users.json' no encontrado o con formato incorrecto. La autenticación no funcionará.")
-        return {}
-
-USERS = load_users()
+# users.json se recarga en caliente; las credenciales ya verificadas se cachean (HMAC) durante AUTH_CACHE_TTL.
+credential_store = CredentialStore(
+    path='users.json',
+    reload_interval=float(os.getenv('USERS_RELOAD_INTERVAL', 2)),
+    cache_ttl=int(os.getenv('AUTH_CACHE_TTL', 300))
+)
+credential_store.start_watching()
 
 def check_auth(username, password):
     """Verifica si un usuario y contraseña son válidos."""
-    if username in USERS and check_password_hash(USERS.get(username), password):
-        return True
-    return False
+    return credential_store.check(username, password)
 
 def authenticate():
     """Respuesta para cuando se requiere autenticación."""
@@ -85,7 +127,9 @@ def login_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         auth = request.authorization
-        if not auth or not check_auth(auth.username, auth.password):
+        with tracer.span('auth.check'):
+            authorized = auth is not None and check_auth(auth.username, auth.password)
+        if not authorized:
             #Registra el intento de login fallido con la ip atacante
             logger.warning(f"Failed login attempt for user '{auth.username if auth else 'None'}' from IP: {get_remote_address()}")
             return authenticate()
@@ -99,96 +143,970 @@ def login_required(f):
 # ...
 
 # --- Sistema de Métricas ---
-class Metrics:
-    def __init__(self):
-        self.response_times = defaultdict(list)
-        self.error_count = defaultdict(int)
-        self.total_requests = 0
-    
-    def record_request(self):
-        self.total_requests += 1
+metrics = Metrics(refresh_interval=float(os.getenv('METRICS_REFRESH_INTERVAL', 1)))
+metrics.start()
 
-    def record_response_time(self, model_name, response_time):
-        self.response_times[model_name].append(response_time)
-    
-    def record_error(self, model_name):
-        self.error_count[model_name] += 1
+@app.before_request
+def track_request_start():
+    """Marca el inicio de la petición para la latencia por ruta y el indicador de peticiones en curso."""
+    g.request_start_time = time.time()
+    metrics.request_started()
+
+@app.teardown_request
+def track_request_end(exc=None):
+    start_time = g.pop('request_start_time', None)
+    if start_time is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.request_finished(route, time.time() - start_time)
+
+# --- Trazas por petición ---
+# Con TRACE_SAMPLE_RATE > 0 se traza esa fracción de peticiones: árbol de spans con tiempos e
+# hilos, exportado en JSON OTLP a TRACE_FILE (rotado) y con las más lentas en /debug/slow.
+tracer = Tracer(
+    sample_rate=float(os.getenv('TRACE_SAMPLE_RATE', 0)),
+    slow_keep=int(os.getenv('TRACE_SLOW_KEEP', 20)),
+    path=os.getenv('TRACE_FILE', 'logs/traces.jsonl'),
+    max_bytes=int(os.getenv('TRACE_FILE_MAX_BYTES', 10 * 1024 * 1024)),
+    backups=int(os.getenv('TRACE_FILE_BACKUPS', 5))
+)
+atexit.register(tracer.close)
+
+@app.before_request
+def start_request_trace():
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.trace = tracer.start_trace(f"{request.method} {route}",
+                                 {'http.request.method': request.method, 'http.route': route})
+
+@app.after_request
+def record_trace_status(response):
+    root = g.get('trace')
+    if root is not None:
+        root.set_attribute('http.response.status_code', response.status_code)
+        if response.is_streamed:
+            # En streaming (SSE) la petición dura hasta que se envía el último evento.
+            g.pop('trace')
+            response.call_on_close(lambda: tracer.finish_trace(root))
+    return response
+
+@app.teardown_request
+def finish_request_trace(exc=None):
+    root = g.pop('trace', None)
+    if root is not None:
+        tracer.finish_trace(root)
+
+# --- Pool compartido para las llamadas a los proveedores ---
+# Un único pool acotado para todas las peticiones, en lugar de un ThreadPoolExecutor por llamada.
+model_executor = ModelCallExecutor(
+    max_workers=int(os.getenv('MODEL_POOL_MAX_WORKERS', 32)),
+    max_queue=int(os.getenv('MODEL_POOL_MAX_QUEUE', 256))
+)
+
+# Bucle de eventos compartido para la ruta asíncrona (una corrutina por llamada, no un hilo).
+async_runtime = AsyncRuntime()
+
+# --- Agrupación de llamadas idénticas ---
+# Las llamadas concurrentes con el mismo modelo, prompt y opciones comparten una sola consulta
+# al proveedor (clave 'coalesce' de cada modelo en models.json y options.coalesce).
+coalescer = SingleFlight()
+coalescer.on_orphaned = lambda future: model_executor.abandon(future, count_timeout=False)
+
+# --- Caché de respuestas ---
+# Solo se usa con opciones deterministas (temperature == 0) o si el llamante envía options.cache = true.
+response_cache = ResponseCache(
+    path=os.getenv('RESPONSE_CACHE_PATH', 'cache/response_cache.sqlite3'),
+    max_entries=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1000)),
+    max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    ttl=int(os.getenv('RESPONSE_CACHE_TTL', 86400))
+)
+
+# Caché semántica: tras un fallo exacto, sirve la respuesta de un prompt casi idéntico (espacios,
+# mayúsculas, puntuación o retoques menores) del mismo modelo y opciones. Es opcional: clave
+# 'semantic_cache' de cada modelo en models.json u options.semantic_cache, y solo en llamadas cacheables.
+semantic_cache = SemanticCache(
+    path=os.getenv('SEMANTIC_CACHE_PATH', 'cache/semantic_cache.npz'),
+    max_entries=int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 10000)),
+    ttl=int(os.getenv('SEMANTIC_CACHE_TTL', 86400)),
+    save_interval=float(os.getenv('SEMANTIC_CACHE_SAVE_INTERVAL', 30))
+)
+semantic_cache.start()
+atexit.register(semantic_cache.close)
+semantic_cache_threshold = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', DEFAULT_SEMANTIC_THRESHOLD))
+
+# --- Conexiones HTTP compartidas ---
+# Los conectores que apuntan al mismo host comparten un cliente httpx (keep-alive, límites y
+# timeouts según 'transport' en la sección 'providers' de models.json).
+http_pools = HTTPPools()
+AIModel.http_pools = http_pools
+
+# --- Registro de modelos ---
+# models.json se parsea una sola vez y se recarga en caliente si cambia su mtime/inode.
+model_registry = ModelRegistry(
+    path='models.json',
+    reload_interval=float(os.getenv('MODELS_RELOAD_INTERVAL', 2))
+)
+model_registry.on_instance_closed = lambda instance: async_runtime.submit(instance.aclose())
+model_registry.start_watching()
+
+# --- Precalentamiento ---
+# Importa e inicializa en segundo plano los conectores de los modelos activos sin bloquear el arranque;
+# /ready responde 503 hasta que termina. Los conectores desactivados no se llegan a importar.
+if os.getenv('PREWARM_MODELS', 'true').lower() != 'false':
+    model_registry.prewarm(
+        max_workers=int(os.getenv('PREWARM_WORKERS', 8)),
+        warm_connections=os.getenv('PREWARM_CONNECTIONS', 'false').lower() == 'true'
+    )
+
+# --- Límites por proveedor ---
+# Llamadas en curso, RPM/TPM, reintentos y circuit breaker según la sección 'providers' de models.json.
+provider_limits = ProviderLimits()
+
+# --- Almacén de resultados ---
+# Escritura diferida en segmentos JSONL rotados bajo results/; la petición solo encola.
+results_store = ResultsStore(
+    base_dir='results',
+    max_segment_bytes=int(os.getenv('RESULTS_SEGMENT_MAX_BYTES', 64 * 1024 * 1024)),
+    max_segment_age=int(os.getenv('RESULTS_SEGMENT_MAX_AGE', 3600)),
+    compression=os.getenv('RESULTS_COMPRESSION') or None,
+    fsync=os.getenv('RESULTS_FSYNC', 'never'),
+    max_queue=int(os.getenv('RESULTS_QUEUE_SIZE', 10000))
+)
+atexit.register(results_store.close)
+
+# --- Índice del histórico ---
+# SQLite + FTS5 sobre results/: se completa en segundo plano y se actualiza con cada registro escrito.
+history_index = HistoryIndex(path=os.getenv('HISTORY_INDEX_PATH', 'cache/history.sqlite3'), results_dir='results')
+results_store.listeners.append(history_index.add_record)
+# Con WEB_WORKERS todos comparten el fichero: solo el trabajador 0 recorre results/ (si se
+# reinicia, retoma donde lo dejó); los demás indexan solo lo que escriben.
+if WORKER_ID in (None, '0'):
+    history_index.start_backfill()
+
+# --- Comparaciones parciales ---
+# Con options.deadline_ms / options.first_k, /compare responde antes y los modelos rezagados
+# se recogen en segundo plano bajo un id de comparación. Su estado se guarda en COMPARE_STATE_PATH
+# para que cualquier trabajador responda a GET /compare/<id>.
+comparison_tracker = ComparisonTracker(
+    path=os.getenv('COMPARE_STATE_PATH', 'cache/comparisons.sqlite3'),
+    retention=int(os.getenv('COMPARE_RETENTION', 600)),
+    max_entries=int(os.getenv('COMPARE_MAX_TRACKED', 1000))
+)
 
-metrics = Metrics()
+# --- Analítica de respuestas ---
+# Con options.analytics, Comparar añade '_analytics': similitud entre respuestas, proporciones
+# de longitud y latencia y grupos de acuerdo (analytics_report.py hace lo mismo sobre results/).
+analytics_threshold = float(os.getenv('ANALYTICS_AGREEMENT_THRESHOLD', 0.5))
+
+# --- Contexto del modo Conversación ---
+# Presupuesto de tokens de entrada por salto y estrategia de recorte; options.context los ajusta por petición.
+conversation_context_defaults = context_settings({
+    'strategy': os.getenv('CONVERSATION_CONTEXT_STRATEGY', 'truncate'),
+    'max_tokens': int(os.getenv('CONVERSATION_MAX_CONTEXT_TOKENS', 4000)),
+    'turns': int(os.getenv('CONVERSATION_CONTEXT_TURNS', 2)),
+})
 
 # --- Funciones de Ayuda ---
 
-def save_results(prompt, results, mode):
-    """Guarda el prompt y los resultados en un fichero JSON."""
+def save_results(prompt, results, mode, record_id=None):
+    """
+    Encola el prompt y los resultados en el almacén de resultados.
+    En el modo Comparar `results` es {modelo: ModelResult}: se guarda el texto en 'results'
+    y las latencias, tokens y errores en 'details'. En Conversación es la cadena de pasos.
+    La escritura a disco la hace el hilo del almacén; la petición no espera.
+    """
+    record = {
+        'timestamp': datetime.now().isoformat(),
+        'mode': mode,
+        'initial_prompt': prompt,
+    }
+    if isinstance(results, dict):
+        record['results'] = {name: result.text for name, result in results.items()}
+        record['details'] = {name: result.meta() for name, result in results.items()}
+        cached_models = [name for name, result in results.items() if result.cached]
+        if cached_models:
+            record['cached_models'] = cached_models
+    else:
+        record['results'] = results
+    if record_id:
+        record['id'] = record_id
+    with tracer.span('results.enqueue', mode=mode):
+        return results_store.enqueue(record)
+
+def persist_comparison(comparison):
+    """Guarda una comparación parcial cuando han terminado todos sus modelos (id = id de la comparación)."""
+    save_results(comparison.prompt, comparison.results, 'compare', record_id=comparison.id)
+
+def compare_response(results, pending=None, comparison_id=None, analytics=None):
+    """
+    Cuerpo JSON del modo Comparar: {modelo: texto} más las claves reservadas '_details'
+    (latencias, tokens, motivo de fin y tipo de error), '_cached', '_analytics' si se pide
+    un umbral de acuerdo en `analytics` y, si quedan modelos por responder, '_pending' y
+    '_comparison_id'.
+    """
+    body = {name: result.text for name, result in results.items()}
+    body['_details'] = {name: result.meta() for name, result in results.items()}
+    cached_models = [name for name, result in results.items() if result.cached]
+    if cached_models:
+        body['_cached'] = cached_models
+    if analytics is not None:
+        with tracer.span('analytics', models=len(results)):
+            body['_analytics'] = comparison_analytics(results, analytics)
+    if comparison_id:
+        body['_pending'] = list(pending)
+        body['_comparison_id'] = comparison_id
+    return body
+
+def enabled_models():
+    """Configuración de los modelos activos según la instantánea vigente de models.json."""
+    with tracer.span('models.snapshot'):
+        return model_registry.snapshot().enabled_models
+
+def get_ai_instance(model_config):
+    """Devuelve la instancia del modelo gestionada por el registro."""
+    with tracer.span('models.instance', model=model_config['name']):
+        return model_registry.get_instance(model_config)
+
+def get_provider_guard(model_config):
+    """Devuelve los límites del proveedor del modelo según la configuración vigente."""
+    return provider_limits.guard_for(model_config, model_registry.snapshot().providers)
+
+def error_result(model_name, error, timeout=60):
+    """Convierte una excepción de la llamada a un modelo en un `ModelResult` de error y la registra."""
+    if isinstance(error, (asyncio.TimeoutError, concurrent.futures.TimeoutError)):
+        result = ModelResult.failure(f"Timeout al consultar {model_name} después de {timeout} segundos.",
+                                     ERROR_TIMEOUT)
+    elif isinstance(error, (ProviderUnavailableError, PoolSaturatedError)):
+        result = ModelResult.failure(f"Error en {model_name}: {error}", ERROR_UNAVAILABLE)
+    elif isinstance(error, ProviderError):
+        result = ModelResult.failure(f"Error en {model_name}: {error}", ERROR_PROVIDER)
+    else:
+        result = ModelResult.failure(f"Error en {model_name}: {error}", ERROR_INTERNAL)
+    logger.warning(result.text)
+    return result
+
+class CacheKey:
+    """Clave exacta de una llamada cacheable y, si usa la caché semántica, su ámbito y su prompt."""
+    __slots__ = ('exact', 'scope', 'prompt')
+
+    def __init__(self, exact, scope=None, prompt=None):
+        self.exact = exact
+        self.scope = scope
+        self.prompt = prompt
+
+def lookup_cached_response(model_config, prompt, options):
+    """
+    Consulta la caché de respuestas y, tras un fallo, la semántica si el modelo o la petición
+    la activan (solo con prompts de texto, no con listas de mensajes). Devuelve (clave,
+    resultado): la clave es None si la llamada no es cacheable y el resultado, un `ModelResult`
+    con `cached` (más `semantic_match` si vino de un prompt parecido) o None si no hay acierto.
+    """
+    if not is_cacheable(options):
+        return None, None
+    with tracer.span('cache.lookup', model=model_config['name']) as span:
+        cache_key = CacheKey(make_cache_key(model_config, prompt, options))
+        cached_response = response_cache.get(cache_key.exact)
+        span.set_attribute('hit', cached_response is not None)
+        if cached_response is not None:
+            return cache_key, ModelResult(cached_response, cached=True)
+        threshold = semantic_threshold(model_config, options, semantic_cache_threshold)
+        if threshold is None or not isinstance(prompt, str):
+            return cache_key, None
+        cache_key.scope, cache_key.prompt = semantic_scope(model_config, options), prompt
+        match = semantic_cache.lookup(cache_key.scope, prompt, threshold)
+        span.set_attribute('semantic_hit', match is not None)
+    if match is None:
+        return cache_key, None
+    response, matched_prompt, similarity = match
+    return cache_key, ModelResult(response, cached=True,
+                                  semantic_match={'prompt': matched_prompt, 'similarity': similarity})
+
+def store_cached_response(cache_key, result):
+    """Guarda el texto de una respuesta correcta en la caché (los errores nunca se cachean)."""
+    if cache_key and result.ok and result.text:
+        response_cache.set(cache_key.exact, result.text)
+        if cache_key.scope is not None:
+            semantic_cache.add(cache_key.scope, cache_key.prompt, result.text)
+
+def coalesce_key(model_config, prompt, options):
+    """Clave de agrupación: el modelo concreto más la misma clave que usa la caché de respuestas."""
+    return f"{model_config['name']}\0{make_cache_key(model_config, prompt, options)}"
+
+class ModelCall:
+    """Llamada a un modelo enviada al pool compartido (o servida desde la caché)."""
+    __slots__ = ('model_config', 'future', 'start_time', 'cache_key', 'cached', 'coalesced')
+
+    def __init__(self, model_config, future, start_time, cache_key=None, cached=False, coalesced=False):
+        self.model_config = model_config
+        self.future = future
+        self.start_time = start_time
+        self.cache_key = cache_key
+        self.cached = cached
+        self.coalesced = coalesced
+
+def submit_ai_model_call(model_config, prompt, options, timeout=60):
+    """
+    Envía la consulta de un modelo al pool compartido sin esperar el resultado.
+    Si la respuesta está en caché, el `ModelCall` devuelto ya está resuelto, y si hay
+    una llamada idéntica en curso que se puede compartir, se engancha a ella.
+    """
+    start_time = time.time()
+    future = concurrent.futures.Future()
     try:
-        base_dir = 'results'
-        os.makedirs(base_dir, exist_ok=True)
-        date_str = datetime.now().strftime("%Y-%m-%d")
-        date_dir = os.path.join(base_dir, date_str)
-        os.makedirs(date_dir, exist_ok=True)
-        timestamp = datetime.now().strftime("%H-%M-%S")
-        safe_prompt = "".join([c if c.isalnum() else "_" for c in prompt[:30]])
-        filename = f"{timestamp}_{mode}_{safe_prompt}.json"
-        filepath = os.path.join(date_dir, filename)
-        data_to_save = {
-            'timestamp': datetime.now().isoformat(),
-            'mode': mode,
-            'initial_prompt': prompt,
-            'results': results
-        }
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data_to_save, f, ensure_ascii=False, indent=4)
-        logger.info(f"Resultados guardados en: {filepath}")
+        cache_key, cached = lookup_cached_response(model_config, prompt, options)
+        if cached is not None:
+            cached.latency = time.time() - start_time
+            future.set_result(cached)
+            return ModelCall(model_config, future, start_time, cache_key, cached=True)
+
+        ai_instance = get_ai_instance(model_config)
+
+        if ai_instance is None:
+            raise ValueError(f"No se pudo crear la instancia del modelo {model_config['name']}.")
+
+        guard = get_provider_guard(model_config)
+
+        def start():
+            # La llamada espera hueco en su proveedor sin ocupar un hilo y solo entonces pasa al pool.
+            # En la traza: espera (proveedor y pool) y cada intento contra la API.
+            query = tracer.wrap(tracer.traced(ai_instance.query, 'provider.request'), 'model.call',
+                                queue_span='pool.queue', model=model_config['name'])
+            return guard.submit(model_executor, query, prompt, options,
+                                tokens=estimate_request_tokens(prompt, options), deadline=start_time + timeout)
+
+        if should_coalesce(model_config, options):
+            future, coalesced = coalescer.submit(coalesce_key(model_config, prompt, options), start)
+            return ModelCall(model_config, future, start_time, cache_key, coalesced=coalesced)
+        return ModelCall(model_config, start(), start_time, cache_key)
     except Exception as e:
-        logger.error(f"Error al guardar los resultados: {e}")
+        # Los errores previos al envío se entregan a través del future para tratarlos en un único sitio.
+        future.set_exception(e)
+        return ModelCall(model_config, future, start_time)
 
-def load_ai_models_config():
-    """Carga la configuración de los modelos desde models.json."""
-    try:
-        with open('models.json', 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logger.error(f"Error al cargar 'models.json': {e}")
-        return {}
-
-@lru_cache(maxsize=32)
-def get_ai_instance(module_path, class_name, model_config_tuple):
-    """Crea y devuelve una instancia de un modelo de IA cacheada."""
-    model_config = dict(model_config_tuple)
+def collect_ai_model_result(call, timeout=60):
+    """
+    Espera el `ModelResult` de una llamada enviada con `submit_ai_model_call` y registra métricas.
+    El timeout se cuenta desde el envío y, al vencer, devuelve el control de inmediato.
+    """
+    if call.cached:
+        return call.future.result()
+
+    model_name = call.model_config['name']
     try:
-        ai_module = import_module(module_path)
-        AIClass = getattr(ai_module, class_name)
-        return AIClass(model_config)
-    except (ImportError, AttributeError) as e:
-        logger.error(f"No se pudo cargar la clase {class_name} desde {module_path}: {e}")
+        result = model_executor.wait(call.future, timeout - (time.time() - call.start_time))
+        result.latency = time.time() - call.start_time
+        store_cached_response(call.cache_key, result)
+    except Exception as e:
+        result = error_result(model_name, e, timeout)
+        result.latency = time.time() - call.start_time
+    result.coalesced = call.coalesced
+    metrics.record_result(model_name, result)
+    return result
+
+def parse_partial_options(options):
+    """
+    Lee las opciones de respuesta parcial de Comparar: `deadline_ms` (presupuesto de la
+    petición) y `first_k` (responder en cuanto K modelos contesten sin error).
+    Lanza `ValueError` si no son válidas.
+    """
+    deadline_ms = options.get('deadline_ms')
+    first_k = options.get('first_k')
+    if deadline_ms is not None and (isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float))
+                                    or deadline_ms <= 0):
+        raise ValueError("La opción 'deadline_ms' debe ser un número positivo.")
+    if first_k is not None and (isinstance(first_k, bool) or not isinstance(first_k, int) or first_k <= 0):
+        raise ValueError("La opción 'first_k' debe ser un entero positivo.")
+    return deadline_ms, first_k
+
+def parse_analytics_option(options):
+    """
+    Lee `options.analytics`: true (umbral de acuerdo por defecto), false/ausente o
+    {"threshold": x} con x entre 0 y 1. Devuelve el umbral o None si no se pide.
+    Lanza `ValueError` si no es válida.
+    """
+    analytics = options.get('analytics')
+    if analytics is None or analytics is False:
         return None
+    if analytics is True:
+        return analytics_threshold
+    if isinstance(analytics, dict) and set(analytics) <= {'threshold'}:
+        threshold = analytics.get('threshold', analytics_threshold)
+        if not isinstance(threshold, bool) and isinstance(threshold, (int, float)) and 0 <= threshold <= 1:
+            return float(threshold)
+    raise ValueError("La opción 'analytics' debe ser true/false o {\"threshold\": número entre 0 y 1}.")
+
+def wait_for_responders(calls, budget, first_k=None):
+    """
+    Recoge las llamadas que terminen en `budget` segundos, o antes si ya han respondido
+    `first_k` modelos sin error. Devuelve (resultados en el orden de `calls`, llamadas pendientes).
+    """
+    by_future = {call.future: call for call in calls}
+    not_done = set(by_future)
+    responses = {}
+    answered = 0
+    end = time.time() + budget
+    while not_done and not (first_k and answered >= first_k):
+        remaining = end - time.time()
+        if remaining <= 0:
+            break
+        done, not_done = concurrent.futures.wait(not_done, timeout=remaining,
+                                                 return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            call = by_future[future]
+            responses[call.model_config['name']] = collect_ai_model_result(call)
+            if responses[call.model_config['name']].ok:
+                answered += 1
+    results = {call.model_config['name']: responses[call.model_config['name']]
+               for call in calls if call.model_config['name'] in responses}
+    return results, [by_future[future] for future in by_future if future in not_done]
+
+def expire_straggler(model_name, call, timeout=60):
+    """Da por agotada una llamada rezagada que nadie ha recogido dentro de su plazo."""
+    model_executor.abandon(call.future)
+    result = error_result(model_name, concurrent.futures.TimeoutError(), timeout)
+    result.latency = time.time() - call.start_time
+    metrics.record_result(model_name, result)
+    return result
+
+def track_stragglers(prompt, results, pending_calls, timeout=60):
+    """
+    Registra las llamadas que no respondieron a tiempo: siguen en el pool, su respuesta se
+    anota en cuanto llega y la comparación completa se persiste al terminar. Devuelve su id.
+    """
+    comparison_id = comparison_tracker.start(
+        prompt, results,
+        pending={call.model_config['name']: call for call in pending_calls},
+        expires_at=max(call.start_time for call in pending_calls) + timeout,
+        on_expire=expire_straggler,
+        on_complete=persist_comparison)
+
+    def on_done(future, call):
+        # Si `expire_straggler` ya la dio por agotada (abandonarla no detiene el hilo), su respuesta
+        # tardía no se recoge: contaría dos veces en las métricas.
+        if comparison_tracker.claim(comparison_id, call.model_config['name']):
+            comparison_tracker.resolve(comparison_id, call.model_config['name'], collect_ai_model_result(call))
+
+    for call in pending_calls:
+        call.future.add_done_callback(lambda future, call=call: on_done(future, call))
+    return comparison_id
 
 def call_ai_model_with_timeout(model_config, prompt, options, timeout=60):
-    """Llama a un modelo de IA con timeout y registra métricas."""
+    """Llama a un modelo de IA con timeout y registra métricas. Devuelve un `ModelResult`."""
+    return collect_ai_model_result(submit_ai_model_call(model_config, prompt, options, timeout), timeout)
+
+async def acall_ai_model_with_timeout(model_config, prompt, options, timeout=60):
+    """Versión asíncrona de `call_ai_model_with_timeout`: el plazo cancela la corrutina."""
     start_time = time.time()
     model_name = model_config['name']
+    coalesced = False
     try:
-        config_tuple = tuple(sorted(model_config.items()))
-        ai_instance = get_ai_instance(model_config['module_path'], model_config['class_name'], config_tuple)
-        
+        cache_key, cached = lookup_cached_response(model_config, prompt, options)
+        if cached is not None:
+            cached.latency = time.time() - start_time
+            return cached
+
+        ai_instance = get_ai_instance(model_config)
+
         if ai_instance is None:
             raise ValueError(f"No se pudo crear la instancia del modelo {model_name}.")
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(ai_instance.query, prompt, options)
-            response = future.result(timeout=timeout)
-            
-        metrics.record_response_time(model_name, time.time() - start_time)
-        return response
+        guard = get_provider_guard(model_config)
+
+        def upstream():
+            return tracer.traced(guard.acall, 'model.call', model=model_name)(
+                tracer.traced(ai_instance.aquery, 'provider.request'), prompt, options,
+                tokens=estimate_request_tokens(prompt, options), deadline=start_time + timeout)
+
+        if should_coalesce(model_config, options):
+            result, coalesced = await asyncio.wait_for(
+                coalescer.run(coalesce_key(model_config, prompt, options), upstream), timeout=timeout)
+        else:
+            result = await asyncio.wait_for(upstream(), timeout=timeout)
+        result.latency = time.time() - start_time
+        store_cached_response(cache_key, result)
+
+    except Exception as e:
+        result = error_result(model_name, e, timeout)
+        result.latency = time.time() - start_time
+    result.coalesced = coalesced
+    metrics.record_result(model_name, result)
+    return result
+
+async def acompare_models(models_config, prompt, options):
+    """Consulta todos los modelos a la vez con `asyncio.gather`. Devuelve {modelo: ModelResult}."""
+    results = await asyncio.gather(
+        *(acall_ai_model_with_timeout(config, prompt, options) for config in models_config))
+    return {config['name']: result for config, result in zip(models_config, results)}
+
+async def acompare_models_partial(models_config, prompt, options, budget, first_k=None, timeout=60):
+    """
+    Variante de `acompare_models` con presupuesto de tiempo y modo "primeros K".
+    Las tareas que no terminan a tiempo siguen en el bucle y se registran como rezagadas.
+    Devuelve (resultados, id de comparación o None).
+    """
+    start_time = time.time()
+    tasks = {asyncio.ensure_future(acall_ai_model_with_timeout(config, prompt, options, timeout)): config['name']
+             for config in models_config}
+    pending = set(tasks)
+    answered = 0
+    while pending and not (first_k and answered >= first_k):
+        remaining = start_time + budget - time.time()
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        answered += sum(1 for task in done if task.result().ok)
+
+    results = {name: task.result() for task, name in tasks.items() if task not in pending}
+    if not pending:
+        return results, None
+
+    def expire_task(model_name, task):
+        # Red de seguridad: `acall_ai_model_with_timeout` ya vence por sí sola a los `timeout` segundos.
+        task.get_loop().call_soon_threadsafe(task.cancel)
+        result = error_result(model_name, asyncio.TimeoutError(), timeout)
+        metrics.record_result(model_name, result)
+        return result
+
+    comparison_id = comparison_tracker.start(
+        prompt, results,
+        pending={tasks[task]: task for task in pending},
+        expires_at=start_time + timeout + 5,
+        on_expire=expire_task,
+        on_complete=persist_comparison)
+
+    def on_done(task):
+        if not task.cancelled():
+            comparison_tracker.resolve(comparison_id, tasks[task], task.result())
+
+    for task in pending:
+        task.add_done_callback(on_done)
+    return results, comparison_id
+
+def conversation_step(model_name, prompt, result, context=None):
+    """
+    Paso de la cadena de Conversación: prompt (el último mensaje si se enviaron varios),
+    respuesta, metadatos del `ModelResult` y el resumen del contexto enviado.
+    """
+    step = {
+        'model_name': model_name,
+        'prompt': prompt_text(prompt),
+        'response': result.text,
+        **result.meta()
+    }
+    if context is not None:
+        step['context'] = context
+    return step
+
+def run_conversation(models_config, context, options, chain=None, on_step=None):
+    """
+    Encadena los modelos: la respuesta de uno es el prompt del siguiente. Con `chain` se
+    continúa una cadena ya empezada (los modelos que ya respondieron se saltan) y
+    `on_step(cadena)` se llama tras cada paso.
+    """
+    conversation_chain = list(chain or [])
+    if conversation_chain and conversation_chain[-1].get('error_kind'):
+        return conversation_chain
+    answered = {step['model_name'] for step in conversation_chain}
+    for step in conversation_chain:
+        context.add_response(step['response'])
+
+    for model_config in models_config:
+        if model_config['name'] in answered:
+            continue
+        model_input, context_info = context.next_input(model_config)
+        result = call_ai_model_with_timeout(model_config, model_input, options)
+        conversation_chain.append(conversation_step(model_config['name'], model_input, result, context_info))
+        if on_step is not None:
+            on_step(conversation_chain)
+
+        # Solo un error real detiene la cadena, no una respuesta que contenga la palabra "Error".
+        if not result.ok:
+            logger.warning(f"Deteniendo la conversación debido a un error en {model_config['name']}.")
+            break
+
+        context.add_response(result.text)
+
+    return conversation_chain
+
+def conversation_models():
+    """Modelos de la cadena de Conversación (sin el Mock si hay otros activos)."""
+    models_config = enabled_models()
+    if len(models_config) > 1:
+        models_config = [m for m in models_config if m.get('name') != 'Mock AI (Pruebas)']
+    return models_config
+
+def conversation_context(prompt, options):
+    """Contexto de la cadena con los ajustes por defecto y los de options.context. Lanza ValueError."""
+    return ConversationContext(prompt, context_settings(options.get('context'), conversation_context_defaults))
+
+async def arun_conversation(models_config, context, options):
+    """Encadena los modelos de forma asíncrona: la respuesta de uno es el prompt del siguiente."""
+    conversation_chain = []
+
+    for model_config in models_config:
+        model_input, context_info = context.next_input(model_config)
+        result = await acall_ai_model_with_timeout(model_config, model_input, options)
+        conversation_chain.append(conversation_step(model_config['name'], model_input, result, context_info))
+
+        if not result.ok:
+            logger.warning(f"Deteniendo la conversación debido a un error en {model_config['name']}.")
+            break
+
+        context.add_response(result.text)
+
+    return conversation_chain
 
+def stream_ai_model(model_config, prompt, options, events, cancelled, timeout=60):
+    """
+    Lanza el streaming de un modelo de IA y publica sus fragmentos en la cola `events`.
+
+    Vuelve enseguida: la consulta espera hueco en su proveedor sin ocupar un hilo y el
+    streaming se lee en el pool compartido. Cada fragmento se publica como ('chunk', {...})
+    y al terminar se publica un único ('done', {'model': ..., 'result': ModelResult}) con el
+    texto completo, los tiempos (primer token y total) y el uso de tokens que informe el
+    conector. Una respuesta cacheada se entrega como un único fragmento. Un error del
+    proveedor solo se reintenta si aún no se ha entregado ningún fragmento.
+
+    Devuelve `settle()`: quien la llame primero (el propio streaming al terminar o la ruta al
+    vencer su plazo) es el único que registra las métricas y la caché de la llamada, y solo
+    él recibe True.
+    """
+    start_time = time.time()
+    model_name = model_config['name']
+    first_token_time = None
+    chunks = []
+    final = None
+    completed = True
+    settled = threading.Lock()
+
+    def settle():
+        return settled.acquire(blocking=False)
+
+    def emit(text, is_token=True):
+        nonlocal first_token_time
+        if is_token and first_token_time is None:
+            first_token_time = time.time() - start_time
+        chunks.append(text)
+        events.put(('chunk', {'model': model_name, 'text': text}))
+
+    def consume(ai_instance):
+        nonlocal final, completed
+        for item in ai_instance.query_stream(prompt, options):
+            if cancelled.is_set():
+                logger.info(f"Streaming de {model_name} cancelado: el cliente se ha desconectado.")
+                completed = False
+                break
+            if isinstance(item, ModelResult):
+                # Cierre del conector: uso de tokens y motivo de fin, o el texto completo / el error
+                # si no hubo fragmentos.
+                final = item
+                if item.text and (not chunks or not item.ok):
+                    emit(item.text, is_token=item.ok)
+                continue
+            if not item:
+                continue
+            emit(item)
+            if time.time() - start_time > timeout:
+                raise concurrent.futures.TimeoutError()
+
+    def finish(cache_key=None, cached=None, error=None):
+        nonlocal final
+        if not settle():
+            return  # la ruta ya la dio por agotada
+        if error is not None:
+            final = error_result(model_name, error, timeout)
+            emit(final.text, is_token=False)
+        result = ModelResult(
+            ''.join(chunks),
+            error_kind=final.error_kind if final else None,
+            latency=time.time() - start_time,
+            first_token_latency=first_token_time,
+            input_tokens=final.input_tokens if final else None,
+            output_tokens=final.output_tokens if final else None,
+            finish_reason=final.finish_reason if final else None,
+            cached=cached is not None,
+            semantic_match=cached.semantic_match if cached is not None else None)
+        metrics.record_result(model_name, result)
+        if completed and cached is None:
+            store_cached_response(cache_key, result)
+        events.put(('done', {'model': model_name, 'result': result}))
+
+    try:
+        cache_key, cached = lookup_cached_response(model_config, prompt, options)
+        if cached is not None:
+            emit(cached.text)
+            finish(cache_key, cached)
+            return settle
+        ai_instance = get_ai_instance(model_config)
+
+        if ai_instance is None:
+            raise ValueError(f"No se pudo crear la instancia del modelo {model_name}.")
+
+        guard = get_provider_guard(model_config)
+        read = tracer.wrap(consume, 'model.stream', queue_span='pool.queue', model=model_name)
+        future = guard.submit(model_executor, read, ai_instance,
+                              tokens=estimate_request_tokens(prompt, options), deadline=start_time + timeout,
+                              can_retry=lambda: not chunks)
     except Exception as e:
-        metrics.record_error(model_name)
-        error_message = f"Error en {model_name}: {e}"
-        if isinstance(e, concurrent.futures.TimeoutError):
-            error_message = f"Timeout al consultar {model_name} después de {timeout} segundos."
-        
-        logger.warning(error_message)
-        return error_message
+        finish(error=e)
+        return settle
+    future.add_done_callback(lambda future: finish(cache_key, error=future.exception()))
+    return settle
+
+def sse_event(event, data):
+    """Serializa un evento en formato Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# --- Cola de trabajos ---
+# POST /jobs encola una comparación o una conversación y responde al momento con su id; la
+# ejecutan JOBS_WORKERS hilos propios, así que las cadenas largas no ocupan hilos de waitress.
+# Los trabajos se guardan en JOBS_PATH y se reanudan tras un reinicio.
+JOB_KINDS = ('compare', 'conversation')
+
+# Barridos de parámetros (POST /sweeps): un trabajo 'sweep' lanza cada celda de la rejilla con
+# SweepScheduler y guarda todas las filas en un único .npz por columnas bajo SWEEPS_DIR.
+SWEEPS_DIR = os.getenv('SWEEPS_DIR', 'results/sweeps')
+sweep_max_calls = int(os.getenv('SWEEP_MAX_CALLS', 500))
+sweep_max_repeats = int(os.getenv('SWEEP_MAX_REPEATS', 20))
+sweep_scheduler = SweepScheduler(max_in_flight=int(os.getenv('SWEEP_MAX_IN_FLIGHT', 8)))
+
+def run_compare_job(job):
+    """Trabajo 'compare': consulta los modelos que aún no han respondido y guarda la comparación."""
+    prompt = job.payload['prompt']
+    options = job.payload.get('options', {})
+    timeout = 60
+    answered = dict(job.progress.get('results', {}))
+    results = {name: ModelResult.from_meta(entry['text'], entry['meta']) for name, entry in answered.items()}
+    models_config = [config for config in enabled_models() if config['name'] not in results]
+    calls = [submit_ai_model_call(config, prompt, options, timeout) for config in models_config]
+    pending = [call.model_config['name'] for call in calls]
+    try:
+        for call in calls:
+            name = call.model_config['name']
+            results[name] = collect_ai_model_result(call, timeout)
+            answered[name] = {'text': results[name].text, 'meta': results[name].meta()}
+            pending.remove(name)
+            job.report(results=answered, pending=pending)
+    except JobCancelled:
+        for call in calls:
+            if call.model_config['name'] in pending:
+                model_executor.abandon(call.future, count_timeout=False)
+        raise
+    save_results(prompt, results, 'compare', record_id=job.id)
+    return compare_response(results, analytics=parse_analytics_option(options))
+
+def run_conversation_job(job):
+    """Trabajo 'conversation': continúa la cadena desde el último paso guardado y la guarda al terminar."""
+    prompt = job.payload['prompt']
+    options = job.payload.get('options', {})
+    context = conversation_context(prompt, options)
+    conversation_chain = run_conversation(conversation_models(), context, options,
+                                          chain=job.progress.get('chain'),
+                                          on_step=lambda chain: job.report(chain=chain))
+    save_results(prompt, conversation_chain, 'conversation', record_id=job.id)
+    return conversation_chain
+
+def load_sweep_spool(path):
+    """Filas ya terminadas de un barrido interrumpido: {índice de celda: fila}."""
+    rows = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # última línea a medio escribir
+                rows[entry['index']] = entry['row']
+    return rows
+
+def run_sweep_job(job):
+    """
+    Trabajo 'sweep': consulta cada celda (modelo × rejilla × repetición) y guarda el barrido.
+    Cada fila terminada se anexa a un fichero de progreso, así que al reanudarse solo se
+    lanzan las celdas que faltan.
+    """
+    prompt = job.payload['prompt']
+    base_options = job.payload.get('options', {})
+    cells = expand_grid(job.payload['models'], job.payload['grid'], job.payload.get('repeats', 1))
+    spool_path = os.path.join(SWEEPS_DIR, f"{job.id}.spool")
+    os.makedirs(SWEEPS_DIR, exist_ok=True)
+    rows = load_sweep_spool(spool_path)
+    configs = {config['name']: config for config in enabled_models()}
+    providers = model_registry.snapshot().providers
+    timeout = sweep_scheduler.timeout
+
+    spool = open(spool_path, 'a', encoding='utf-8')
+
+    def record(index, cell, result):
+        rows[index] = sweep_row(cell, result)
+        spool.write(json.dumps({'index': index, 'row': rows[index]}, ensure_ascii=False) + '\n')
+        spool.flush()
+
+    def cell_options(cell):
+        # Por defecto cada celda es una llamada real: sin caché ni llamadas compartidas, para medir latencias.
+        options = {'cache': False, 'coalesce': False, **base_options}
+        options.update({key: cell[key] for key in ('temperature', 'max_tokens') if key in cell})
+        return options
+
+    def budget_of(provider):
+        guard = provider_limits.guard_for(provider_configs[provider], providers)
+        return guard.max_in_flight, guard.in_flight
+
+    last_report = time.time()
+    stopped = None
+
+    def should_stop():
+        nonlocal last_report, stopped
+        if time.time() - last_report < 1:
+            return False
+        last_report = time.time()
+        try:
+            job.report(done=len(rows), total=len(cells))
+        except JobCancelled as e:
+            stopped = e
+            return True
+        return False
+
+    try:
+        pending = []
+        for index, cell in enumerate(cells):
+            if index in rows:
+                continue
+            if cell['model'] not in configs:
+                record(index, cell, ModelResult.failure(f"El modelo {cell['model']} ya no está activo.", ERROR_UNAVAILABLE))
+            else:
+                pending.append((index, cell))
+        provider_configs = {provider_name(configs[cell['model']]): configs[cell['model']] for _, cell in pending}
+        abandoned = sweep_scheduler.run(
+            pending,
+            provider_of=lambda cell: provider_name(configs[cell['model']]),
+            budget_of=budget_of,
+            submit=lambda cell: submit_ai_model_call(configs[cell['model']], prompt, cell_options(cell), timeout),
+            collect=lambda call: collect_ai_model_result(call, timeout),
+            on_result=record,
+            should_stop=should_stop)
+    finally:
+        spool.close()
+    if stopped is not None:
+        for call in abandoned:
+            model_executor.abandon(call.future, count_timeout=False)
+        if isinstance(stopped, JobLost):
+            raise stopped  # el fichero de progreso lo sigue usando el nuevo dueño
+        os.remove(spool_path)
+        raise JobCancelled()
+
+    path = os.path.join(SWEEPS_DIR, datetime.now().strftime('%Y-%m-%d'), f"sweep-{job.id}.npz")
+    meta = {'id': job.id, 'prompt': prompt, 'models': job.payload['models'], 'grid': job.payload['grid'],
+            'repeats': job.payload.get('repeats', 1), 'options': base_options, 'user': job.user,
+            'finished_at': datetime.now().isoformat()}
+    write_sweep(path, [rows[index] for index in range(len(cells))], meta)
+    os.remove(spool_path)
+    columns, _ = read_sweep(path)
+    summary = summarize(columns)
+    errors = int((columns['error_kind'] != '').sum())
+    # En el histórico queda un único registro que apunta al fichero del barrido.
+    results_store.enqueue({'id': job.id, 'mode': 'sweep', 'initial_prompt': prompt,
+                           'sweep': {'path': path, 'models': job.payload['models'], 'grid': job.payload['grid'],
+                                     'repeats': job.payload.get('repeats', 1), 'calls': len(cells), 'errors': errors}})
+    return {'sweep_id': job.id, 'path': path, 'calls': len(cells), 'errors': errors, 'cells': summary}
+
+job_queue = JobQueue(
+    path=os.getenv('JOBS_PATH', 'results/jobs.sqlite3'),
+    workers=int(os.getenv('JOBS_WORKERS', 2)),
+    lease=float(os.getenv('JOBS_LEASE_SEC', 60)),
+    max_queued_per_user=int(os.getenv('JOBS_MAX_QUEUED_PER_USER', 100)),
+    retention=int(os.getenv('JOBS_RETENTION_SEC', 7 * 86400))
+)
+job_queue.register('compare', run_compare_job)
+job_queue.register('conversation', run_conversation_job)
+job_queue.register('sweep', run_sweep_job)
+job_queue.start()
+atexit.register(job_queue.stop)
+# Cada cuántos milisegundos reconecta EventSource a GET /jobs/<id>/events (cada conexión se cierra al momento).
+jobs_events_retry_ms = int(os.getenv('JOBS_EVENTS_RETRY_MS', 2000))
+
+def current_user():
+    return request.authorization.username
+
+# --- Agregación entre trabajadores ---
+
+def process_stats():
+    """Estado de los recursos propios de este proceso (pools, cachés, proveedores...)."""
+    return {
+        'coalescing': coalescer.stats(),
+        'model_pool': model_executor.stats(),
+        'response_cache': response_cache.stats(),
+        'semantic_cache': semantic_cache.stats(),
+        'model_registry': model_registry.stats(),
+        'results_store': results_store.stats(),
+        'history_index': history_index.stats(),
+        'providers': provider_limits.stats(),
+        'http_pools': http_pools.stats(),
+        'partial_comparisons': comparison_tracker.stats(),
+        'auth': credential_store.stats(),
+        'tracing': tracer.stats(),
+        'jobs': job_queue.stats(),
+    }
+
+def process_gauges(stats):
+    """
+    Indicadores Prometheus de los recursos de un proceso a partir de su `process_stats()`.
+    Los contadores monótonos llevan el sufijo `_total` (se exportan como `counter`).
+    """
+    pool = stats['model_pool']
+    cache = stats['response_cache']
+    semantic = stats['semantic_cache']
+    providers = stats['providers']
+    pools = stats['http_pools']
+    breaker_states = {'closed': 0, 'half_open': 1, 'open': 2}
+    return {
+        'prompt_compare_model_pool_queued': ('Llamadas en cola en el pool compartido.', pool['queued']),
+        'prompt_compare_model_pool_active': ('Hilos del pool ocupados.', pool['active']),
+        'prompt_compare_model_pool_abandoned': ('Llamadas abandonadas por timeout aún en curso.', pool['abandoned_running']),
+        'prompt_compare_response_cache_events_total': ('Contadores de la caché de respuestas.', {
+            (('event', key),): cache[key]
+            for key in ('memory_hits', 'disk_hits', 'misses', 'stores', 'evictions', 'expirations')
+        }),
+        'prompt_compare_semantic_cache_events_total': ('Contadores de la caché semántica.', {
+            (('event', key),): semantic[key] for key in ('hits', 'misses', 'stores', 'evictions', 'expirations')
+        }),
+        'prompt_compare_semantic_cache_hit_rate': ('Aciertos / consultas de la caché semántica.', semantic['hit_rate']),
+        'prompt_compare_semantic_cache_entries': ('Entradas vigentes en la caché semántica.', semantic['entries']),
+        'prompt_compare_provider_circuit_state': ('Estado del circuito por proveedor (0 cerrado, 1 semiabierto, 2 abierto).', {
+            (('provider', name),): breaker_states[p['state']] for name, p in providers.items()
+        }),
+        'prompt_compare_provider_in_flight': ('Llamadas en curso por proveedor.', {
+            (('provider', name),): p['in_flight'] for name, p in providers.items()
+        }),
+        'prompt_compare_provider_waiting': ('Llamadas en cola esperando hueco en su proveedor.', {
+            (('provider', name),): p['waiting'] for name, p in providers.items()
+        }),
+        'prompt_compare_provider_queue_wait_p95_seconds': ('p95 de la espera por hueco/cuota de cada proveedor.', {
+            (('provider', name),): p['queue_wait_sec']['p95'] for name, p in providers.items()
+        }),
+        'prompt_compare_provider_retries_total': ('Reintentos por proveedor.', {
+            (('provider', name),): p['retries'] for name, p in providers.items()
+        }),
+        'prompt_compare_http_pool_connections': ('Conexiones HTTP abiertas por pool compartido.', {
+            (('pool', name), ('state', state)): p[key] for name, p in pools.items()
+            for state, key in (('busy', 'busy_connections'), ('open', 'connections'))
+        }),
+        'prompt_compare_http_pool_utilization': ('Conexiones ocupadas / max_connections por pool.', {
+            (('pool', name),): p['utilization'] for name, p in pools.items()
+        }),
+        'prompt_compare_http_pool_waiting_requests': ('Peticiones esperando una conexión libre.', {
+            (('pool', name),): p['waiting_requests'] for name, p in pools.items()
+        }),
+        'prompt_compare_http_pool_requests_total': ('Peticiones HTTP por pool, en conexión nueva o reutilizada.', {
+            (('pool', name), ('connection', kind)): p[key] for name, p in pools.items()
+            for kind, key in (('new', 'new_connections'), ('reused', 'reused_connections'))
+        }),
+    }
+
+# Cada trabajador publica sus métricas y una instantánea de process_stats() en WORKER_STATE_PATH
+# cada WORKER_STATE_INTERVAL segundos; /status y /metrics sirven el agregado de todos.
+worker_board = None
+if WORKER_ID is not None:
+    worker_board = WorkerBoard(WORKER_STATE_PATH, WORKER_ID, interval=float(os.getenv('WORKER_STATE_INTERVAL', 1)))
+    worker_board.start(metrics, process_stats)
 
 # --- Rutas de la Aplicación ---
 
@@ -196,28 +1114,92 @@ def call_ai_model_with_timeout(model_config, prompt, options, timeout=60):
 @login_required
 def index():
     """Renderiza la página principal."""
-    models_config = load_ai_models_config()
-    model_names = [model['name'] for model in models_config.get('models', []) if model.get('enabled', False)]
-    return render_template('index.html', model_names=model_names)
+    return render_template('index.html', model_names=list(model_registry.snapshot().enabled_names))
 
 @app.route('/status')
 def status():
     """Endpoint para ver el estado del sistema y métricas (público)."""
-    active_models = [model['name'] for model in load_ai_models_config().get('models', []) if model.get('enabled', False)]
+    active_models = list(model_registry.snapshot().enabled_names)
     
-    avg_response_times = {
-        model: sum(times) / len(times) if times else 0
-        for model, times in metrics.response_times.items()
-    }
+    summary = worker_board.metrics().summary() if worker_board else metrics.summary()
 
     status_info = {
-        'total_requests': metrics.total_requests,
+        'total_requests': summary.get('total_requests', 0),
+        'in_flight_requests': summary.get('in_flight', 0),
         'active_models': active_models,
-        'average_response_times_sec': {k: round(v, 2) for k, v in avg_response_times.items()},
-        'error_counts': dict(metrics.error_count),
+        'average_response_times_sec': {k: v['mean'] for k, v in summary.get('models', {}).items()},
+        'average_first_token_times_sec': {k: v['mean'] for k, v in summary.get('first_token', {}).items()},
+        'latency_percentiles_sec': summary.get('models', {}),
+        'first_token_percentiles_sec': summary.get('first_token', {}),
+        'route_latency_sec': summary.get('routes', {}),
+        'error_counts': summary.get('error_counts', {}),
+        'error_kinds': summary.get('error_kinds', {}),
+        'token_usage': summary.get('token_usage', {}),
+        'coalesced_calls': summary.get('coalesced_calls', {}),
+        **process_stats(),
     }
+    if worker_board:
+        # Las métricas de arriba suman todos los trabajadores; los recursos propios son los de este
+        # proceso, y 'workers' trae la última instantánea de cada trabajador vivo.
+        status_info['worker'] = WORKER_ID
+        status_info['workers'] = worker_board.workers()
     return jsonify(status_info)
 
+@app.route('/ready')
+@limiter.exempt
+def ready():
+    """
+    Disponibilidad para balanceadores y systemd (público): 200 cuando los conectores activos
+    están importados e inicializados, 503 mientras se precalientan.
+    """
+    readiness = model_registry.readiness()
+    return jsonify(readiness), 200 if readiness['ready'] else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Exporta las métricas en formato de texto de Prometheus (público, como /status)."""
+    if worker_board:
+        # Contadores e histogramas agregados; los indicadores de cada proceso llevan la etiqueta 'worker'.
+        extra_gauges = {}
+        for worker in worker_board.workers():
+            worker_label = (('worker', worker['worker']),)
+            for name, (help_text, value) in process_gauges(worker['stats']).items():
+                series = extra_gauges.setdefault(name, (help_text, {}))[1]
+                if isinstance(value, dict):
+                    series.update({worker_label + pairs: v for pairs, v in value.items()})
+                else:
+                    series[worker_label] = value
+        return Response(worker_board.metrics().render_prometheus(extra_gauges), mimetype='text/plain; version=0.0.4')
+    return Response(metrics.render_prometheus(process_gauges(process_stats())), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/slow')
+@limiter.exempt
+@login_required
+def debug_slow():
+    """
+    Las peticiones trazadas más lentas de este proceso, con su árbol de spans (tiempos en ms
+    relativos al inicio, hilo y atributos). Solo hay datos con TRACE_SAMPLE_RATE > 0.
+    """
+    return jsonify({'tracing': tracer.stats(), 'slowest': tracer.slowest()})
+
+@app.route('/history')
+@login_required
+def history():
+    """
+    Histórico de resultados paginado por keyset.
+    Parámetros: q (búsqueda de texto completo), model, mode, cursor y limit.
+    """
+    try:
+        page = history_index.search(
+            query=request.args.get('q'),
+            model=request.args.get('model'),
+            mode=request.args.get('mode'),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', 20, type=int)
+        )
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({'error': 'El cursor es inválido.'}), 400
+    return jsonify(page)
 
 @app.route('/compare', methods=['POST'])
 @limiter.limit("10 per minute")
@@ -230,25 +1212,130 @@ def compare():
     options = data.get('options', {})
     if not prompt:
         return jsonify({'error': 'El prompt es inválido.'}), 400
+    try:
+        deadline_ms, first_k = parse_partial_options(options)
+        analytics = parse_analytics_option(options)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    models_config = [model for model in load_ai_models_config().get('models', []) if model.get('enabled', False)]
+    models_config = enabled_models()
     results = {}
+    timeout = 60
+    pending_calls = []
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(models_config)) as executor:
-        future_to_model = {executor.submit(call_ai_model_with_timeout, config, prompt, options): config for config in models_config}
-        
-        for future in concurrent.futures.as_completed(future_to_model):
-            model_config = future_to_model[future]
-            try:
-                results[model_config['name']] = future.result()
-            except Exception as e:
-                error_message = f"Error al obtener resultado de {model_config['name']}: {e}"
-                logger.error(error_message)
-                results[model_config['name']] = error_message
-    
-    save_results(prompt, results, 'compare')
-            
-    return jsonify(results)
+    # Se envían todas las llamadas a la vez y se recogen con el mismo plazo para cada una.
+    calls = [submit_ai_model_call(config, prompt, options, timeout) for config in models_config]
+    if deadline_ms is None and first_k is None:
+        for call in calls:
+            results[call.model_config['name']] = collect_ai_model_result(call, timeout)
+    else:
+        budget = min(deadline_ms / 1000, timeout) if deadline_ms is not None else timeout
+        results, pending_calls = wait_for_responders(calls, budget, first_k)
+
+    if pending_calls:
+        # Los rezagados siguen en curso; la comparación se guarda cuando terminan todos.
+        comparison_id = track_stragglers(prompt, results, pending_calls, timeout)
+    else:
+        comparison_id = None
+        save_results(prompt, results, 'compare')
+
+    # Los modelos que aún no han respondido se listan en '_pending' y se recogen con GET /compare/<id>.
+    pending = [call.model_config['name'] for call in pending_calls]
+    return jsonify(compare_response(results, pending, comparison_id, analytics))
+
+@app.route('/compare/<comparison_id>')
+@limiter.exempt
+@login_required
+def compare_result(comparison_id):
+    """
+    Estado de una comparación parcial: las respuestas que han ido llegando y los modelos
+    aún pendientes. Sin límite de peticiones para que el cliente pueda sondear.
+    """
+    snapshot = comparison_tracker.get(comparison_id)
+    if snapshot is None:
+        return jsonify({'error': 'La comparación no existe o ha caducado; búscala en /history.'}), 404
+    results, pending = snapshot
+    analytics = analytics_threshold if request.args.get('analytics') in ('1', 'true') else None
+    return jsonify(compare_response(results, pending, comparison_id, analytics))
+
+@app.route('/compare/stream', methods=['POST'])
+@limiter.limit("10 per minute")
+@login_required
+def compare_stream():
+    """
+    Endpoint API para el modo Comparar en streaming (Server-Sent Events).
+
+    Intercala los fragmentos de todos los modelos a medida que llegan, de modo que
+    el usuario ve los primeros tokens sin esperar al proveedor más lento.
+    """
+    metrics.record_request()
+    data = request.get_json()
+    prompt = data.get('prompt', '').strip()
+    options = data.get('options', {})
+    if not prompt:
+        return jsonify({'error': 'El prompt es inválido.'}), 400
+    try:
+        analytics = parse_analytics_option(options)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    models_config = enabled_models()
+    timeout = 60
+    events = queue.Queue()
+    cancelled = threading.Event()
+
+    settlers = {config['name']: stream_ai_model(config, prompt, options, events, cancelled, timeout)
+                for config in models_config}
+
+    def generate():
+        pending = {config['name'] for config in models_config}
+        results = {}
+        timings = {}
+        deadline = time.time() + timeout
+        expired = False
+        try:
+            yield sse_event('start', {'models': sorted(pending)})
+            while pending:
+                try:
+                    event, payload = events.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    if expired:
+                        break
+                    # Plazo vencido: se dan por agotados los modelos que no han terminado. Uno que
+                    # termine justo ahora ya se ha reservado el cierre y su 'done' va por la cola.
+                    expired = True
+                    deadline = time.time() + 5
+                    for model_name in sorted(pending):
+                        if not settlers[model_name]():
+                            continue
+                        pending.discard(model_name)
+                        result = error_result(model_name, concurrent.futures.TimeoutError(), timeout)
+                        result.latency = timeout
+                        metrics.record_result(model_name, result)
+                        results[model_name] = result
+                        timings[model_name] = {'model': model_name, **result.meta()}
+                        yield sse_event('chunk', {'model': model_name, 'text': result.text})
+                        yield sse_event('done', timings[model_name])
+                    continue
+                if payload['model'] not in pending:
+                    continue  # fragmentos tardíos de un modelo ya dado por agotado
+                if event == 'done':
+                    model_name = payload['model']
+                    pending.discard(model_name)
+                    results[model_name] = payload['result']
+                    payload = timings[model_name] = {'model': model_name, **payload['result'].meta()}
+                yield sse_event(event, payload)
+
+            save_results(prompt, results, 'compare')
+            end = {'timings': timings}
+            if analytics is not None:
+                end['analytics'] = comparison_analytics(results, analytics)
+            yield sse_event('end', end)
+        finally:
+            cancelled.set()
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/conversation', methods=['POST'])
 @limiter.limit("5 per minute")
@@ -262,37 +1349,237 @@ def conversation():
     if not prompt:
         return jsonify({'error': 'El prompt es inválido.'}), 400
 
-    models_config = [model for model in load_ai_models_config().get('models', []) if model.get('enabled', False)]
-    
-    if len(models_config) > 1:
-        models_config = [m for m in models_config if m.get('name') != 'Mock AI (Pruebas)']
-        
-    conversation_chain = []
-    current_prompt = prompt
+    models_config = conversation_models()
 
-    for model_config in models_config:
-        response_text = call_ai_model_with_timeout(model_config, current_prompt, options)
-        
-        step = {
-            'model_name': model_config['name'],
-            'prompt': current_prompt,
-            'response': response_text
-        }
-        conversation_chain.append(step)
-        
-        if "Error" in response_text or "Timeout" in response_text:
-            logger.warning(f"Deteniendo la conversación debido a un error en {model_config['name']}.")
-            break
-            
-        current_prompt = response_text
-    
+    try:
+        context = conversation_context(prompt, options)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conversation_chain = run_conversation(models_config, context, options)
     save_results(prompt, conversation_chain, 'conversation')
             
     return jsonify(conversation_chain)
 
+@app.route('/compare/async', methods=['POST'])
+@limiter.limit("10 per minute")
+@login_required
+def compare_async():
+    """Variante asíncrona del modo Comparar: el fan-out se hace con corrutinas."""
+    metrics.record_request()
+    data = request.get_json()
+    prompt = data.get('prompt', '').strip()
+    options = data.get('options', {})
+    if not prompt:
+        return jsonify({'error': 'El prompt es inválido.'}), 400
+    try:
+        deadline_ms, first_k = parse_partial_options(options)
+        analytics = parse_analytics_option(options)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    models_config = enabled_models()
+    comparison_id = None
+    if deadline_ms is None and first_k is None:
+        results = async_runtime.run(tracer.bind(acompare_models(models_config, prompt, options)))
+    else:
+        budget = min(deadline_ms / 1000, 60) if deadline_ms is not None else 60
+        results, comparison_id = async_runtime.run(
+            tracer.bind(acompare_models_partial(models_config, prompt, options, budget, first_k)))
+
+    if comparison_id is None:
+        save_results(prompt, results, 'compare')
+
+    pending = [m['name'] for m in models_config if m['name'] not in results]
+    return jsonify(compare_response(results, pending, comparison_id, analytics))
+
+@app.route('/conversation/async', methods=['POST'])
+@limiter.limit("5 per minute")
+@login_required
+def conversation_async():
+    """Variante asíncrona del modo Conversación."""
+    metrics.record_request()
+    data = request.get_json()
+    prompt = data.get('prompt', '').strip()
+    options = data.get('options', {})
+    if not prompt:
+        return jsonify({'error': 'El prompt es inválido.'}), 400
+
+    models_config = conversation_models()
+
+    try:
+        context = conversation_context(prompt, options)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    conversation_chain = async_runtime.run(tracer.bind(arun_conversation(models_config, context, options)))
+
+    save_results(prompt, conversation_chain, 'conversation')
+
+    return jsonify(conversation_chain)
+
+@app.route('/jobs', methods=['POST'])
+@limiter.limit("30 per minute")
+@login_required
+def submit_job():
+    """
+    Encola una comparación o una conversación y devuelve su id al momento (202).
+    Cuerpo: {"mode": "compare" | "conversation", "prompt", "options", "priority"}.
+    """
+    metrics.record_request()
+    data = request.get_json()
+    mode = data.get('mode', 'compare')
+    prompt = data.get('prompt', '').strip()
+    options = data.get('options', {})
+    priority = data.get('priority', 0)
+    if mode not in JOB_KINDS:
+        return jsonify({'error': f"'mode' debe ser uno de {JOB_KINDS}."}), 400
+    if not prompt:
+        return jsonify({'error': 'El prompt es inválido.'}), 400
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        return jsonify({'error': "'priority' debe ser un entero."}), 400
+    try:
+        if mode == 'compare':
+            parse_analytics_option(options)
+        else:
+            conversation_context(prompt, options)
+        job = job_queue.submit(current_user(), mode, {'prompt': prompt, 'options': options}, priority)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify(job), 202, {'Location': f"/jobs/{job['id']}"}
+
+@app.route('/jobs')
+@limiter.exempt
+@login_required
+def list_jobs():
+    """Trabajos del usuario, del más reciente al más antiguo."""
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({'jobs': job_queue.user_jobs(current_user(), limit)})
+
+@app.route('/sweeps', methods=['POST'])
+@limiter.limit("10 per minute")
+@login_required
+def submit_sweep():
+    """
+    Encola un barrido de parámetros como trabajo (202). Cuerpo: {"prompt", "grid":
+    {"temperature": [...], "max_tokens": [...]}, "models" (por defecto, los activos),
+    "options" comunes, "repeats" por celda y "priority"}.
+    """
+    metrics.record_request()
+    data = request.get_json()
+    prompt = data.get('prompt', '').strip()
+    options = data.get('options', {})
+    repeats = data.get('repeats', 1)
+    priority = data.get('priority', 0)
+    if not prompt:
+        return jsonify({'error': 'El prompt es inválido.'}), 400
+    enabled = [config['name'] for config in enabled_models()]
+    models = data.get('models') or enabled
+    unknown = [name for name in models if name not in enabled] if isinstance(models, list) else models
+    if unknown:
+        return jsonify({'error': f"Modelos desconocidos o inactivos: {unknown}."}), 400
+    if isinstance(repeats, bool) or not isinstance(repeats, int) or not 1 <= repeats <= sweep_max_repeats:
+        return jsonify({'error': f"'repeats' debe ser un entero entre 1 y {sweep_max_repeats}."}), 400
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        return jsonify({'error': "'priority' debe ser un entero."}), 400
+    try:
+        grid = sweep_grid(data.get('grid'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    calls = len(expand_grid(models, grid, repeats))
+    if calls > sweep_max_calls:
+        return jsonify({'error': f"El barrido tiene {calls} llamadas; el máximo es {sweep_max_calls}."}), 400
+    payload = {'prompt': prompt, 'models': list(dict.fromkeys(models)), 'grid': grid, 'options': options,
+               'repeats': repeats}
+    try:
+        job = job_queue.submit(current_user(), 'sweep', payload, priority)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify(job), 202, {'Location': f"/jobs/{job['id']}"}
+
+@app.route('/sweeps/<job_id>/data')
+@limiter.exempt
+@login_required
+def sweep_data(job_id):
+    """Descarga el barrido terminado: un .npz por columnas (ver services/sweeps.read_sweep)."""
+    job = owned_job(job_id)
+    if job is None or job['kind'] != 'sweep':
+        return jsonify({'error': 'El barrido no existe.'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"El barrido aún no ha terminado (estado: {job['status']})."}), 409
+    return send_file(os.path.abspath(job['result']['path']), mimetype='application/octet-stream',
+                     as_attachment=True, download_name=f"sweep-{job_id}.npz")
+
+def owned_job(job_id, include_result=True):
+    job = job_queue.get(job_id, include_result)
+    return job if job is not None and job['user'] == current_user() else None
+
+@app.route('/jobs/<job_id>')
+@limiter.exempt
+@login_required
+def job_status(job_id):
+    """
+    Estado de un trabajo: 'queued', 'running', 'done', 'failed' o 'cancelled', progreso y resultado.
+    Con ?version=N responde 304 sin cuerpo si el trabajo no ha cambiado desde esa versión.
+    """
+    since = request.args.get('version', type=int)
+    job = owned_job(job_id, include_result=since is None)
+    if job is None:
+        return jsonify({'error': 'El trabajo no existe.'}), 404
+    if since is not None:
+        if job['version'] == since:
+            return '', 304
+        job = job_queue.get(job_id)
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+@login_required
+def cancel_job(job_id):
+    """Cancela un trabajo en cola o, si está en marcha, lo detiene tras el modelo en curso."""
+    if owned_job(job_id, include_result=False) is None:
+        return jsonify({'error': 'El trabajo no existe.'}), 404
+    return jsonify(job_queue.cancel(job_id))
+
+@app.route('/jobs/<job_id>/events')
+@limiter.exempt
+@login_required
+def job_events(job_id):
+    """
+    Estado de un trabajo en Server-Sent Events: 'progress' o, al terminar, 'end' con el
+    resultado. Cada conexión envía el estado actual y se cierra al momento, así que no ocupa
+    un hilo de waitress mientras el trabajo avanza. EventSource reconecta tras
+    JOBS_EVENTS_RETRY_MS con Last-Event-ID (la versión del trabajo); si no ha cambiado, la
+    respuesta solo lleva `retry`.
+    """
+    job = owned_job(job_id)
+    if job is None:
+        return jsonify({'error': 'El trabajo no existe.'}), 404
+
+    body = f"retry: {jobs_events_retry_ms}\n\n"
+    if job['version'] != request.headers.get('Last-Event-ID', type=int):
+        if job['status'] in ('done', 'failed', 'cancelled'):
+            event = 'end'
+        else:
+            event = 'progress'
+            job.pop('result', None)
+        body += f"id: {job['version']}\n" + sse_event(event, job)
+    return Response(body, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # --- Punto de Entrada ---
 if __name__ == '__main__':
     host = '0.0.0.0'
-    port = 3556
-    logger.info(f"Iniciando servidor de producción con Waitress en http://{host}:{port}")
-    serve(app, host=host, port=port)
+    port = int(os.getenv('PORT', 3556))
+    # SIGTERM (systemd) termina con SystemExit para que atexit vacíe el almacén de resultados.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    threads = int(os.getenv('WAITRESS_THREADS', 4))
+    worker_fd = os.getenv(WORKER_FD_ENV)
+    if worker_fd:
+        # Trabajador del modo multiproceso: atiende en el socket que abrió el supervisor.
+        logger.info(f"Trabajador {WORKER_ID} (pid {os.getpid()}) atendiendo en http://{host}:{port}")
+        serve(app, sockets=[socket.socket(fileno=int(worker_fd))], threads=threads)
+    else:
+        logger.info(f"Iniciando servidor de producción con Waitress en http://{host}:{port}")
+        serve(app, host=host, port=port, threads=threads)
@@ -0,0 +1,277 @@
+# batch_runner.py
+# Ejecuta en lote un fichero JSONL de prompts contra los modelos de models.json.
+#
+# Cada línea del fichero de entrada es un objeto JSON con, al menos, el prompt:
+#   {"id": "p1", "prompt": "¿Qué es un agujero negro?", "options": {"temperature": 0}, "models": ["Gemini 1.5 Flash"]}
+# 'options' y 'models' son opcionales (por defecto se usan --temperature/--max-tokens y todos los modelos activos).
+#
+# Uso:
+#   python batch_runner.py prompts.jsonl -o results/batch/salida.jsonl --concurrency 16 --per-model-concurrency 4
+#
+# Los resultados se escriben de forma incremental (una línea por prompt) y el progreso se guarda
+# en '<salida>.checkpoint.json', de modo que si el proceso se interrumpe basta con relanzar el
+# mismo comando para continuar donde se quedó.
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from ai_models.base_model import (ModelResult, ProviderError, ERROR_INTERNAL, ERROR_PROVIDER, ERROR_TIMEOUT,
+                                  ERROR_UNAVAILABLE, estimate_tokens)
+from services.model_registry import ModelRegistry
+from services.provider_limits import ProviderLimits, ProviderUnavailableError, estimate_request_tokens
+
+logging.basicConfig(level=logging.WARNING,
+                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('batch_runner')
+
+
+class Checkpoint:
+    """
+    Progreso de una ejecución con memoria acotada.
+
+    Guarda la marca de agua (todas las líneas anteriores están hechas), el conjunto de
+    líneas terminadas por encima de ella (como mucho tantas como trabajos en curso) y
+    el tamaño del fichero de salida en el momento de guardar.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.watermark = 0
+        self.done_above = set()
+        self.output_offset = 0
+
+    def load(self, output_path):
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.watermark = data['watermark']
+            self.done_above = set(data['done_above'])
+            self.output_offset = data['output_offset']
+        # Las líneas escritas después del último checkpoint también cuentan como hechas.
+        if os.path.exists(output_path):
+            with open(output_path, 'rb') as f:
+                f.seek(self.output_offset)
+                for raw in f:
+                    try:
+                        self.mark_done(json.loads(raw)['line'])
+                    except (json.JSONDecodeError, KeyError):
+                        break
+
+    def is_done(self, line_number):
+        return line_number < self.watermark or line_number in self.done_above
+
+    def mark_done(self, line_number):
+        self.done_above.add(line_number)
+        while self.watermark in self.done_above:
+            self.done_above.remove(self.watermark)
+            self.watermark += 1
+
+    def save(self, output_offset):
+        self.output_offset = output_offset
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'watermark': self.watermark, 'done_above': sorted(self.done_above),
+                       'output_offset': output_offset}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class BatchRunner:
+    def __init__(self, args):
+        self.args = args
+        self.registry = ModelRegistry(path=args.models_file, reload_interval=0)
+        self.provider_limits = ProviderLimits()
+        snapshot = self.registry.snapshot()
+        if args.models:
+            self.default_models = [name.strip() for name in args.models.split(',') if name.strip()]
+        else:
+            self.default_models = list(snapshot.enabled_names)
+        self.global_limit = asyncio.Semaphore(args.concurrency)
+        self.model_limits = {}
+        self.checkpoint = Checkpoint(args.output + '.checkpoint.json')
+        self.started_at = time.time()
+        self.completed = 0
+        self.skipped = 0
+        self.errors = 0
+        self.output_tokens = 0
+        self.total_lines = None
+
+    def model_limit(self, model_config):
+        name = model_config['name']
+        if name not in self.model_limits:
+            limit = model_config.get('batch_concurrency', self.args.per_model_concurrency)
+            self.model_limits[name] = asyncio.Semaphore(limit)
+        return self.model_limits[name]
+
+    async def run_model(self, model_config, prompt, options):
+        """Ejecuta una llamada respetando el límite por modelo y el global. Devuelve un `ModelResult`."""
+        start_time = time.time()
+        async with self.model_limit(model_config):
+            async with self.global_limit:
+                try:
+                    instance = self.registry.get_instance(model_config)
+                    if instance is None:
+                        raise ValueError(f"No se pudo crear la instancia del modelo {model_config['name']}.")
+                    guard = self.provider_limits.guard_for(model_config, self.registry.snapshot().providers)
+                    call = guard.acall(instance.aquery, prompt, options,
+                                       tokens=estimate_request_tokens(prompt, options),
+                                       deadline=time.time() + self.args.timeout)
+                    result = await asyncio.wait_for(call, timeout=self.args.timeout)
+                except asyncio.TimeoutError:
+                    result = ModelResult.failure(
+                        f"Timeout al consultar {model_config['name']} después de {self.args.timeout} segundos.",
+                        ERROR_TIMEOUT)
+                except ProviderUnavailableError as e:
+                    result = ModelResult.failure(f"Error en {model_config['name']}: {e}", ERROR_UNAVAILABLE)
+                except ProviderError as e:
+                    result = ModelResult.failure(f"Error en {model_config['name']}: {e}", ERROR_PROVIDER)
+                except Exception as e:
+                    result = ModelResult.failure(f"Error en {model_config['name']}: {e}", ERROR_INTERNAL)
+        result.latency = time.time() - start_time
+        if result.ok:
+            # Si el proveedor no informa del uso de tokens se recurre a la estimación.
+            self.output_tokens += result.output_tokens or estimate_tokens(result.text)
+        else:
+            self.errors += 1
+        return result
+
+    async def run_line(self, line_number, item, output):
+        prompt = item.get('prompt', '').strip()
+        options = item.get('options') or self.default_options()
+        snapshot = self.registry.snapshot()
+        names = item.get('models') or self.default_models
+        models = [snapshot.by_name[name] for name in names if name in snapshot.by_name]
+        unknown = [name for name in names if name not in snapshot.by_name]
+        if unknown:
+            logger.warning(f"Línea {line_number}: modelos desconocidos {unknown}.")
+
+        results = await asyncio.gather(*(self.run_model(m, prompt, options) for m in models))
+        record = {
+            'line': line_number,
+            'id': item.get('id', line_number),
+            'timestamp': datetime.now().isoformat(),
+            'prompt': prompt,
+            'options': options,
+            'results': {m['name']: result.text for m, result in zip(models, results)},
+            'latency_sec': {m['name']: round(result.latency, 3) for m, result in zip(models, results)},
+            'details': {m['name']: result.meta() for m, result in zip(models, results)},
+        }
+        output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        output.flush()
+        self.checkpoint.mark_done(line_number)
+        self.completed += 1
+
+    def default_options(self):
+        options = {}
+        if self.args.temperature is not None:
+            options['temperature'] = self.args.temperature
+        if self.args.max_tokens is not None:
+            options['max_tokens'] = self.args.max_tokens
+        return options
+
+    def iter_input(self):
+        """Lee el fichero de entrada de forma perezosa: (número de línea, objeto)."""
+        with open(self.args.input, 'r', encoding='utf-8') as f:
+            for line_number, raw in enumerate(f):
+                if not raw.strip():
+                    continue
+                try:
+                    item = json.loads(raw)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Línea {line_number} inválida: {e}")
+                    continue
+                if self.args.prompt_field != 'prompt':
+                    item['prompt'] = item.get(self.args.prompt_field, '')
+                if 'id' not in item and self.args.id_field in item:
+                    item['id'] = item[self.args.id_field]
+                yield line_number, item
+
+    def report(self, final=False):
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        rate = self.completed / elapsed
+        tokens_rate = self.output_tokens / elapsed
+        done = self.completed + self.skipped
+        eta = ''
+        if self.total_lines and rate > 0:
+            remaining = max(self.total_lines - done, 0)
+            eta = f" · ETA {time.strftime('%H:%M:%S', time.gmtime(remaining / rate))}"
+        total = f"/{self.total_lines}" if self.total_lines else ''
+        end = '\n' if final else '\r'
+        sys.stderr.write(f"{done}{total} prompts · {rate:.2f} prompts/s · ~{tokens_rate:.0f} tokens/s "
+                         f"· {self.errors} errores{eta}   {end}")
+        sys.stderr.flush()
+
+    async def run(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.args.output)), exist_ok=True)
+        self.checkpoint.load(self.args.output)
+        if not self.args.no_count:
+            with open(self.args.input, 'rb') as f:
+                self.total_lines = sum(1 for raw in f if raw.strip())
+
+        # El número de líneas en curso está acotado: la memoria no depende del tamaño de la entrada.
+        max_pending = self.args.concurrency * 2
+        pending = set()
+        last_save = last_report = time.time()
+
+        with open(self.args.output, 'a', encoding='utf-8') as output:
+            for line_number, item in self.iter_input():
+                if self.checkpoint.is_done(line_number):
+                    self.skipped += 1
+                    continue
+                while len(pending) >= max_pending:
+                    finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in finished:
+                        task.result()
+                pending.add(asyncio.ensure_future(self.run_line(line_number, item, output)))
+
+                now = time.time()
+                if now - last_save >= self.args.checkpoint_interval:
+                    self.checkpoint.save(output.tell())
+                    last_save = now
+                if now - last_report >= 1:
+                    self.report()
+                    last_report = now
+
+            while pending:
+                finished, pending = await asyncio.wait(pending, timeout=1, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    task.result()
+                self.report()
+            self.checkpoint.save(output.tell())
+
+        self.report(final=True)
+        for instance in self.registry.live_instances():
+            await instance.aclose()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Ejecuta en lote un fichero JSONL de prompts contra los modelos configurados.")
+    parser.add_argument('input', help="Fichero JSONL de entrada (un objeto por línea).")
+    parser.add_argument('-o', '--output', required=True, help="Fichero JSONL de salida (se anexa).")
+    parser.add_argument('--models', help="Modelos por defecto separados por comas (por defecto, los activos).")
+    parser.add_argument('--models-file', default='models.json', help="Ruta a models.json.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Llamadas simultáneas en total.")
+    parser.add_argument('--per-model-concurrency', type=int, default=2,
+                        help="Llamadas simultáneas por modelo (se puede fijar por modelo con 'batch_concurrency').")
+    parser.add_argument('--timeout', type=float, default=60, help="Timeout por llamada en segundos.")
+    parser.add_argument('--temperature', type=float, help="Temperatura por defecto si la línea no trae 'options'.")
+    parser.add_argument('--max-tokens', type=int, help="max_tokens por defecto si la línea no trae 'options'.")
+    parser.add_argument('--prompt-field', default='prompt', help="Campo del que se lee el prompt (ej: 'body').")
+    parser.add_argument('--id-field', default='id', help="Campo del que se lee el identificador (ej: 'request_id').")
+    parser.add_argument('--checkpoint-interval', type=float, default=5, help="Segundos entre checkpoints.")
+    parser.add_argument('--no-count', action='store_true', help="No contar las líneas de entrada (sin ETA).")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    asyncio.run(BatchRunner(parse_args()).run())
@@ -0,0 +1,272 @@
+# benchmarks/fake_provider.py
+# Proveedor simulado: servidor HTTP local que habla los formatos de chat de OpenAI (DeepSeek, Groq),
+# Anthropic y Mistral, con y sin streaming, para medir la aplicación de punta a punta sin
+# pagar a ningún proveedor.
+#
+# Uso:
+#   python benchmarks/fake_provider.py --port 8765 --latency 0.3 --tokens-per-sec 80 --response-tokens 200 --rate-429 0.02
+#
+# y en models.json, la URL del proveedor simulado en cada modelo (la clave de API puede ser cualquiera):
+#   DeepSeek: "base_url": "http://127.0.0.1:8765"           -> POST /chat/completions
+#   Groq:     "base_url": "http://127.0.0.1:8765"           -> POST /openai/v1/chat/completions
+#   Mistral:  "base_url": "http://127.0.0.1:8765"           -> POST /v1/chat/completions
+#   Claude:   "base_url": "http://127.0.0.1:8765"           -> POST /v1/messages
+#
+# Gemini no está incluido: su SDK usa gRPC por defecto.
+# GET /stats devuelve los contadores del servidor; GET .../models, un listado para calentar conexiones.
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur', 'adipiscing', 'elit', 'sed', 'do',
+         'eiusmod', 'tempor', 'incididunt', 'ut', 'labore', 'et', 'dolore', 'magna', 'aliqua')
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4) if text else 0
+
+
+class FakeProvider:
+    """Parámetros de la simulación y contadores compartidos por todos los hilos del servidor."""
+
+    def __init__(self, args):
+        self.latency = args.latency
+        self.latency_jitter = args.latency_jitter
+        self.tokens_per_sec = args.tokens_per_sec
+        self.response_tokens = args.response_tokens
+        self.rate_429 = args.rate_429
+        self.retry_after = args.retry_after
+        self._random = random.Random(args.seed)
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'streams': 0, 'rate_limited': 0, 'in_flight': 0, 'max_in_flight': 0}
+
+    def count(self, key, delta=1):
+        with self._lock:
+            self.counters[key] += delta
+            if key == 'in_flight':
+                self.counters['max_in_flight'] = max(self.counters['max_in_flight'], self.counters['in_flight'])
+
+    def rate_limited(self):
+        with self._lock:
+            return self._random.random() < self.rate_429
+
+    def first_byte_delay(self):
+        with self._lock:
+            return max(0.0, self.latency + self._random.uniform(-self.latency_jitter, self.latency_jitter))
+
+    def tokens(self, max_tokens=None):
+        """Palabras de la respuesta (una por token), acotadas por max_tokens si la petición lo trae."""
+        count = min(self.response_tokens, max_tokens) if max_tokens else self.response_tokens
+        return [WORDS[i % len(WORDS)] if i == 0 else ' ' + WORDS[i % len(WORDS)] for i in range(count)]
+
+    def token_batches(self, tokens):
+        """
+        Agrupa los tokens en fragmentos y devuelve (fragmentos, segundos entre fragmentos).
+        Con muchos tokens por segundo se envían varios por fragmento (uno cada 10 ms como mínimo).
+        """
+        if not self.tokens_per_sec:
+            return [''.join(tokens)], 0.0
+        per_batch = max(1, int(self.tokens_per_sec * 0.01))
+        batches = [''.join(tokens[i:i + per_batch]) for i in range(0, len(tokens), per_batch)]
+        return batches, per_batch / self.tokens_per_sec
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # conexiones persistentes, como los SDK reales
+    provider = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- Rutas ---
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, self.provider.counters)
+        elif self.path.split('?')[0].endswith('/models'):
+            # Listado de modelos (lo usan los conectores para calentar la conexión); vale para los tres SDK.
+            model = {'id': 'fake-model', 'object': 'model', 'type': 'model', 'created': 0,
+                     'created_at': '2024-01-01T00:00:00Z', 'display_name': 'Fake', 'owned_by': 'fake'}
+            self.send_json(200, {'object': 'list', 'data': [model], 'has_more': False,
+                                 'first_id': model['id'], 'last_id': model['id']})
+        else:
+            self.send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self.send_json(400, {'error': {'message': 'Invalid JSON'}})
+            return
+
+        if self.path.endswith('/messages'):
+            style = 'anthropic'
+        elif self.path.endswith('/chat/completions'):
+            style = 'openai'
+        else:
+            self.send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+
+        provider = self.provider
+        provider.count('requests')
+        provider.count('in_flight')
+        try:
+            if provider.rate_limited():
+                provider.count('rate_limited')
+                self.send_rate_limited(style)
+                return
+            time.sleep(provider.first_byte_delay())
+            prompt_tokens = estimate_tokens(json.dumps(body.get('messages', [])))
+            tokens = provider.tokens(body.get('max_tokens'))
+            if body.get('stream'):
+                provider.count('streams')
+                self.stream(style, body, prompt_tokens, tokens)
+            else:
+                # Sin streaming, la generación completa se cobra antes de responder.
+                if provider.tokens_per_sec:
+                    time.sleep(len(tokens) / provider.tokens_per_sec)
+                self.send_json(200, self.completion(style, body, prompt_tokens, tokens))
+        finally:
+            provider.count('in_flight', -1)
+
+    # --- Respuestas ---
+
+    def completion(self, style, body, prompt_tokens, tokens):
+        text = ''.join(tokens)
+        if style == 'anthropic':
+            return {
+                'id': f"msg_{uuid.uuid4().hex}", 'type': 'message', 'role': 'assistant', 'model': body.get('model'),
+                'content': [{'type': 'text', 'text': text}],
+                'stop_reason': 'end_turn', 'stop_sequence': None,
+                'usage': {'input_tokens': prompt_tokens, 'output_tokens': len(tokens)},
+            }
+        return {
+            'id': f"chatcmpl-{uuid.uuid4().hex}", 'object': 'chat.completion', 'created': int(time.time()),
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                      'total_tokens': prompt_tokens + len(tokens)},
+        }
+
+    def stream(self, style, body, prompt_tokens, tokens):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        batches, interval = self.provider.token_batches(tokens)
+        start = time.time()
+        events = self.anthropic_events if style == 'anthropic' else self.openai_events
+        sent = 0
+        for event in events(body, prompt_tokens, tokens, batches):
+            if event is None:
+                # Marca de un fragmento de texto: se espera a su instante previsto.
+                remaining = start + sent * interval - time.time()
+                if remaining > 0:
+                    time.sleep(remaining)
+                sent += 1
+                continue
+            self.write_chunk(event)
+        self.write_chunk(b'')
+
+    def openai_events(self, body, prompt_tokens, tokens, batches):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                 'total_tokens': prompt_tokens + len(tokens)}
+
+        def chunk(delta, finish_reason=None, **extra):
+            data = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': body.get('model'),
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}], **extra}
+            return f"data: {json.dumps(data)}\n\n".encode()
+
+        for index, text in enumerate(batches):
+            yield None
+            yield chunk({'role': 'assistant', 'content': text} if index == 0 else {'content': text})
+        # Groq informa del uso en 'x_groq'; Mistral en el último fragmento; OpenAI/DeepSeek en un
+        # fragmento sin opciones si se pide con stream_options.include_usage.
+        yield chunk({}, 'stop', usage=usage, x_groq={'id': completion_id, 'usage': usage})
+        if (body.get('stream_options') or {}).get('include_usage'):
+            data = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': body.get('model'), 'choices': [], 'usage': usage}
+            yield f"data: {json.dumps(data)}\n\n".encode()
+        yield b"data: [DONE]\n\n"
+
+    def anthropic_events(self, body, prompt_tokens, tokens, batches):
+        def event(name, data):
+            return f"event: {name}\ndata: {json.dumps({'type': name, **data})}\n\n".encode()
+
+        yield event('message_start', {'message': {
+            'id': f"msg_{uuid.uuid4().hex}", 'type': 'message', 'role': 'assistant', 'model': body.get('model'),
+            'content': [], 'stop_reason': None, 'stop_sequence': None,
+            'usage': {'input_tokens': prompt_tokens, 'output_tokens': 1}}})
+        yield event('content_block_start', {'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        for text in batches:
+            yield None
+            yield event('content_block_delta', {'index': 0, 'delta': {'type': 'text_delta', 'text': text}})
+        yield event('content_block_stop', {'index': 0})
+        yield event('message_delta', {'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                      'usage': {'output_tokens': len(tokens)}})
+        yield event('message_stop', {})
+
+    def send_rate_limited(self, style):
+        if style == 'anthropic':
+            body = {'type': 'error', 'error': {'type': 'rate_limit_error', 'message': 'Rate limit simulado.'}}
+        else:
+            body = {'error': {'message': 'Rate limit simulado.', 'type': 'rate_limit_exceeded',
+                              'code': 'rate_limit_exceeded'}}
+        self.send_json(429, body, {'Retry-After': str(self.provider.retry_after)})
+
+    # --- E/S ---
+
+    def send_json(self, status, data, headers=None):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Proveedor simulado compatible con OpenAI, Anthropic y Mistral.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.3, help="Segundos hasta el primer byte.")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="Variación uniforme (+/-) de la latencia.")
+    parser.add_argument('--tokens-per-sec', type=float, default=100, help="Velocidad de generación (0 = instantánea).")
+    parser.add_argument('--response-tokens', type=int, default=200, help="Tokens por respuesta (acotados por max_tokens).")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fracción de peticiones que reciben un 429.")
+    parser.add_argument('--retry-after', type=float, default=1, help="Valor de la cabecera Retry-After de los 429.")
+    parser.add_argument('--seed', type=int, help="Semilla para que la inyección de 429 sea reproducible.")
+    return parser.parse_args(argv)
+
+
+def make_server(args):
+    handler = type('FakeProviderHandler', (Handler,), {'provider': FakeProvider(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    server = make_server(args)
+    print(f"Proveedor simulado escuchando en http://{args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,385 @@
+# benchmarks/load_test.py
+# Prueba de carga de /compare y /conversation con modelos Mock configurables.
+#
+# Uso:
+#   python benchmarks/load_test.py --concurrency 1,4,16,64 --duration 15
+#   python benchmarks/load_test.py --baseline benchmarks/results/bench-20260101-120000.json
+#   python benchmarks/load_test.py --diff antes.json despues.json
+#   python benchmarks/load_test.py --fake-provider --fake-provider-args "--latency 0.3 --rate-429 0.02"
+#
+# Por defecto arranca la aplicación (waitress) en un directorio temporal con benchmarks/models.json,
+# un usuario de prueba y el rate limiting desactivado. Con --fake-provider usa los conectores reales
+# (benchmarks/models.fake.json) contra el proveedor simulado de benchmarks/fake_provider.py.
+# Con --no-launch se mide un servidor ya en marcha en --url (--pid permite muestrear su memoria e hilos).
+#
+# Cada paso (endpoint x concurrencia) mantiene N clientes enviando peticiones sin pausa durante
+# --duration segundos y mide rendimiento, p50/p95/p99 y memoria/hilos del servidor. El resultado
+# se guarda en JSON para poder comparar versiones (--baseline / --diff).
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+from werkzeug.security import generate_password_hash
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+QUANTILES = (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))
+# Métricas que se comparan con --baseline/--diff: (clave, True si mayor es mejor).
+COMPARED_METRICS = (('throughput_rps', True), ('p50', False), ('p95', False), ('p99', False),
+                    ('max_rss_mb', False))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class ProcessSampler:
+    """Muestrea la memoria residente y el número de hilos de un proceso (Linux, /proc)."""
+
+    def __init__(self, pid, interval=0.2):
+        self.path = f"/proc/{pid}/status" if pid else None
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def read(self):
+        if not self.path or not os.path.exists(self.path):
+            return None
+        values = {}
+        with open(self.path, 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmRSS', 'Threads'):
+                    values[key] = int(value.split()[0])
+        return {'rss_mb': values.get('VmRSS', 0) / 1024, 'threads': values.get('Threads', 0)}
+
+    def start(self):
+        self.samples = []
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(self.interval):
+                sample = self.read()
+                if sample:
+                    self.samples.append(sample)
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if not self.samples:
+            return {'max_rss_mb': None, 'max_threads': None}
+        return {
+            'max_rss_mb': round(max(s['rss_mb'] for s in self.samples), 1),
+            'max_threads': max(s['threads'] for s in self.samples),
+        }
+
+
+class Client:
+    """Cliente HTTP con conexión persistente (uno por hilo de carga)."""
+
+    def __init__(self, url, auth_header, timeout):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.auth_header = auth_header
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        if self.conn is None:
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        headers = {'Authorization': self.auth_header, 'Content-Type': 'application/json'}
+        try:
+            self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+            return response.status, data
+        except Exception:
+            self.conn.close()
+            self.conn = None
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def run_step(args, auth_header, endpoint, concurrency, sampler):
+    """Mantiene `concurrency` clientes sin pausa durante `args.duration` segundos."""
+    payload = {'prompt': args.prompt, 'options': {}}
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    end = time.time() + args.duration
+
+    def worker():
+        client = Client(args.url, auth_header, args.request_timeout)
+        local_latencies = []
+        local_errors = {}
+        while time.time() < end:
+            start = time.perf_counter()
+            try:
+                status, _ = client.request('POST', endpoint, payload)
+                key = None if status == 200 else f"http_{status}"
+            except Exception as e:
+                key = type(e).__name__
+            if key is None:
+                local_latencies.append(time.perf_counter() - start)
+            else:
+                local_errors[key] = local_errors.get(key, 0) + 1
+        client.close()
+        with lock:
+            latencies.extend(local_latencies)
+            for key, count in local_errors.items():
+                errors[key] = errors.get(key, 0) + count
+
+    sampler.start()
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    elapsed = time.time() - started
+    process = sampler.stop()
+
+    latencies.sort()
+    step = {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'duration_sec': round(elapsed, 3),
+        'requests': len(latencies) + sum(errors.values()),
+        'ok': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 3),
+        'mean': round(sum(latencies) / len(latencies), 4) if latencies else None,
+        'max': round(latencies[-1], 4) if latencies else None,
+    }
+    for label, q in QUANTILES:
+        value = percentile(latencies, q)
+        step[label] = round(value, 4) if value is not None else None
+    step.update(process)
+    step['server_status'] = fetch_status(args, auth_header)
+    return step
+
+
+def fetch_status(args, auth_header):
+    """Contadores internos del servidor al final del paso (pool, proveedores)."""
+    try:
+        status, data = Client(args.url, auth_header, 10).request('GET', '/status')
+        if status != 200:
+            return None
+        info = json.loads(data)
+        return {key: info.get(key) for key in ('model_pool', 'error_counts', 'providers', 'in_flight_requests')}
+    except Exception:
+        return None
+
+
+def start_fake_provider(args):
+    """Arranca benchmarks/fake_provider.py y espera a que responda."""
+    command = [sys.executable, os.path.join(BENCH_DIR, 'fake_provider.py'),
+               '--port', str(args.fake_provider_port)] + shlex.split(args.fake_provider_args)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+    wait_until_up(f"http://127.0.0.1:{args.fake_provider_port}", '/stats', process, 'El proveedor simulado')
+    return process
+
+
+def wait_until_up(url, path, process, label, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{label} terminó al arrancar.")
+        try:
+            Client(url, '', 2).request('GET', path)
+            return
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{label} no respondió en {timeout} s.")
+
+
+def start_server(args):
+    """Arranca app.py en un directorio temporal con los modelos de prueba. Devuelve (proceso, directorio)."""
+    workdir = tempfile.mkdtemp(prefix='prompt-compare-bench-')
+    with open(args.models_file, 'r', encoding='utf-8') as f:
+        models = json.load(f)
+    if args.fake_provider:
+        # Los modelos con 'base_url' apuntan al proveedor simulado en el puerto elegido.
+        for model in models['models']:
+            if 'base_url' in model:
+                model['base_url'] = f"http://127.0.0.1:{args.fake_provider_port}"
+    with open(os.path.join(workdir, 'models.json'), 'w', encoding='utf-8') as f:
+        json.dump(models, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(workdir, 'users.json'), 'w') as f:
+        json.dump({args.user: generate_password_hash(args.password)}, f)
+
+    env = dict(os.environ,
+               PORT=str(urlparse(args.url).port),
+               RATELIMIT_ENABLED='false',
+               WAITRESS_THREADS=str(args.server_threads),
+               MODELS_RELOAD_INTERVAL='0',
+               FAKE_PROVIDER_API_KEY='fake')
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, 'app.py')], cwd=workdir, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    wait_until_up(args.url, '/status', process, f"El servidor (ver {workdir}/server.log)")
+    return process, workdir
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_step(step):
+    errors = sum(step['errors'].values())
+    rss = f"{step['max_rss_mb']} MB" if step['max_rss_mb'] is not None else '-'
+    print(f"{step['endpoint']:<14} c={step['concurrency']:<4} {step['throughput_rps']:>8.2f} req/s  "
+          f"p50 {step['p50'] or 0:.3f}  p95 {step['p95'] or 0:.3f}  p99 {step['p99'] or 0:.3f} s  "
+          f"errores {errors:<4} RSS {rss}  hilos {step['max_threads'] or '-'}", flush=True)
+
+
+def compare_runs(baseline, current, threshold):
+    """Imprime la variación de cada paso respecto a la referencia. Devuelve el número de regresiones."""
+    reference = {(s['endpoint'], s['concurrency']): s for s in baseline['steps']}
+    regressions = 0
+    print(f"\nComparación con {baseline.get('git_commit') or '?'} ({baseline.get('created_at')}):")
+    for step in current['steps']:
+        old = reference.get((step['endpoint'], step['concurrency']))
+        if old is None:
+            continue
+        changes = []
+        for key, higher_is_better in COMPARED_METRICS:
+            if not old.get(key) or step.get(key) is None:
+                continue
+            delta = (step[key] - old[key]) / old[key] * 100
+            worse = delta < -threshold if higher_is_better else delta > threshold
+            regressions += worse
+            changes.append(f"{key} {delta:+.1f}%{' (!)' if worse else ''}")
+        print(f"  {step['endpoint']:<14} c={step['concurrency']:<4} " + '  '.join(changes))
+    if regressions:
+        print(f"{regressions} métricas empeoran más de un {threshold}%.")
+    return regressions
+
+
+def load_run(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga de /compare y /conversation con modelos Mock.")
+    parser.add_argument('--url', default='http://127.0.0.1:3657', help="URL del servidor.")
+    parser.add_argument('--no-launch', action='store_true', help="No arrancar la aplicación: medir --url tal cual.")
+    parser.add_argument('--pid', type=int, help="PID del servidor externo para muestrear memoria e hilos.")
+    parser.add_argument('--user', default='bench', help="Usuario de Basic auth.")
+    parser.add_argument('--password', default='bench', help="Contraseña de Basic auth.")
+    parser.add_argument('--models-file', help="models.json de la prueba (por defecto benchmarks/models.json, "
+                                              "o benchmarks/models.fake.json con --fake-provider).")
+    parser.add_argument('--fake-provider', action='store_true',
+                        help="Arrancar benchmarks/fake_provider.py y usar los conectores reales contra él.")
+    parser.add_argument('--fake-provider-port', type=int, default=8765)
+    parser.add_argument('--fake-provider-args', default='', help="Opciones para fake_provider.py (latencia, 429...).")
+    parser.add_argument('--server-threads', type=int, default=int(os.getenv('WAITRESS_THREADS', 4)),
+                        help="Hilos de waitress del servidor arrancado.")
+    parser.add_argument('--endpoints', default='/compare,/conversation', help="Endpoints separados por comas.")
+    parser.add_argument('--concurrency', default='1,4,16,64', help="Niveles de concurrencia separados por comas.")
+    parser.add_argument('--duration', type=float, default=10, help="Segundos por paso.")
+    parser.add_argument('--request-timeout', type=float, default=120, help="Timeout de cada petición HTTP.")
+    parser.add_argument('--prompt', default='Explica en una frase qué es la latencia de cola.')
+    parser.add_argument('-o', '--output', help="Fichero JSON de salida (por defecto benchmarks/results/bench-<fecha>.json).")
+    parser.add_argument('--baseline', help="Resultado anterior con el que comparar al terminar.")
+    parser.add_argument('--diff', nargs=2, metavar=('ANTES', 'DESPUES'), help="Solo comparar dos resultados guardados.")
+    parser.add_argument('--regression-threshold', type=float, default=10,
+                        help="Porcentaje a partir del cual un cambio cuenta como regresión.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.models_file:
+        args.models_file = os.path.join(BENCH_DIR, 'models.fake.json' if args.fake_provider else 'models.json')
+    if args.diff:
+        return 1 if compare_runs(load_run(args.diff[0]), load_run(args.diff[1]), args.regression_threshold) else 0
+
+    process = workdir = fake_provider = None
+    pid = args.pid
+    if args.fake_provider:
+        fake_provider = start_fake_provider(args)
+    if not args.no_launch:
+        process, workdir = start_server(args)
+        pid = process.pid
+    auth_header = 'Basic ' + base64.b64encode(f"{args.user}:{args.password}".encode()).decode()
+    sampler = ProcessSampler(pid)
+
+    models = None
+    if not args.no_launch:
+        with open(args.models_file, 'r', encoding='utf-8') as f:
+            models = json.load(f)['models']
+    run = {
+        'format': 1,
+        'created_at': datetime.now().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: getattr(args, key) for key in ('url', 'server_threads', 'duration', 'prompt',
+                                                         'fake_provider', 'fake_provider_args')},
+        'models': models,
+        'idle': sampler.read(),
+        'steps': [],
+    }
+    try:
+        endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+        levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+        for endpoint in endpoints:
+            # Una petición de calentamiento: instancias de los modelos, imports perezosos, etc.
+            Client(args.url, auth_header, args.request_timeout).request(
+                'POST', endpoint, {'prompt': args.prompt, 'options': {}})
+            for concurrency in levels:
+                step = run_step(args, auth_header, endpoint, concurrency, sampler)
+                run['steps'].append(step)
+                print_step(step)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+            shutil.rmtree(workdir, ignore_errors=True)
+        if fake_provider is not None:
+            fake_provider.terminate()
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(run, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {output}")
+
+    if args.baseline:
+        return 1 if compare_runs(load_run(args.baseline), run, args.regression_threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,3 @@
+# Este paquete agrupa los servicios internos de la aplicación (pool de llamadas,
+# métricas, caché, etc.) para que app.py se limite a definir las rutas.
+# Se importan módulo a módulo (ej: from services.executor import ModelCallExecutor).
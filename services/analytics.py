@@ -0,0 +1,309 @@
+# services/analytics.py
+import re
+from collections import defaultdict
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Similitud coseno a partir de la cual dos respuestas se consideran de acuerdo.
+DEFAULT_AGREEMENT_THRESHOLD = 0.5
+
+
+class ResponseBatch:
+    """
+    Respuestas de muchas comparaciones aplanadas en columnas (una fila por respuesta).
+
+    Las respuestas de una misma comparación quedan contiguas y comparten `group`; solo se
+    comparan entre sí las de la misma comparación.
+    """
+
+    def __init__(self):
+        self.texts = []
+        self.models = []
+        self.groups = []
+        self.latencies = []
+        self.comparisons = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, responses):
+        """Añade una comparación: [(modelo, texto, latencia en segundos o None)]."""
+        if not responses:
+            return
+        for model, text, latency in responses:
+            self.texts.append(text)
+            self.models.append(model)
+            self.groups.append(self.comparisons)
+            self.latencies.append(np.nan if latency is None else latency)
+        self.comparisons += 1
+
+    def add_results(self, results):
+        """Añade una comparación a partir de {modelo: ModelResult}; los errores no cuentan."""
+        self.add([(name, result.text, result.latency) for name, result in results.items()
+                  if result.error_kind is None])
+
+    def add_record(self, record, models=None):
+        """
+        Añade un registro guardado del modo Comparar (o del procesamiento por lotes),
+        opcionalmente solo con las respuestas de `models`.
+        """
+        results = record.get('results')
+        if not isinstance(results, dict):
+            return
+        details = record.get('details') or {}
+        responses = []
+        for model, text in results.items():
+            meta = details.get(model) or {}
+            if model.startswith('_') or meta.get('error_kind') or not isinstance(text, str):
+                continue
+            if models is not None and model not in models:
+                continue
+            responses.append((model, text, meta.get('total_sec')))
+        self.add(responses)
+
+
+def _term_matrix(texts):
+    """
+    Matriz documento-término dispersa en formato de coordenadas (doc, término, peso):
+    unigramas y bigramas, tf sublineal por idf suavizado y normalización L2 por documento.
+    """
+    vocab = defaultdict()
+    vocab.default_factory = vocab.__len__
+    lengths = np.empty(len(texts), dtype=np.int64)
+    ids = []
+    for index, text in enumerate(texts):
+        words = _TOKEN_RE.findall(text.lower())
+        lengths[index] = len(words)
+        ids.extend(map(vocab.__getitem__, words))
+    unigrams = np.asarray(ids, dtype=np.int64)
+    docs = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    if not len(unigrams):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, np.empty(0)
+
+    # Bigramas: pares de unigramas consecutivos del mismo documento, renumerados tras el vocabulario.
+    vocab_size = len(vocab)
+    same_doc = docs[1:] == docs[:-1]
+    bigram_keys = unigrams[:-1][same_doc] * vocab_size + unigrams[1:][same_doc]
+    _, bigrams = np.unique(bigram_keys, return_inverse=True)
+    terms = np.concatenate([unigrams, vocab_size + bigrams])
+    docs = np.concatenate([docs, docs[:-1][same_doc]])
+
+    n_terms = int(terms.max()) + 1
+    keys, counts = np.unique(docs * n_terms + terms, return_counts=True)
+    docs, terms = np.divmod(keys, n_terms)
+    df = np.bincount(terms, minlength=n_terms)
+    idf = np.log((1 + len(texts)) / (1 + df)) + 1
+    weights = (1 + np.log(counts)) * idf[terms]
+    norms = np.sqrt(np.bincount(docs, weights=weights ** 2, minlength=len(texts)))
+    return docs, terms, weights / norms[docs]
+
+
+def _pairs(groups):
+    """Todos los pares (a, b), a < b, de respuestas de la misma comparación."""
+    sizes = np.bincount(groups)
+    first, second = [], []
+    for offset in range(1, int(sizes.max()) if len(sizes) else 0):
+        index = np.nonzero(groups[:-offset] == groups[offset:])[0]
+        first.append(index)
+        second.append(index + offset)
+    if not first:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(first), np.concatenate(second)
+
+
+def _similarities(docs, terms, weights, groups, first, second, n_docs):
+    """Similitud coseno de cada par (first[i], second[i]) como suma de productos de términos comunes."""
+    similarity = np.zeros(len(first))
+    if not len(first) or not len(docs):
+        return similarity
+    # Ordenadas por (comparación, término, documento), las entradas que multiplicar quedan a
+    # distancia menor que el tamaño de la comparación: basta un desplazamiento por distancia.
+    # Las entradas ya vienen ordenadas por documento, así que basta una ordenación estable.
+    term_groups = groups[docs]
+    order = np.argsort(term_groups * (int(terms.max()) + 1) + terms, kind='stable')
+    docs, terms, weights, term_groups = docs[order], terms[order], weights[order], term_groups[order]
+    pair_keys = first * n_docs + second
+    sort = np.argsort(pair_keys)
+    sorted_keys = pair_keys[sort]
+    for offset in range(1, int(np.bincount(groups).max())):
+        match = np.nonzero((terms[:-offset] == terms[offset:]) & (term_groups[:-offset] == term_groups[offset:]))[0]
+        if not len(match):
+            break
+        keys = docs[match] * n_docs + docs[match + offset]
+        position = sort[np.searchsorted(sorted_keys, keys)]
+        similarity += np.bincount(position, weights=weights[match] * weights[match + offset],
+                                  minlength=len(first))
+    return np.clip(similarity, 0.0, 1.0)
+
+
+def _clusters(n_docs, first, second, agree):
+    """Componentes conexas del grafo de acuerdo: etiqueta = índice mínimo de la componente."""
+    labels = np.arange(n_docs)
+    a, b = first[agree], second[agree]
+    while len(a):
+        previous = labels.copy()
+        np.minimum.at(labels, a, labels[b])
+        np.minimum.at(labels, b, labels[a])
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            break
+    return labels
+
+
+def analyze(batch, threshold=DEFAULT_AGREEMENT_THRESHOLD):
+    """
+    Analítica vectorizada de un `ResponseBatch`. Devuelve columnas NumPy:
+
+    - por respuesta: 'length_ratio' (caracteres frente a la media de su comparación),
+      'latency_ratio' (latencia frente a la más rápida de su comparación; NaN sin latencia),
+      'cluster' (respuestas de acuerdo entre sí, directa o transitivamente) y 'agrees'
+      (si su grupo de acuerdo es el mayor de la comparación y tiene al menos dos miembros);
+    - por par de la misma comparación: 'first', 'second' y 'similarity' (coseno TF-IDF de
+      unigramas y bigramas);
+    - por comparación: 'consensus' (fracción de respuestas en el mayor grupo de acuerdo).
+    """
+    n_docs = len(batch)
+    groups = np.asarray(batch.groups, dtype=np.int64)
+    sizes = np.bincount(groups, minlength=batch.comparisons)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+
+    lengths = np.fromiter(map(len, batch.texts), dtype=np.float64, count=n_docs)
+    latencies = np.asarray(batch.latencies, dtype=np.float64)
+    if n_docs:
+        mean_length = np.add.reduceat(lengths, starts) / sizes
+        fastest = np.fmin.reduceat(latencies, starts)
+    else:
+        mean_length = fastest = np.empty(0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        length_ratio = np.where(mean_length[groups] > 0, lengths / mean_length[groups], 1.0)
+        latency_ratio = np.where(fastest[groups] > 0, latencies / fastest[groups], np.nan)
+
+    docs, terms, weights = _term_matrix(batch.texts)
+    first, second = _pairs(groups)
+    similarity = _similarities(docs, terms, weights, groups, first, second, n_docs)
+    cluster = _clusters(n_docs, first, second, similarity >= threshold)
+
+    # Tamaño de cada grupo de acuerdo y el mayor de cada comparación.
+    cluster_size = np.bincount(cluster, minlength=n_docs)[cluster]
+    largest = np.zeros(batch.comparisons, dtype=np.int64)
+    np.maximum.at(largest, groups, cluster_size)
+    # En caso de empate entre grupos del mismo tamaño, el de etiqueta menor.
+    candidate = np.where(cluster_size == largest[groups], cluster, n_docs)
+    majority = np.full(batch.comparisons, n_docs, dtype=np.int64)
+    np.minimum.at(majority, groups, candidate)
+    agrees = (cluster == majority[groups]) & (cluster_size > 1)
+
+    return {
+        'groups': groups,
+        'length_ratio': length_ratio,
+        'latency_ratio': latency_ratio,
+        'cluster': cluster,
+        'agrees': agrees,
+        'first': first,
+        'second': second,
+        'similarity': similarity,
+        'consensus': largest / np.maximum(sizes, 1),
+        'sizes': sizes,
+    }
+
+
+def _round(value, digits=3):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def comparison_analytics(results, threshold=DEFAULT_AGREEMENT_THRESHOLD):
+    """
+    Analítica de una sola comparación ({modelo: ModelResult}) para la clave '_analytics'
+    de /compare: similitud entre cada par de modelos, proporciones de longitud y latencia,
+    grupos de acuerdo y consenso. Los modelos con error se omiten.
+    """
+    batch = ResponseBatch()
+    batch.add_results(results)
+    if not len(batch):
+        return {'models': [], 'similarity': {}, 'length_ratio': {}, 'latency_ratio': {}, 'clusters': [],
+                'consensus': None, 'threshold': threshold}
+    report = analyze(batch, threshold)
+    models = batch.models
+    similarity = {model: {} for model in models}
+    for a, b, value in zip(report['first'], report['second'], report['similarity']):
+        similarity[models[a]][models[b]] = similarity[models[b]][models[a]] = _round(value)
+    clusters = defaultdict(list)
+    for model, label in zip(models, report['cluster']):
+        clusters[label].append(model)
+    return {
+        'models': models,
+        'similarity': similarity,
+        'length_ratio': {model: _round(value) for model, value in zip(models, report['length_ratio'])},
+        'latency_ratio': {model: _round(value) for model, value in zip(models, report['latency_ratio'])},
+        'clusters': sorted(clusters.values(), key=len, reverse=True),
+        'consensus': _round(report['consensus'][0]),
+        'threshold': threshold,
+    }
+
+
+def history_report(batch, threshold=DEFAULT_AGREEMENT_THRESHOLD):
+    """
+    Informe agregado de muchas comparaciones: por modelo (respuestas, proporciones medias
+    de longitud y latencia, tasa de acuerdo con la mayoría y de respuestas aisladas) y por
+    par de modelos (comparaciones en común, similitud media y tasa de acuerdo).
+    """
+    report = analyze(batch, threshold)
+    names, model_ids = np.unique(np.asarray(batch.models, dtype=object), return_inverse=True)
+    n_models = len(names)
+    # Solo cuentan para el acuerdo las respuestas de comparaciones con más de un modelo.
+    shared = report['sizes'][report['groups']] > 1
+    isolated = shared & (np.bincount(report['cluster'], minlength=len(batch))[report['cluster']] == 1)
+
+    def per_model(values, mask=None):
+        mask = np.ones(len(batch), dtype=bool) if mask is None else mask
+        valid = mask & ~np.isnan(values)
+        counts = np.bincount(model_ids[valid], minlength=n_models)
+        sums = np.bincount(model_ids[valid], weights=values[valid], minlength=n_models)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    responses = np.bincount(model_ids, minlength=n_models)
+    length_ratio = per_model(report['length_ratio'])
+    latency_ratio = per_model(report['latency_ratio'])
+    agreement = per_model(report['agrees'].astype(np.float64), shared)
+    outliers = per_model(isolated.astype(np.float64), shared)
+
+    # Pares de modelos: el par se ordena por id de modelo para que (a, b) y (b, a) coincidan.
+    a, b = model_ids[report['first']], model_ids[report['second']]
+    pair_ids = np.minimum(a, b) * n_models + np.maximum(a, b)
+    pair_counts = np.bincount(pair_ids, minlength=n_models * n_models)
+    pair_similarity = np.bincount(pair_ids, weights=report['similarity'], minlength=n_models * n_models)
+    pair_agree = np.bincount(pair_ids, weights=(report['similarity'] >= threshold).astype(np.float64),
+                             minlength=n_models * n_models)
+
+    pairs = []
+    for pair in np.nonzero(pair_counts)[0]:
+        count = pair_counts[pair]
+        pairs.append({
+            'models': [names[pair // n_models], names[pair % n_models]],
+            'comparisons': int(count),
+            'mean_similarity': _round(pair_similarity[pair] / count),
+            'agreement_rate': _round(pair_agree[pair] / count),
+        })
+    pairs.sort(key=lambda entry: entry['mean_similarity'], reverse=True)
+
+    return {
+        'comparisons': int(batch.comparisons),
+        'responses': len(batch),
+        'threshold': threshold,
+        'mean_consensus': _round(report['consensus'][report['sizes'] > 1].mean()) if (report['sizes'] > 1).any() else None,
+        'models': {
+            names[index]: {
+                'responses': int(responses[index]),
+                'mean_length_ratio': _round(length_ratio[index]),
+                'mean_latency_ratio': _round(latency_ratio[index]),
+                'agreement_rate': _round(agreement[index]),
+                'outlier_rate': _round(outliers[index]),
+            } for index in range(n_models)
+        },
+        'pairs': pairs,
+    }
@@ -0,0 +1,64 @@
+# services/async_runtime.py
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    """
+    Bucle de eventos asyncio de larga duración que corre en un hilo en segundo plano.
+
+    Las rutas síncronas de Flask le entregan corrutinas con `run()`. Como todas las
+    llamadas asíncronas a los proveedores se ejecutan en este mismo bucle, los clientes
+    asíncronos de los SDK (ligados al bucle donde se usan) pueden reutilizarse entre
+    peticiones, y miles de llamadas en curso cuestan corrutinas en lugar de hilos.
+    """
+
+    def __init__(self, name='async-runtime'):
+        self.name = name
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run_loop, name=self.name, daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            logger.info(f"Bucle de eventos '{self.name}' iniciado.")
+            return loop
+
+    def submit(self, coro):
+        """Programa la corrutina en el bucle y devuelve un `concurrent.futures.Future`."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+
+    def run(self, coro, timeout=None):
+        """Ejecuta la corrutina en el bucle compartido y espera su resultado."""
+        future = self.submit(coro)
+        try:
+            return future.result(timeout=timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def stop(self):
+        with self._lock:
+            if self._loop is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._loop = None
+            self._thread = None
@@ -0,0 +1,142 @@
+# services/auth.py
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.security import check_password_hash
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialStore:
+    """
+    Usuarios de users.json con verificación rápida de credenciales.
+
+    `check_password_hash` (scrypt/pbkdf2) cuesta decenas de milisegundos de CPU, así que
+    tras una verificación correcta se guarda el HMAC de (usuario, contraseña) con una clave
+    aleatoria del proceso durante `cache_ttl` segundos: las peticiones siguientes solo
+    calculan un HMAC-SHA256. La contraseña nunca se guarda, y la caché se vacía cuando
+    users.json cambia. Los fallos no se cachean: cada intento erróneo paga el hash completo.
+    """
+
+    def __init__(self, path='users.json', reload_interval=2.0, cache_ttl=300, max_entries=1024):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.cache_ttl = cache_ttl
+        self.max_entries = max_entries
+        self._secret = os.urandom(32)
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # hmac -> (usuario, hash de users.json, caduca_en)
+        self._users = {}
+        self._file_signature = None
+        self._loaded = False
+        self._watcher = None
+        self._stop = threading.Event()
+        self.counters = {'cache_hits': 0, 'cache_misses': 0, 'failures': 0, 'reloads': 0}
+        self.reload(force=True)
+
+    # --- Carga de users.json ---
+
+    def _read_signature(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def reload(self, force=False):
+        """Recarga users.json si ha cambiado. Devuelve True si se cargó una versión nueva."""
+        signature = self._read_signature()
+        if not force and signature == self._file_signature:
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                users = json.load(f)
+            if not isinstance(users, dict):
+                raise ValueError("users.json debe ser un objeto {usuario: hash}.")
+        except (FileNotFoundError, json.JSONDecodeError, ValueError):
+            self._file_signature = signature
+            if not self._loaded:
+                logger.error("Error: 'users.json' no encontrado o con formato incorrecto. La autenticación no funcionará.")
+            else:
+                # Se conservan los últimos usuarios válidos.
+                logger.error("Error al recargar 'users.json'; se mantienen los usuarios anteriores.")
+            return False
+
+        with self._lock:
+            self._file_signature = signature
+            self._users = users
+            self._cache.clear()
+            if self._loaded:
+                self.counters['reloads'] += 1
+                logger.info(f"users.json recargado: {len(users)} usuarios.")
+            self._loaded = True
+        return True
+
+    def start_watching(self):
+        if self._watcher is not None or self.reload_interval <= 0:
+            return
+
+        def watch():
+            while not self._stop.wait(self.reload_interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error(f"Error al recargar los usuarios: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='users-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    # --- Verificación ---
+
+    def _cache_key(self, username, password):
+        message = username.encode('utf-8') + b'\0' + password.encode('utf-8')
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def check(self, username, password):
+        """Verifica usuario y contraseña; con un acierto en caché cuesta un HMAC."""
+        if username is None or password is None:
+            return False
+        key = self._cache_key(username, password)
+        now = time.time()
+        with self._lock:
+            users = self._users
+            stored_hash = users.get(username)
+            entry = self._cache.get(key)
+            if entry is not None:
+                cached_user, cached_hash, expires_at = entry
+                # La entrada solo vale si no ha caducado y el hash del usuario sigue siendo el mismo.
+                if now < expires_at and cached_user == username and cached_hash == stored_hash:
+                    self.counters['cache_hits'] += 1
+                    return True
+                del self._cache[key]
+            self.counters['cache_misses'] += 1
+
+        if stored_hash is None or not check_password_hash(stored_hash, password):
+            with self._lock:
+                self.counters['failures'] += 1
+            return False
+
+        with self._lock:
+            # Si users.json cambió durante la verificación no se cachea el resultado.
+            if self._users is users and self.cache_ttl > 0:
+                self._cache[key] = (username, stored_hash, now + self.cache_ttl)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'users': len(self._users),
+                'cached_credentials': len(self._cache),
+            }
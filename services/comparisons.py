@@ -0,0 +1,194 @@
+# services/comparisons.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from ai_models.base_model import ModelResult
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS comparisons (
+    id TEXT PRIMARY KEY,
+    results TEXT NOT NULL,
+    pending TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    completed_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_comparisons_completed ON comparisons (completed_at);
+"""
+
+
+class Comparison:
+    """Una comparación devuelta antes de que respondieran todos los modelos."""
+    __slots__ = ('id', 'prompt', 'results', 'pending', 'claimed', 'created_at',
+                 'expires_at', 'completed_at', 'on_expire', 'on_complete')
+
+    def __init__(self, comparison_id, prompt, results, pending, expires_at, on_expire, on_complete):
+        self.id = comparison_id
+        self.prompt = prompt
+        self.results = dict(results)  # modelo -> ModelResult
+        self.pending = dict(pending)  # modelo -> manejador de la llamada en curso
+        self.claimed = set()  # modelos pendientes que ya está resolviendo alguien
+        self.created_at = time.time()
+        self.expires_at = expires_at
+        self.completed_at = None
+        self.on_expire = on_expire
+        self.on_complete = on_complete
+
+
+class ComparisonTracker:
+    """
+    Comparaciones con modelos rezagados, en un SQLite local (modo WAL) que comparten los
+    trabajadores: cualquiera de ellos responde a `get`, aunque la comparación la empezara otro.
+
+    Las llamadas en curso solo existen en el proceso que empezó la comparación, así que es
+    él quien resuelve cada modelo pendiente cuando llega su respuesta (`resolve`) o, si vence
+    su plazo sin que nadie lo haya resuelto, quien lo da por agotado desde un hilo barrendero
+    llamando a `on_expire(modelo, manejador)`, que devuelve el resultado de error. Cuando no queda ninguno se llama a
+    `on_complete(comparación)` (para persistirla) y se conserva `retention` segundos
+    más para que el cliente pueda recogerla. Quien vaya a calcular el resultado de un
+    modelo pendiente (con efectos como registrar métricas) lo reserva antes con `claim`,
+    de modo que la respuesta tardía y el vencimiento nunca se procesan los dos.
+    """
+
+    def __init__(self, path, retention=600, max_entries=1000, sweep_interval=1.0):
+        self.path = path
+        self.retention = retention
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._db = self._connect(path)
+        self._entries = {}  # id -> Comparison con modelos pendientes (solo las de este proceso)
+        self.counters = {'started': 0, 'completed': 0, 'late_arrivals': 0, 'expired_models': 0, 'evicted': 0}
+        self._sweeper = threading.Thread(target=self._sweep_loop, name='comparison-sweeper', daemon=True)
+        self._sweeper.start()
+
+    @staticmethod
+    def _connect(path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript(_SCHEMA)
+        return db
+
+    @staticmethod
+    def _encode_results(results):
+        return json.dumps({name: {'text': result.text, **result.meta()} for name, result in results.items()},
+                          ensure_ascii=False, default=str)
+
+    @staticmethod
+    def _decode_results(data):
+        return {name: ModelResult.from_meta(entry.pop('text'), entry) for name, entry in json.loads(data).items()}
+
+    def start(self, prompt, results, pending, expires_at, on_expire, on_complete):
+        """Registra una comparación parcial. `pending` es {modelo: manejador}. Devuelve su id."""
+        comparison = Comparison(uuid.uuid4().hex, prompt, results, pending, expires_at, on_expire, on_complete)
+        with self._lock:
+            self._db.execute('INSERT INTO comparisons (id, results, pending, created_at, expires_at) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (comparison.id, self._encode_results(comparison.results),
+                              json.dumps(sorted(comparison.pending), ensure_ascii=False),
+                              comparison.created_at, expires_at))
+            self._entries[comparison.id] = comparison
+            self.counters['started'] += 1
+            self._evict()
+        return comparison.id
+
+    def claim(self, comparison_id, model_name):
+        """Reserva un modelo pendiente para resolverlo. Devuelve False si ya lo reservó otro."""
+        with self._lock:
+            comparison = self._entries.get(comparison_id)
+            if comparison is None or model_name not in comparison.pending or model_name in comparison.claimed:
+                return False
+            comparison.claimed.add(model_name)
+            return True
+
+    def resolve(self, comparison_id, model_name, result, late=True):
+        """Anota el resultado de un modelo pendiente. Se ignora si ya estaba resuelto."""
+        with self._lock:
+            comparison = self._entries.get(comparison_id)
+            if comparison is None or comparison.pending.pop(model_name, None) is None:
+                return
+            comparison.results[model_name] = result
+            if late:
+                self.counters['late_arrivals'] += 1
+            finished = not comparison.pending
+            if finished:
+                comparison.completed_at = time.time()
+                self.counters['completed'] += 1
+                del self._entries[comparison_id]
+            try:
+                self._db.execute('UPDATE comparisons SET results = ?, pending = ?, completed_at = ? WHERE id = ?',
+                                 (self._encode_results(comparison.results),
+                                  json.dumps(sorted(comparison.pending), ensure_ascii=False),
+                                  comparison.completed_at, comparison_id))
+            except sqlite3.Error as e:
+                logger.error(f"Error al guardar la comparación {comparison_id}: {e}")
+        if finished and comparison.on_complete is not None:
+            try:
+                comparison.on_complete(comparison)
+            except Exception as e:
+                logger.error(f"Error al completar la comparación {comparison_id}: {e}")
+
+    def get(self, comparison_id):
+        """Estado actual: (resultados hasta ahora, modelos pendientes), o None si no existe o ha caducado."""
+        with self._lock:
+            row = self._db.execute('SELECT results, pending FROM comparisons WHERE id = ?',
+                                   (comparison_id,)).fetchone()
+        if row is None:
+            return None
+        return self._decode_results(row[0]), json.loads(row[1])
+
+    # --- Mantenimiento ---
+
+    def _evict(self):
+        """Descarta las comparaciones terminadas más antiguas si se supera `max_entries`."""
+        cursor = self._db.execute(
+            'DELETE FROM comparisons WHERE id IN (SELECT id FROM comparisons WHERE completed_at IS NOT NULL '
+            'ORDER BY completed_at LIMIT MAX((SELECT COUNT(*) FROM comparisons) - ?, 0))', (self.max_entries,))
+        self.counters['evicted'] += max(cursor.rowcount, 0)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error al revisar las comparaciones pendientes: {e}")
+
+    def sweep(self):
+        now = time.time()
+        expired = []
+        with self._lock:
+            # Las terminadas caducan tras `retention`; las que dejó a medias un proceso que ya no
+            # existe, `retention` segundos después de su plazo.
+            self._db.execute('DELETE FROM comparisons WHERE completed_at < ? '
+                             'OR (completed_at IS NULL AND expires_at < ?)', (now - self.retention, now - self.retention))
+            for comparison in self._entries.values():
+                if now >= comparison.expires_at:
+                    for name, handle in comparison.pending.items():
+                        if name not in comparison.claimed:
+                            comparison.claimed.add(name)
+                            expired.append((comparison, name, handle))
+            self.counters['expired_models'] += len(expired)
+        for comparison, model_name, handle in expired:
+            self.resolve(comparison.id, model_name, comparison.on_expire(model_name, handle), late=False)
+
+    def stats(self):
+        with self._lock:
+            tracked, pending = self._db.execute(
+                'SELECT COUNT(*), COUNT(*) - COUNT(completed_at) FROM comparisons').fetchone()
+            return {
+                **self.counters,
+                'tracked': tracked,
+                'pending': pending,
+            }
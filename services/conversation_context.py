@@ -0,0 +1,148 @@
+# services/conversation_context.py
+from ai_models.base_model import estimate_tokens
+
+# Estrategias para construir la entrada de cada salto del modo Conversación.
+CONTEXT_STRATEGIES = ('truncate', 'head_tail', 'messages')
+
+DEFAULT_CONTEXT_SETTINGS = {
+    'strategy': 'truncate',  # truncate | head_tail | messages
+    'max_tokens': 4000,      # presupuesto de tokens de entrada por salto (0 = sin límite)
+    'turns': 2,              # respuestas anteriores que se conservan con 'messages'
+}
+
+# Misma proporción que `estimate_tokens`, para que recortar a N tokens dé una estimación de N.
+_CHARS_PER_TOKEN = 4
+_ELISION = '\n\n[...]\n\n'
+
+
+def context_settings(settings=None, defaults=None):
+    """
+    Valida `settings` completándolos con `defaults` (por defecto, `DEFAULT_CONTEXT_SETTINGS`).
+    Lanza ValueError con un mensaje para el cliente.
+    """
+    if settings is not None and not isinstance(settings, dict):
+        raise ValueError("'options.context' debe ser un objeto.")
+    unknown = set(settings or {}) - set(DEFAULT_CONTEXT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Ajustes de contexto desconocidos: {sorted(unknown)}.")
+    merged = {**(defaults or DEFAULT_CONTEXT_SETTINGS), **(settings or {})}
+    if merged['strategy'] not in CONTEXT_STRATEGIES:
+        raise ValueError(f"'strategy' debe ser una de {CONTEXT_STRATEGIES}.")
+    if not isinstance(merged['max_tokens'], int) or isinstance(merged['max_tokens'], bool) or merged['max_tokens'] < 0:
+        raise ValueError("'max_tokens' debe ser un entero no negativo (0 = sin límite).")
+    if not isinstance(merged['turns'], int) or isinstance(merged['turns'], bool) or merged['turns'] < 1:
+        raise ValueError("'turns' debe ser un entero positivo.")
+    return merged
+
+
+def truncate(text, max_tokens):
+    """Conserva el principio del texto hasta `max_tokens` tokens estimados."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max_tokens * _CHARS_PER_TOKEN]
+
+
+def head_tail(text, max_tokens):
+    """Conserva el principio y el final del texto (mitad y mitad), marcando lo omitido."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    chars = max_tokens * _CHARS_PER_TOKEN - len(_ELISION)
+    if chars <= 0:
+        return truncate(text, max_tokens)
+    head = chars - chars // 2
+    return text[:head] + _ELISION + text[len(text) - chars // 2:]
+
+
+class ConversationContext:
+    """
+    Contexto de una cadena del modo Conversación con un presupuesto de tokens por salto.
+
+    Sin recortes, cada modelo recibe la respuesta completa del anterior y las cadenas
+    crecen sin límite (más lentas, más caras y a veces por encima de la ventana de
+    contexto). Con un presupuesto, la entrada de cada salto queda acotada:
+
+    - 'truncate': la respuesta anterior (o el prompt en el primer salto), cortada al final.
+    - 'head_tail': la misma entrada, conservando el principio y el final.
+    - 'messages': el prompt original más las últimas `turns` respuestas como mensajes
+      alternos (el último es siempre 'user'); si no caben, se descartan las más antiguas
+      y, en último extremo, se recortan principio y final de la más reciente.
+
+    El presupuesto es `max_tokens` o, si es menor, el 'max_context_tokens' del modelo en
+    models.json. Los tokens se estiman localmente (`estimate_tokens`), sin llamar a nadie.
+    """
+
+    def __init__(self, prompt, settings=None):
+        self.prompt = prompt
+        self.settings = context_settings(settings)
+        self.responses = []
+
+    def add_response(self, text):
+        self.responses.append(text)
+
+    def budget(self, model_config):
+        limit = self.settings['max_tokens']
+        model_limit = model_config.get('max_context_tokens')
+        if model_limit:
+            limit = min(limit, model_limit) if limit else model_limit
+        return limit
+
+    def next_input(self, model_config):
+        """
+        Entrada del siguiente modelo y el resumen que se guarda en su paso:
+        (prompt o lista de mensajes, {'strategy', 'budget_tokens', 'source_tokens',
+        'context_tokens', 'trimmed'} más 'messages' con la estrategia 'messages').
+        """
+        strategy = self.settings['strategy']
+        budget = self.budget(model_config)
+        if strategy == 'messages':
+            model_input, source_tokens = self._messages(budget)
+            context_tokens = estimate_tokens(model_input)
+        else:
+            source = self.responses[-1] if self.responses else self.prompt
+            source_tokens = estimate_tokens(source)
+            trim = truncate if strategy == 'truncate' else head_tail
+            model_input = trim(source, budget) if budget else source
+            context_tokens = estimate_tokens(model_input)
+
+        info = {
+            'strategy': strategy,
+            'budget_tokens': budget or None,
+            'source_tokens': source_tokens,
+            'context_tokens': context_tokens,
+            'trimmed': context_tokens < source_tokens,
+        }
+        if strategy == 'messages':
+            info['messages'] = len(model_input)
+        return model_input, info
+
+    def _messages(self, budget):
+        """Prompt original más las últimas respuestas que quepan en el presupuesto."""
+        turns = self.responses[-self.settings['turns']:]
+        source_tokens = estimate_tokens(self.prompt) + sum(estimate_tokens(text) for text in turns)
+        if not budget:
+            selected = list(turns)
+            prompt = self.prompt
+        else:
+            # Con respuestas que llevar, el prompt original puede ocupar como mucho la mitad del presupuesto.
+            prompt = head_tail(self.prompt, budget // 2 if turns else budget)
+            remaining = budget - estimate_tokens(prompt)
+            selected = []
+            for text in reversed(turns):
+                tokens = estimate_tokens(text)
+                if tokens <= remaining:
+                    selected.insert(0, text)
+                    remaining -= tokens
+                else:
+                    if not selected:
+                        selected.insert(0, head_tail(text, max(remaining, 1)))
+                    break
+
+        # Los roles se asignan desde el final (la última respuesta es lo que debe contestar el
+        # modelo). Si al prompt le tocaría 'assistant', se une al primer mensaje 'user'.
+        if len(selected) % 2:
+            texts = [prompt + '\n\n' + selected[0]] + selected[1:]
+        else:
+            texts = [prompt] + selected
+        messages = [{'role': 'user' if (len(texts) - 1 - index) % 2 == 0 else 'assistant', 'content': text}
+                    for index, text in enumerate(texts)]
+        return messages, source_tokens
@@ -0,0 +1,123 @@
+# services/executor.py
+import concurrent.futures
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PoolSaturatedError(RuntimeError):
+    """Se lanza cuando la cola del pool de llamadas está llena."""
+
+
+class ModelCallExecutor:
+    """
+    Pool de hilos compartido y acotado para las llamadas a los proveedores de IA.
+
+    Sustituye a los `ThreadPoolExecutor` que se creaban en cada petición: hay un único
+    pool de larga duración con un número máximo de hilos y una cola limitada. Esperar
+    un resultado con `wait()` libera de verdad al llamante cuando vence el timeout;
+    la llamada rezagada se cancela si aún no había empezado o se abandona si ya estaba
+    en curso (su hilo termina por su cuenta y se contabiliza como abandonada).
+    """
+
+    def __init__(self, max_workers=32, max_queue=256):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='model-call')
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._abandoned = 0
+        self._rejected = 0
+        self._timeouts = 0
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Encola una llamada en el pool compartido y devuelve su `Future`.
+        Lanza `PoolSaturatedError` si la cola ya está llena (backpressure).
+        """
+        with self._lock:
+            if self._queued >= self.max_queue:
+                self._rejected += 1
+                raise PoolSaturatedError(
+                    f"El pool de llamadas está saturado ({self._queued} llamadas en cola).")
+            self._queued += 1
+
+        state = {'finished': False, 'abandoned': False}
+
+        def run():
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    state['finished'] = True
+                    if state['abandoned']:
+                        self._abandoned -= 1
+
+        try:
+            future = self._executor.submit(run)
+        except RuntimeError:
+            with self._lock:
+                self._queued -= 1
+            raise
+        future._call_state = state
+        return future
+
+    def wait(self, future, timeout):
+        """
+        Espera el resultado de `future` como máximo `timeout` segundos.
+
+        Si vence el plazo se intenta cancelar la llamada; si ya estaba en ejecución
+        se marca como abandonada y se relanza `concurrent.futures.TimeoutError`
+        sin esperar a que termine.
+        """
+        try:
+            return future.result(timeout=max(timeout, 0))
+        except concurrent.futures.TimeoutError:
+            self.abandon(future)
+            raise
+
+    def abandon(self, future, count_timeout=True):
+        """Cancela una llamada pendiente o la marca como abandonada si ya empezó."""
+        if count_timeout:
+            with self._lock:
+                self._timeouts += 1
+        on_abandon = getattr(future, '_on_abandon', None)
+        if on_abandon is not None:
+            # Espera sobre una llamada agrupada (services.singleflight): la real solo se
+            # abandona cuando dejan de esperarla todos.
+            on_abandon()
+            return
+        if future.cancel():
+            with self._lock:
+                self._queued -= 1
+            return
+        state = getattr(future, '_call_state', None)
+        if state is None:
+            return
+        with self._lock:
+            if not state['finished'] and not state['abandoned']:
+                state['abandoned'] = True
+                self._abandoned += 1
+
+    def stats(self):
+        """Devuelve una instantánea de los indicadores del pool."""
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'queued': self._queued,
+                'active': self._active,
+                'abandoned_running': self._abandoned,
+                'rejected_total': self._rejected,
+                'timeouts_total': self._timeouts,
+            }
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,312 @@
+# services/history_index.py
+import base64
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    record_id TEXT NOT NULL UNIQUE,
+    ts TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_records_ts ON records (ts, id);
+CREATE INDEX IF NOT EXISTS idx_records_mode_ts ON records (mode, ts, id);
+CREATE TABLE IF NOT EXISTS record_models (
+    model TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    record_rowid INTEGER NOT NULL,
+    PRIMARY KEY (model, ts, record_rowid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_record_models_rowid ON record_models (record_rowid);
+CREATE VIRTUAL TABLE IF NOT EXISTS records_fts USING fts5(prompt, responses, models);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    lines INTEGER NOT NULL
+);
+"""
+
+
+def extract_responses(record):
+    """Devuelve [(modelo, respuesta)] tanto para registros de 'compare' como de 'conversation'."""
+    results = record.get('results')
+    pairs = []
+    if isinstance(results, dict):
+        for model, response in results.items():
+            if model.startswith('_'):
+                continue
+            if isinstance(response, dict):
+                response = response.get('text') or response.get('response') or ''
+            pairs.append((model, str(response)))
+    elif isinstance(results, list):
+        for step in results:
+            if isinstance(step, dict) and 'model_name' in step:
+                pairs.append((step['model_name'], str(step.get('response', ''))))
+    return pairs
+
+
+def iter_result_files(results_dir):
+    """Ficheros de resultados bajo `results_dir`: JSON antiguos y segmentos JSONL (comprimidos o no)."""
+    for root, _, files in os.walk(results_dir):
+        for name in files:
+            if name.endswith(('.json', '.jsonl', '.jsonl.gz', '.jsonl.zst')):
+                yield os.path.join(root, name)
+
+
+def open_result_lines(path):
+    """Abre un segmento JSONL en modo texto, descomprimiéndolo si hace falta."""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.zst'):
+        import io
+        import zstandard
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb')), encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def iter_result_records(results_dir):
+    """Todos los registros guardados en `results_dir`; las líneas a medio escribir se saltan."""
+    for path in iter_result_files(results_dir):
+        try:
+            if path.endswith('.json'):
+                with open(path, 'r', encoding='utf-8') as f:
+                    yield json.load(f)
+                continue
+            with open_result_lines(path) as f:
+                for line in f:
+                    if line.strip():
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo leer '{path}': {e}")
+
+
+def _fts_query(text):
+    """Convierte el texto del usuario en una consulta FTS5 segura (cada palabra entre comillas)."""
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    return ' '.join(terms)
+
+
+def encode_cursor(ts, rowid):
+    return base64.urlsafe_b64encode(f"{ts}|{rowid}".encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    ts, rowid = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+    return ts, int(rowid)
+
+
+class HistoryIndex:
+    """
+    Índice local (SQLite + FTS5) del histórico de resultados.
+
+    Al arrancar recorre `results/` en segundo plano (ficheros JSON antiguos y segmentos
+    JSONL, de forma incremental según tamaño/mtime/líneas ya leídas) y después se
+    mantiene al día con cada registro que escribe el almacén de resultados. El recorrido
+    confirma y suelta el candado cada `batch_lines` líneas (guardando por dónde va en
+    `sources`), así que las consultas y `stats()` no esperan a que termine un segmento
+    grande y un reinicio continúa desde el último lote.
+    """
+
+    def __init__(self, path='cache/history.sqlite3', results_dir='results', batch_lines=500):
+        self.path = path
+        self.results_dir = results_dir
+        self.batch_lines = batch_lines
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+        # Contador de registros para stats(): evita un COUNT(*) con el candado tomado en cada /status.
+        self._records = self._db.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+        self.backfill_state = {'running': False, 'files': 0, 'records': 0, 'seconds': None}
+
+    # --- Escritura ---
+
+    def _insert(self, record, source):
+        """Inserta un registro si no estaba ya indexado. Debe llamarse con el candado tomado."""
+        record_id = record.get('id') or f"file:{source}"
+        cursor = self._db.execute(
+            'INSERT OR IGNORE INTO records (record_id, ts, mode, prompt, source) VALUES (?, ?, ?, ?, ?)',
+            (record_id, record.get('timestamp', ''), record.get('mode', ''), record.get('initial_prompt', ''), source))
+        if not cursor.rowcount:
+            return False
+        rowid = cursor.lastrowid
+        pairs = extract_responses(record)
+        models = sorted({model for model, _ in pairs})
+        self._db.executemany('INSERT OR IGNORE INTO record_models (model, ts, record_rowid) VALUES (?, ?, ?)',
+                             [(model, record.get('timestamp', ''), rowid) for model in models])
+        self._db.execute('INSERT INTO records_fts (rowid, prompt, responses, models) VALUES (?, ?, ?, ?)',
+                         (rowid, record.get('initial_prompt', ''),
+                          '\n\n'.join(response for _, response in pairs), ' '.join(models)))
+        self._records += 1
+        return True
+
+    def add_record(self, record, source=None):
+        """Oyente del almacén de resultados: indexa un registro recién escrito."""
+        with self._lock:
+            self._insert(record, os.path.relpath(source, self.results_dir) if source else None)
+            self._db.commit()
+
+    # --- Backfill incremental ---
+
+    def _iter_sources(self):
+        return iter_result_files(self.results_dir)
+
+    def _save_progress(self, relative, records, size, mtime_ns, lines):
+        """Indexa un lote de registros y guarda hasta qué línea se ha leído. Devuelve los añadidos."""
+        with self._lock:
+            added = sum(self._insert(record, relative) for record in records)
+            self._db.execute('INSERT OR REPLACE INTO sources (path, size, mtime_ns, lines) VALUES (?, ?, ?, ?)',
+                             (relative, size, mtime_ns, lines))
+            self._db.commit()
+        self.backfill_state['records'] += added
+        return added
+
+    def _index_file(self, path):
+        """Indexa lo nuevo de un fichero por lotes. Devuelve el número de registros añadidos."""
+        relative = os.path.relpath(path, self.results_dir)
+        st = os.stat(path)
+        with self._lock:
+            row = self._db.execute('SELECT size, mtime_ns, lines FROM sources WHERE path = ?', (relative,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return 0
+
+        if path.endswith('.json'):
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            return self._save_progress(relative, [record], st.st_size, st.st_mtime_ns, 1)
+
+        # Los segmentos solo crecen: se saltan las líneas ya indexadas. Los lotes intermedios
+        # se guardan con tamaño -1 para que el fichero no cuente como terminado.
+        already = row[2] if row else 0
+        added = 0
+        lines = 0
+        batch = []
+        with open_result_lines(path) as f:
+            for line in f:
+                lines += 1
+                if lines <= already or not line.strip():
+                    continue
+                try:
+                    batch.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Última línea a medio escribir: se reintentará en la siguiente pasada.
+                    lines -= 1
+                    break
+                if len(batch) >= self.batch_lines:
+                    added += self._save_progress(relative, batch, -1, 0, lines)
+                    batch = []
+        return added + self._save_progress(relative, batch, st.st_size, st.st_mtime_ns, max(lines, already))
+
+    def backfill(self):
+        """Recorre `results/` e indexa los ficheros nuevos o que han crecido."""
+        start = time.time()
+        self.backfill_state.update(running=True, files=0, records=0)
+        try:
+            for path in self._iter_sources():
+                try:
+                    self._index_file(path)
+                    self.backfill_state['files'] += 1
+                except (OSError, ValueError, json.JSONDecodeError) as e:
+                    logger.warning(f"No se pudo indexar '{path}': {e}")
+        finally:
+            self.backfill_state.update(running=False, seconds=round(time.time() - start, 2))
+        logger.info(f"Índice del histórico actualizado: {self.backfill_state['records']} registros nuevos "
+                    f"en {self.backfill_state['files']} ficheros ({self.backfill_state['seconds']} s).")
+
+    def start_backfill(self):
+        threading.Thread(target=self.backfill, name='history-backfill', daemon=True).start()
+
+    # --- Consulta ---
+
+    def search(self, query=None, model=None, mode=None, cursor=None, limit=20):
+        """
+        Búsqueda paginada por keyset sobre (timestamp, id), de más reciente a más antiguo.
+        Devuelve {'items': [...], 'next_cursor': str | None}.
+        """
+        limit = max(1, min(int(limit), 200))
+        # Con filtro de modelo la consulta recorre record_models, que ya está ordenada por
+        # (modelo, ts, id); sin él, el índice (ts, id) de records. Así el keyset no ordena en memoria.
+        if model:
+            ts_col, id_col = 'm.ts', 'm.record_rowid'
+            source = 'record_models m JOIN records r ON r.id = m.record_rowid'
+            where = ['m.model = ?']
+            params = [model]
+        else:
+            ts_col, id_col = 'r.ts', 'r.id'
+            source = 'records r'
+            where = []
+            params = []
+
+        select = 'SELECT r.id, r.record_id, r.ts, r.mode, r.prompt, r.source'
+        fts_query = _fts_query(query) if query and query.strip() else None
+        if fts_query:
+            # Las coincidencias FTS se materializan una vez y se filtran siguiendo el orden del índice.
+            where.append('r.id IN (SELECT rowid FROM records_fts WHERE records_fts MATCH ?)')
+            params.append(fts_query)
+        if mode:
+            where.append('r.mode = ?')
+            params.append(mode)
+        if cursor:
+            ts, rowid = decode_cursor(cursor)
+            where.append(f'({ts_col} < ? OR ({ts_col} = ? AND {id_col} < ?))')
+            params.extend([ts, ts, rowid])
+
+        sql = f"{select} FROM {source}"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {ts_col} DESC, {id_col} DESC LIMIT ?'
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+            page = rows[:limit]
+            models_by_row = {}
+            if page:
+                ids = [row[0] for row in page]
+                placeholders = ','.join('?' * len(ids))
+                for rowid, model_name in self._db.execute(
+                        f'SELECT record_rowid, model FROM record_models WHERE record_rowid IN ({placeholders})', ids):
+                    models_by_row.setdefault(rowid, []).append(model_name)
+                if fts_query:
+                    snippets = dict(self._db.execute(
+                        f"SELECT rowid, snippet(records_fts, -1, '[', ']', '…', 16) FROM records_fts "
+                        f"WHERE records_fts MATCH ? AND rowid IN ({placeholders})", [fts_query] + ids))
+
+        items = []
+        for row in page:
+            item = {
+                'id': row[1],
+                'timestamp': row[2],
+                'mode': row[3],
+                'prompt': row[4],
+                'source': row[5],
+                'models': sorted(models_by_row.get(row[0], [])),
+            }
+            if fts_query:
+                item['snippet'] = snippets.get(row[0], '')
+            items.append(item)
+
+        next_cursor = encode_cursor(page[-1][2], page[-1][0]) if len(rows) > limit else None
+        return {'items': items, 'next_cursor': next_cursor}
+
+    def stats(self):
+        return {'records': self._records, 'backfill': dict(self.backfill_state)}
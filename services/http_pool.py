@@ -0,0 +1,344 @@
+# services/http_pool.py
+import json
+import logging
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Ajustes de transporte por defecto; se sobrescriben con 'transport' en la sección 'providers' de models.json.
+DEFAULT_TRANSPORT_SETTINGS = {
+    'max_connections': 100,           # conexiones abiertas con el host (en uso + libres)
+    'max_keepalive_connections': 20,  # conexiones libres que se conservan abiertas
+    'keepalive_expiry': 30,           # segundos que sigue abierta una conexión libre (httpx usa 5)
+    'http2': False,                   # requiere el paquete opcional 'h2'
+    'connect_timeout': 5,
+    'read_timeout': 600,              # entre dos lecturas: una respuesta en streaming puede tardar
+    'write_timeout': 30,
+    'pool_timeout': 10,               # espera por una conexión libre del pool
+    'total_timeout': None,            # límite de la petición completa, incluida la lectura de la respuesta
+}
+
+_COUNTS = ('max_connections', 'max_keepalive_connections')
+_SECONDS = ('keepalive_expiry', 'connect_timeout', 'read_timeout', 'write_timeout', 'pool_timeout', 'total_timeout')
+
+
+def transport_settings(settings):
+    """Valida los ajustes de transporte de un proveedor y los completa con los valores por defecto."""
+    if not isinstance(settings, dict):
+        raise ValueError("'transport' debe ser un objeto.")
+    unknown = sorted(set(settings) - set(DEFAULT_TRANSPORT_SETTINGS))
+    if unknown:
+        raise ValueError(f"Ajustes de transporte desconocidos: {unknown}.")
+    merged = {**DEFAULT_TRANSPORT_SETTINGS, **settings}
+    if 'max_keepalive_connections' not in settings and isinstance(merged['max_connections'], int):
+        merged['max_keepalive_connections'] = min(merged['max_keepalive_connections'], merged['max_connections'])
+    for key in _COUNTS:
+        if not isinstance(merged[key], int) or isinstance(merged[key], bool) or merged[key] <= 0:
+            raise ValueError(f"'{key}' debe ser un entero positivo.")
+    for key in _SECONDS:
+        value = merged[key]
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool) or value <= 0):
+            raise ValueError(f"'{key}' debe ser un número positivo o null.")
+    if not isinstance(merged['http2'], bool):
+        raise ValueError("'http2' debe ser booleano.")
+    if merged['max_keepalive_connections'] > merged['max_connections']:
+        raise ValueError("'max_keepalive_connections' no puede superar 'max_connections'.")
+    return merged
+
+
+class _PoolCounters:
+    """Peticiones, conexiones nuevas y timeouts totales de un cliente compartido."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.active_requests = 0
+        self.total_timeouts = 0
+
+    def add(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def on_trace(self, event_name):
+        # Cada conexión nueva pasa por connect_tcp; las reutilizadas van directas al envío.
+        if event_name == 'connection.connect_tcp.complete':
+            self.add('new_connections')
+
+
+def _bounded_timeouts(request, total_timeout):
+    """Ningún plazo parcial de la petición supera el total."""
+    timeouts = dict(request.extensions.get('timeout') or {})
+    for key in ('connect', 'read', 'write', 'pool'):
+        value = timeouts.get(key)
+        timeouts[key] = total_timeout if value is None else min(value, total_timeout)
+    return timeouts
+
+
+def _pool_usage(transport):
+    """Conexiones abiertas, ocupadas y peticiones esperando conexión en el pool de httpcore."""
+    pool = transport._pool  # httpx no expone el pool de httpcore de otra forma
+    connections = list(pool.connections)
+    busy = sum(1 for connection in connections if not connection.is_idle())
+    waiting = sum(1 for pool_request in list(pool._requests) if pool_request.is_queued())
+    return len(connections), busy, waiting
+
+
+def _httpx_module(client_class):
+    """Módulo httpx del que deriva `client_class` (algunos SDK usan una copia propia de httpx)."""
+    for cls in client_class.__mro__:
+        top_level = cls.__module__.split('.')[0]
+        if top_level.startswith('httpx'):
+            return sys.modules[top_level]
+    raise TypeError(f"{client_class.__name__} no es un cliente httpx.")
+
+
+_TRANSPORTS = {}  # nombre del módulo httpx -> (transporte síncrono, transporte asíncrono)
+
+
+def _transport_classes(hx):
+    """Transportes de `hx` que cuentan peticiones y conexiones nuevas y aplican el tiempo total."""
+    if hx.__name__ in _TRANSPORTS:
+        return _TRANSPORTS[hx.__name__]
+
+    def total_timeout_error(counters, request):
+        counters.add('total_timeouts')
+        return hx.ReadTimeout("Se superó el tiempo total de la petición.", request=request)
+
+    class TrackedStream(hx.SyncByteStream):
+        """Cuerpo de la respuesta: marca el fin de la petición y aplica el límite total entre fragmentos."""
+
+        def __init__(self, stream, request, counters, deadline):
+            self._stream = stream
+            self._request = request
+            self._counters = counters
+            self._deadline = deadline
+            self._closed = False
+
+        def __iter__(self):
+            for chunk in self._stream:
+                if self._deadline is not None and time.monotonic() > self._deadline:
+                    raise total_timeout_error(self._counters, self._request)
+                yield chunk
+
+        def close(self):
+            if not self._closed:
+                self._closed = True
+                self._counters.add('active_requests', -1)
+                self._stream.close()
+
+    class AsyncTrackedStream(hx.AsyncByteStream):
+        def __init__(self, stream, request, counters, deadline):
+            self._stream = stream
+            self._request = request
+            self._counters = counters
+            self._deadline = deadline
+            self._closed = False
+
+        async def __aiter__(self):
+            async for chunk in self._stream:
+                if self._deadline is not None and time.monotonic() > self._deadline:
+                    raise total_timeout_error(self._counters, self._request)
+                yield chunk
+
+        async def aclose(self):
+            if not self._closed:
+                self._closed = True
+                self._counters.add('active_requests', -1)
+                await self._stream.aclose()
+
+    def prepare(transport, request):
+        """Cuenta la petición y aplica el tiempo total. Devuelve el instante límite (o None)."""
+        deadline = None
+        if transport.total_timeout is not None:
+            deadline = time.monotonic() + transport.total_timeout
+            request.extensions['timeout'] = _bounded_timeouts(request, transport.total_timeout)
+        transport.counters.add('requests')
+        transport.counters.add('active_requests')
+        return deadline
+
+    class CountingTransport(hx.HTTPTransport):
+        def __init__(self, counters, total_timeout, **kwargs):
+            super().__init__(**kwargs)
+            self.counters = counters
+            self.total_timeout = total_timeout
+
+        def handle_request(self, request):
+            previous_trace = request.extensions.get('trace')
+
+            def trace(event_name, info):
+                self.counters.on_trace(event_name)
+                if previous_trace is not None:
+                    previous_trace(event_name, info)
+
+            request.extensions['trace'] = trace
+            deadline = prepare(self, request)
+            try:
+                response = super().handle_request(request)
+            except BaseException:
+                self.counters.add('active_requests', -1)
+                raise
+            return hx.Response(status_code=response.status_code, headers=response.headers,
+                               stream=TrackedStream(response.stream, request, self.counters, deadline),
+                               extensions=response.extensions)
+
+    class AsyncCountingTransport(hx.AsyncHTTPTransport):
+        def __init__(self, counters, total_timeout, **kwargs):
+            super().__init__(**kwargs)
+            self.counters = counters
+            self.total_timeout = total_timeout
+
+        async def handle_async_request(self, request):
+            previous_trace = request.extensions.get('trace')
+
+            async def trace(event_name, info):
+                self.counters.on_trace(event_name)
+                if previous_trace is not None:
+                    await previous_trace(event_name, info)
+
+            request.extensions['trace'] = trace
+            deadline = prepare(self, request)
+            try:
+                response = await super().handle_async_request(request)
+            except BaseException:
+                self.counters.add('active_requests', -1)
+                raise
+            return hx.Response(status_code=response.status_code, headers=response.headers,
+                               stream=AsyncTrackedStream(response.stream, request, self.counters, deadline),
+                               extensions=response.extensions)
+
+    _TRANSPORTS[hx.__name__] = (CountingTransport, AsyncCountingTransport)
+    return _TRANSPORTS[hx.__name__]
+
+
+class _SharedClient:
+    """Un cliente httpx compartido por los conectores que usan el mismo host con los mismos ajustes."""
+
+    def __init__(self, name, origin, settings, hx, asynchronous):
+        self.name = name
+        self.origin = origin
+        self.settings = settings
+        self.asynchronous = asynchronous
+        self.library = hx.__name__
+        self.counters = _PoolCounters()
+        self.users = 0
+        limits = hx.Limits(max_connections=settings['max_connections'],
+                           max_keepalive_connections=settings['max_keepalive_connections'],
+                           keepalive_expiry=settings['keepalive_expiry'])
+        timeout = hx.Timeout(connect=settings['connect_timeout'], read=settings['read_timeout'],
+                             write=settings['write_timeout'], pool=settings['pool_timeout'])
+        sync_transport, async_transport = _transport_classes(hx)
+        transport_class = async_transport if self.asynchronous else sync_transport
+        self.transport = transport_class(self.counters, settings['total_timeout'], limits=limits,
+                                         http2=settings['http2'])
+        client_class = hx.AsyncClient if asynchronous else hx.Client
+        self.client = client_class(transport=self.transport, timeout=timeout, limits=limits)
+
+    def stats(self):
+        connections, busy, waiting = _pool_usage(self.transport)
+        counters = self.counters
+        return {
+            'client': 'async' if self.asynchronous else 'sync',
+            'origin': self.origin,
+            'http2': self.settings['http2'],
+            'users': self.users,
+            'requests': counters.requests,
+            'active_requests': counters.active_requests,
+            'new_connections': counters.new_connections,
+            'reused_connections': max(0, counters.requests - counters.new_connections),
+            'total_timeouts': counters.total_timeouts,
+            'connections': connections,
+            'busy_connections': busy,
+            'waiting_requests': waiting,
+            'max_connections': self.settings['max_connections'],
+            'utilization': round(busy / self.settings['max_connections'], 3),
+        }
+
+
+class HTTPPools:
+    """
+    Clientes httpx compartidos para los SDK de los proveedores.
+
+    Los conectores que apuntan al mismo host (esquema, host y puerto) con los mismos ajustes
+    de transporte reciben el mismo cliente, de modo que reutilizan las conexiones abiertas
+    (keep-alive) en lugar de mantener un pool por instancia. Cada cliente cuenta sus
+    peticiones y conexiones nuevas y se cierra cuando lo suelta el último conector.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}  # (origen, ajustes, módulo httpx, asíncrono) -> _SharedClient
+        self._variants = {}  # origen -> ajustes vistos, para numerar los pools del mismo host
+        self._http2_warned = False
+
+    def acquire(self, base_url, settings=None, client_class=httpx.Client):
+        """
+        Cliente compartido para `base_url`. `client_class` indica el httpx que usa el SDK y si
+        el cliente es síncrono o asíncrono. Hay que devolverlo con `release`/`arelease`.
+        """
+        settings = transport_settings(settings or {})
+        if settings['http2'] and not self._http2_available():
+            settings = {**settings, 'http2': False}
+        hx = _httpx_module(client_class)
+        asynchronous = issubclass(client_class, hx.AsyncClient)
+        parts = urlsplit(base_url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        key = (origin, json.dumps(settings, sort_keys=True), hx.__name__, asynchronous)
+        with self._lock:
+            shared = self._clients.get(key)
+            if shared is None:
+                # Mismo host con otros ajustes: un pool aparte, numerado.
+                variants = self._variants.setdefault(origin, [])
+                if key[1] not in variants:
+                    variants.append(key[1])
+                index = variants.index(key[1])
+                name = origin if index == 0 else f"{origin}#{index + 1}"
+                shared = _SharedClient(name, origin, settings, hx, asynchronous)
+                self._clients[key] = shared
+                logger.info(f"Pool HTTP {'asíncrono' if asynchronous else 'síncrono'} ({hx.__name__}) "
+                            f"creado para {name}.")
+            shared.users += 1
+            return shared.client
+
+    def _http2_available(self):
+        try:
+            import h2  # noqa: F401
+            return True
+        except ImportError:
+            if not self._http2_warned:
+                self._http2_warned = True
+                logger.warning("HTTP/2 solicitado pero el paquete 'h2' no está instalado; se usará HTTP/1.1.")
+            return False
+
+    def _detach(self, client):
+        """Resta un usuario; devuelve True si era el último y el cliente hay que cerrarlo."""
+        with self._lock:
+            for key, shared in self._clients.items():
+                if shared.client is client:
+                    shared.users -= 1
+                    if shared.users > 0:
+                        return False
+                    del self._clients[key]
+                    return True
+        return False
+
+    def release(self, client):
+        """Suelta un cliente síncrono; lo cierra si ningún conector lo usa ya."""
+        if self._detach(client):
+            client.close()
+
+    async def arelease(self, client):
+        """Suelta un cliente asíncrono (desde el bucle en el que se usa)."""
+        if self._detach(client):
+            await client.aclose()
+
+    def stats(self):
+        with self._lock:
+            clients = list(self._clients.values())
+        return {f"{shared.name} ({shared.library}, {'async' if shared.asynchronous else 'sync'})": shared.stats()
+                for shared in clients}
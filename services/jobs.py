@@ -0,0 +1,396 @@
+# services/jobs.py
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+FINISHED_STATES = ('done', 'failed', 'cancelled')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progress TEXT NOT NULL DEFAULT '{}',
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    owner TEXT,
+    heartbeat_at REAL,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_user ON jobs (status, user);
+CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs (user, created_at);
+CREATE TABLE IF NOT EXISTS job_users (
+    user TEXT PRIMARY KEY,
+    last_started_at REAL NOT NULL
+);
+"""
+
+# Siguiente trabajo: primero el usuario con menos trabajos en marcha y, a igualdad, el que lleva
+# más tiempo sin que se le atienda; dentro de sus trabajos, el de más prioridad y el más antiguo.
+_CLAIM = """
+UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?, heartbeat_at = ?,
+                started_at = COALESCE(started_at, ?), version = version + 1
+WHERE id = (
+    SELECT j.id FROM jobs j LEFT JOIN job_users u ON u.user = j.user
+    WHERE j.status = 'queued'
+    ORDER BY (SELECT COUNT(*) FROM jobs r WHERE r.status = 'running' AND r.user = j.user),
+             COALESCE(u.last_started_at, 0), j.priority DESC, j.created_at
+    LIMIT 1
+) AND status = 'queued'
+RETURNING id, user, kind, priority, payload, progress, attempts
+"""
+
+_COLUMNS = ('id', 'user', 'kind', 'priority', 'status', 'payload', 'progress', 'result', 'error', 'attempts',
+            'cancel_requested', 'created_at', 'started_at', 'finished_at', 'version')
+
+
+class JobQueueFull(Exception):
+    """El usuario ya tiene demasiados trabajos en cola."""
+
+
+class JobCancelled(Exception):
+    """Se pidió cancelar el trabajo mientras se ejecutaba."""
+
+
+class JobLost(JobCancelled):
+    """
+    El trabajo ya no es de este proceso: su concesión venció y lo reservó otro. Se detiene
+    como una cancelación, pero sin tocar su estado, que ahora lleva el nuevo dueño.
+    """
+
+
+class Job:
+    """Trabajo en ejecución tal como lo recibe su función: datos, progreso guardado e informe de avance."""
+
+    def __init__(self, queue, job_id, user, kind, priority, payload, progress, attempts):
+        self.queue = queue
+        self.id = job_id
+        self.user = user
+        self.kind = kind
+        self.priority = priority
+        self.payload = payload
+        self.progress = progress
+        self.attempts = attempts
+
+    @property
+    def resumed(self):
+        """True si el trabajo ya se empezó antes (reinicio o caída del proceso que lo ejecutaba)."""
+        return self.attempts > 1
+
+    def report(self, **progress):
+        """
+        Guarda el avance (se combina con el anterior y sirve para reanudar tras un reinicio).
+        Lanza `JobCancelled` si entretanto se pidió cancelar el trabajo y `JobLost` si ya lo
+        ejecuta otro proceso.
+        """
+        self.progress.update(progress)
+        cancel_requested = self.queue._save_progress(self.id, self.progress)
+        if cancel_requested is None:
+            raise JobLost()
+        if cancel_requested:
+            raise JobCancelled()
+
+
+class JobQueue:
+    """
+    Cola de trabajos persistente (SQLite local en modo WAL) con un número fijo de hilos.
+
+    Las peticiones largas (/compare, /conversation) se encolan y responden al momento con
+    un id; los hilos de la cola las ejecutan sin ocupar los de waitress. Cada tipo de
+    trabajo tiene una función registrada con `register(kind, fn)` que recibe un `Job`,
+    informa de su avance con `job.report(...)` y devuelve el resultado (serializable a JSON).
+
+    El reparto es justo entre usuarios: el siguiente trabajo es del usuario con menos
+    trabajos en marcha y, a igualdad, del que lleva más tiempo sin que se le atienda;
+    `priority` ordena los trabajos de un mismo usuario. Los trabajos sobreviven a un
+    reinicio: los que estaban en marcha se devuelven a la cola (con su progreso, para que
+    la función retome donde iba) si el proceso que los tenía ya no existe o deja de
+    renovar su concesión durante `lease` segundos. Varios procesos pueden compartir el
+    fichero; la reserva de cada trabajo es una única sentencia atómica.
+    """
+
+    def __init__(self, path, workers=2, lease=60.0, max_attempts=3, max_queued_per_user=100,
+                 retention=7 * 86400, poll_interval=1.0):
+        self.path = path
+        self.workers = workers
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.max_queued_per_user = max_queued_per_user
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.runners = {}
+        self.counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'cancelled': 0, 'requeued': 0}
+        self._lock = threading.Lock()
+        self._db = self._connect(path)
+        self._running = {}  # id de trabajo -> hilo que lo ejecuta (solo los de este proceso)
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @staticmethod
+    def _connect(path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript(_SCHEMA)
+        return db
+
+    def register(self, kind, fn):
+        self.runners[kind] = fn
+
+    # --- API para las peticiones ---
+
+    def submit(self, user, kind, payload, priority=0):
+        """Encola un trabajo y devuelve su estado. Lanza `JobQueueFull` si el usuario tiene demasiados en cola."""
+        if kind not in self.runners:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            queued = self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND user = ?",
+                                      (user,)).fetchone()[0]
+            if self.max_queued_per_user and queued >= self.max_queued_per_user:
+                raise JobQueueFull(f"Ya tienes {queued} trabajos en cola; espera a que terminen.")
+            self._db.execute('INSERT INTO jobs (id, user, kind, priority, status, payload, created_at) '
+                             "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                             (job_id, user, kind, priority, json.dumps(payload, ensure_ascii=False), time.time()))
+            self.counters['submitted'] += 1
+        self._wakeup.set()
+        return self.get(job_id)
+
+    def get(self, job_id, include_result=True):
+        """Estado del trabajo (None si no existe): estado, progreso, resultado o error y tiempos."""
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(_COLUMNS, row))
+            if job['status'] == 'queued':
+                job['queued_before'] = self._db.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?",
+                    (job['created_at'],)).fetchone()[0]
+        return self._public(job, include_result)
+
+    def version(self, job_id):
+        """Contador de cambios del trabajo (para detectar avances sin leerlo entero)."""
+        with self._lock:
+            row = self._db.execute('SELECT version FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def user_jobs(self, user, limit=50):
+        """Trabajos del usuario, del más reciente al más antiguo (sin resultado)."""
+        with self._lock:
+            rows = self._db.execute(f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE user = ? "
+                                    'ORDER BY created_at DESC LIMIT ?', (user, limit)).fetchall()
+        return [self._public(dict(zip(_COLUMNS, row)), include_result=False) for row in rows]
+
+    def cancel(self, job_id):
+        """
+        Cancela un trabajo en cola al momento; uno en marcha se detiene en su siguiente
+        informe de avance. Devuelve el estado resultante (None si no existe).
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET status = 'cancelled', finished_at = ?, version = version + 1 "
+                                      "WHERE id = ? AND status = 'queued'", (now, job_id))
+            if cursor.rowcount:
+                self.counters['cancelled'] += 1
+            else:
+                self._db.execute('UPDATE jobs SET cancel_requested = 1, version = version + 1 '
+                                 "WHERE id = ? AND status = 'running'", (job_id,))
+        return self.get(job_id, include_result=False)
+
+    @staticmethod
+    def _public(job, include_result=True):
+        job['payload'] = json.loads(job['payload'])
+        job['progress'] = json.loads(job['progress'])
+        job['cancel_requested'] = bool(job['cancel_requested'])
+        result = job.pop('result')
+        if include_result:
+            job['result'] = json.loads(result) if result is not None else None
+        return job
+
+    # --- Ejecución ---
+
+    def start(self):
+        """Devuelve a la cola los trabajos huérfanos y arranca los hilos de trabajo y de mantenimiento."""
+        if self._threads:
+            return
+        self._recover()
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, name='job-maintenance', daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def _claim(self):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(_CLAIM, (self.owner, now, now)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('INSERT INTO job_users (user, last_started_at) VALUES (?, ?) '
+                             'ON CONFLICT (user) DO UPDATE SET last_started_at = excluded.last_started_at',
+                             (row[1], now))
+        job_id, user, kind, priority, payload, progress, attempts = row
+        return Job(self, job_id, user, kind, priority, json.loads(payload), json.loads(progress), attempts)
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                logger.error(f"Error al reservar un trabajo: {e}")
+                job = None
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            with self._lock:
+                self._running[job.id] = threading.current_thread()
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._running.pop(job.id, None)
+
+    def _run(self, job):
+        if job.resumed:
+            logger.info(f"Reanudando el trabajo {job.id} ({job.kind}, intento {job.attempts}).")
+        try:
+            result = self.runners[job.kind](job)
+        except JobLost:
+            logger.warning(f"El trabajo {job.id} pasó a otro proceso; se deja de ejecutar aquí.")
+        except JobCancelled:
+            self._finish(job.id, 'cancelled')
+        except Exception as e:
+            logger.error(f"Error en el trabajo {job.id} ({job.kind}): {e}")
+            self._finish(job.id, 'failed', error=str(e))
+        else:
+            self._finish(job.id, 'done', result=result)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock:
+            cursor = self._db.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, owner = NULL, '
+                'version = version + 1 WHERE id = ? AND owner = ?',
+                (status, json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                 error, time.time(), job_id, self.owner))
+            if not cursor.rowcount:
+                logger.warning(f"El trabajo {job_id} pasó a otro proceso; no se guarda su resultado de aquí.")
+                return
+            self.counters[{'done': 'completed', 'failed': 'failed', 'cancelled': 'cancelled'}[status]] += 1
+
+    def _save_progress(self, job_id, progress):
+        """
+        Guarda el progreso y renueva la concesión. Devuelve True si se pidió cancelar, o None
+        si el trabajo ya no es de este proceso (no se guarda nada).
+        """
+        with self._lock:
+            row = self._db.execute('UPDATE jobs SET progress = ?, heartbeat_at = ?, version = version + 1 '
+                                   'WHERE id = ? AND owner = ? RETURNING cancel_requested',
+                                   (json.dumps(progress, ensure_ascii=False, default=str), time.time(),
+                                    job_id, self.owner)).fetchone()
+        return bool(row[0]) if row else None
+
+    # --- Mantenimiento ---
+
+    def _maintain(self):
+        interval = max(1.0, self.lease / 3)
+        while not self._stop.wait(interval):
+            try:
+                self._heartbeat()
+                self._recover()
+                self._purge()
+            except sqlite3.Error as e:
+                logger.error(f"Error en el mantenimiento de la cola de trabajos: {e}")
+
+    def _heartbeat(self):
+        """Renueva la concesión de los trabajos de este proceso (las llamadas largas no informan a menudo)."""
+        with self._lock:
+            running = list(self._running)
+            if running:
+                self._db.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND id IN "
+                                 f"({', '.join('?' * len(running))})", (time.time(), self.owner, *running))
+
+    def _recover(self):
+        """Devuelve a la cola los trabajos en marcha de procesos que ya no existen o sin concesión vigente."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute("SELECT id, owner, heartbeat_at, attempts FROM jobs WHERE status = 'running'").fetchall()
+            for job_id, owner, heartbeat_at, attempts in rows:
+                if owner == self.owner:
+                    continue
+                if not _owner_gone(owner) and (heartbeat_at or 0) >= now - self.lease:
+                    continue
+                if attempts >= self.max_attempts:
+                    self._db.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, owner = NULL, "
+                                     "version = version + 1 WHERE id = ? AND status = 'running' AND owner IS ?",
+                                     (f"Abandonado tras {attempts} intentos.", now, job_id, owner))
+                    self.counters['failed'] += 1
+                    continue
+                cursor = self._db.execute("UPDATE jobs SET status = 'queued', owner = NULL, version = version + 1 "
+                                          "WHERE id = ? AND status = 'running' AND owner IS ?", (job_id, owner))
+                if cursor.rowcount:
+                    self.counters['requeued'] += 1
+                    logger.warning(f"Trabajo {job_id} devuelto a la cola (su proceso terminó o dejó de renovarlo).")
+        self._wakeup.set()
+
+    def _purge(self):
+        if not self.retention:
+            return
+        with self._lock:
+            self._db.execute(f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED_STATES))}) "
+                             'AND finished_at < ?', (*FINISHED_STATES, time.time() - self.retention))
+
+    def stats(self):
+        with self._lock:
+            states = dict(self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            return {
+                **self.counters,
+                'workers': self.workers,
+                'busy': len(self._running),
+                **{state: states.get(state, 0) for state in JOB_STATES},
+            }
+
+
+def _owner_gone(owner):
+    """True si el proceso `pid:token` dueño de un trabajo ya no existe en esta máquina."""
+    try:
+        pid = int(str(owner).split(':', 1)[0])
+    except ValueError:
+        return True
+    if pid == os.getpid():
+        # Mismo pid pero otro token: una ejecución anterior de este proceso (p. ej. en un contenedor).
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
@@ -0,0 +1,414 @@
+# services/metrics.py
+import bisect
+import logging
+import math
+import threading
+import time
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# Cubos logarítmicos: de 1 ms a ~10 min con un crecimiento del 10% (error relativo < 5%).
+_BUCKET_MIN = 0.001
+_BUCKET_GROWTH = 1.1
+BUCKET_BOUNDS = tuple(_BUCKET_MIN * _BUCKET_GROWTH ** i for i in range(int(math.log(600 / _BUCKET_MIN, _BUCKET_GROWTH)) + 2))
+
+# Ventanas deslizantes en segundos y anchura de cada franja del anillo.
+WINDOWS = {'1m': 60, '5m': 300, '1h': 3600}
+SLOT_SECONDS = 10
+_MAX_SLOTS = max(WINDOWS.values()) // SLOT_SECONDS
+
+# Límites 'le' de los histogramas exportados a Prometheus.
+PROMETHEUS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+QUANTILES = (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))
+
+
+def _bucket_index(value):
+    return min(bisect.bisect_left(BUCKET_BOUNDS, value), len(BUCKET_BOUNDS) - 1)
+
+
+def _percentile(counts, total, q):
+    """Percentil aproximado (límite superior del cubo) a partir de los contadores por cubo."""
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return BUCKET_BOUNDS[index]
+    return BUCKET_BOUNDS[-1]
+
+
+class WindowedHistogram:
+    """
+    Histograma de memoria fija: contadores por cubo logarítmico para todo el histórico
+    más un anillo de franjas de `SLOT_SECONDS` para las ventanas de 1m/5m/1h.
+    """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKET_BOUNDS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slots = deque(maxlen=_MAX_SLOTS)  # (inicio_franja, contadores, n)
+        self._dirty = True
+        self._cached = None
+        self._cached_slot = None
+
+    def record(self, value, now):
+        index = _bucket_index(value)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self._dirty = True
+
+        slot_start = int(now // SLOT_SECONDS) * SLOT_SECONDS
+        if not self.slots or self.slots[-1][0] != slot_start:
+            self.slots.append((slot_start, [0] * len(BUCKET_BOUNDS), [0]))
+        _, slot_counts, slot_n = self.slots[-1]
+        slot_counts[index] += 1
+        slot_n[0] += 1
+
+    def summary(self, now):
+        # Solo se recalcula si hubo registros nuevos o si las ventanas han avanzado una franja.
+        current_slot = int(now // SLOT_SECONDS)
+        if not self._dirty and self._cached_slot == current_slot:
+            return self._cached
+
+        summary = {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else 0,
+            'max': round(self.max, 3),
+        }
+        for label, q in QUANTILES:
+            # El límite superior del cubo nunca se informa por encima del máximo observado.
+            summary[label] = round(min(_percentile(self.counts, self.count, q), self.max), 3)
+
+        # Una sola pasada de la franja más reciente a la más antigua, cerrando cada ventana al cruzar su límite.
+        windows = {}
+        pending = sorted(WINDOWS.items(), key=lambda item: item[1])
+        merged = [0] * len(BUCKET_BOUNDS)
+        n = 0
+        for slot_start, slot_counts, slot_n in reversed(self.slots):
+            while pending and slot_start <= now - pending[0][1]:
+                windows[pending.pop(0)[0]] = self._window_summary(merged, n)
+            if not pending:
+                break
+            n += slot_n[0]
+            for index, count in enumerate(slot_counts):
+                if count:
+                    merged[index] += count
+        for window_label, _ in pending:
+            windows[window_label] = self._window_summary(merged, n)
+        summary['windows'] = {label: windows[label] for label in WINDOWS}
+
+        self._dirty = False
+        self._cached_slot = current_slot
+        self._cached = summary
+        return summary
+
+    @staticmethod
+    def _window_summary(counts, n):
+        window = {'count': n}
+        for label, q in QUANTILES:
+            window[label] = round(_percentile(counts, n, q), 3)
+        return window
+
+    def export(self):
+        """Estado serializable en JSON (cubos dispersos) para agregarlo desde otro proceso."""
+        return {
+            'counts': {index: count for index, count in enumerate(self.counts) if count},
+            'count': self.count,
+            'total': self.total,
+            'max': self.max,
+            'slots': [[start, {i: c for i, c in enumerate(counts) if c}, n[0]] for start, counts, n in self.slots],
+        }
+
+    def merge(self, state):
+        """Suma el estado exportado por `export()` de otro histograma."""
+        for index, count in state['counts'].items():
+            self.counts[int(index)] += count
+        self.count += state['count']
+        self.total += state['total']
+        self.max = max(self.max, state['max'])
+        slots = {start: (counts, n) for start, counts, n in self.slots}
+        for start, counts, n in state['slots']:
+            slot_counts, slot_n = slots.setdefault(start, ([0] * len(BUCKET_BOUNDS), [0]))
+            for index, count in counts.items():
+                slot_counts[int(index)] += count
+            slot_n[0] += n
+        self.slots = deque(((start, *slots[start]) for start in sorted(slots)), maxlen=_MAX_SLOTS)
+        self._dirty = True
+
+    def cumulative(self, bounds):
+        """Contadores acumulados por límite 'le' (formato histograma de Prometheus)."""
+        result = []
+        running = 0
+        index = 0
+        for le in bounds:
+            while index < len(BUCKET_BOUNDS) and BUCKET_BOUNDS[index] <= le:
+                running += self.counts[index]
+                index += 1
+            result.append(running)
+        return result
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """
+    Métricas de la aplicación, seguras entre hilos y de memoria acotada.
+
+    Las escrituras solo actualizan contadores bajo un candado. Un hilo en segundo plano
+    recalcula periódicamente los resúmenes (percentiles y ventanas), de modo que
+    /status se limita a leer un diccionario ya preparado.
+    """
+
+    def __init__(self, refresh_interval=1.0):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self.total_requests = 0
+        self.in_flight = 0
+        self.error_count = defaultdict(int)
+        self.error_kinds = defaultdict(int)  # (modelo, tipo) -> errores
+        self.coalesced_calls = defaultdict(int)  # llamadas servidas por otra idéntica en curso
+        self.input_tokens = defaultdict(int)
+        self.output_tokens = defaultdict(int)
+        self.generation_seconds = defaultdict(float)  # latencia de las respuestas con tokens de salida conocidos
+        self.response_times = defaultdict(WindowedHistogram)
+        self.first_token_times = defaultdict(WindowedHistogram)
+        self.route_latencies = defaultdict(WindowedHistogram)
+        self._summary = {}
+        self._refresher = None
+        self._stop = threading.Event()
+
+    # --- Registro ---
+
+    def record_request(self):
+        with self._lock:
+            self.total_requests += 1
+
+    def record_error(self, model_name, error_kind='internal'):
+        with self._lock:
+            self.error_count[model_name] += 1
+            self.error_kinds[(model_name, error_kind)] += 1
+
+    def record_result(self, model_name, result):
+        """
+        Registra un `ModelResult`: latencias y uso de tokens si fue correcto, o el error por tipo.
+        Las respuestas servidas desde la caché no cuentan para las latencias ni el rendimiento,
+        y las agrupadas con otra llamada en curso solo cuentan su latencia (los tokens ya los
+        contó la llamada real).
+        """
+        now = time.time()
+        with self._lock:
+            if result.coalesced:
+                self.coalesced_calls[model_name] += 1
+            if not result.ok:
+                self.error_count[model_name] += 1
+                self.error_kinds[(model_name, result.error_kind)] += 1
+                return
+            if result.cached:
+                return
+            if result.latency is not None:
+                self.response_times[model_name].record(result.latency, now)
+            if result.first_token_latency is not None:
+                self.first_token_times[model_name].record(result.first_token_latency, now)
+            if result.coalesced:
+                return
+            if result.input_tokens:
+                self.input_tokens[model_name] += result.input_tokens
+            if result.output_tokens and result.latency:
+                self.output_tokens[model_name] += result.output_tokens
+                self.generation_seconds[model_name] += result.latency
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, route, latency):
+        with self._lock:
+            self.in_flight -= 1
+            self.route_latencies[route].record(latency, time.time())
+
+    # --- Agregación entre procesos ---
+
+    _HISTOGRAMS = ('response_times', 'first_token_times', 'route_latencies')
+
+    def export_state(self):
+        """Contadores e histogramas en un diccionario serializable en JSON (ver `merged`)."""
+        with self._lock:
+            return {
+                'total_requests': self.total_requests,
+                'in_flight': self.in_flight,
+                'error_count': dict(self.error_count),
+                'error_kinds': [[model, kind, count] for (model, kind), count in self.error_kinds.items()],
+                'coalesced_calls': dict(self.coalesced_calls),
+                'input_tokens': dict(self.input_tokens),
+                'output_tokens': dict(self.output_tokens),
+                'generation_seconds': dict(self.generation_seconds),
+                **{name: {key: h.export() for key, h in getattr(self, name).items()} for name in self._HISTOGRAMS},
+            }
+
+    @classmethod
+    def merged(cls, states):
+        """
+        Métricas agregadas de varios procesos a partir de sus `export_state()`, con el resumen
+        ya calculado. Las peticiones en curso solo se suman de los estados marcados como vivos
+        (`state['live']`); los contadores de los procesos que ya terminaron siguen contando.
+        """
+        merged = cls()
+        for state in states:
+            merged.total_requests += state['total_requests']
+            if state.get('live', True):
+                merged.in_flight += state['in_flight']
+            for model, kind, count in state['error_kinds']:
+                merged.error_kinds[(model, kind)] += count
+            for name in ('error_count', 'coalesced_calls', 'input_tokens', 'output_tokens', 'generation_seconds'):
+                totals = getattr(merged, name)
+                for key, value in state[name].items():
+                    totals[key] += value
+            for name in cls._HISTOGRAMS:
+                series = getattr(merged, name)
+                for key, histogram_state in state[name].items():
+                    series[key].merge(histogram_state)
+        merged.refresh()
+        return merged
+
+    # --- Resúmenes ---
+
+    def start(self):
+        """Arranca el hilo que mantiene precalculados los resúmenes."""
+        if self._refresher is not None:
+            return
+
+        def refresh_loop():
+            while not self._stop.wait(self.refresh_interval):
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f"Error al recalcular las métricas: {e}")
+
+        self.refresh()
+        self._refresher = threading.Thread(target=refresh_loop, name='metrics-refresher', daemon=True)
+        self._refresher.start()
+
+    def refresh(self):
+        now = time.time()
+        with self._lock:
+            summary = {
+                'total_requests': self.total_requests,
+                'in_flight': self.in_flight,
+                'error_counts': dict(self.error_count),
+                'error_kinds': self._error_kinds_by_model(),
+                'token_usage': self._token_usage(),
+                'coalesced_calls': dict(self.coalesced_calls),
+                'models': {name: h.summary(now) for name, h in self.response_times.items()},
+                'first_token': {name: h.summary(now) for name, h in self.first_token_times.items()},
+                'routes': {route: h.summary(now) for route, h in self.route_latencies.items()},
+            }
+        summary['computed_at'] = now
+        self._summary = summary
+
+    def _error_kinds_by_model(self):
+        by_model = defaultdict(dict)
+        for (model, kind), count in self.error_kinds.items():
+            by_model[model][kind] = count
+        return dict(by_model)
+
+    def _token_usage(self):
+        """Tokens de entrada/salida por modelo y rendimiento medio en tokens de salida por segundo."""
+        usage = {}
+        for model in set(self.input_tokens) | set(self.output_tokens):
+            seconds = self.generation_seconds.get(model, 0)
+            usage[model] = {
+                'input_tokens': self.input_tokens.get(model, 0),
+                'output_tokens': self.output_tokens.get(model, 0),
+                'tokens_per_sec': round(self.output_tokens.get(model, 0) / seconds, 1) if seconds else None,
+            }
+        return usage
+
+    def summary(self):
+        """Último resumen precalculado (O(1))."""
+        return self._summary
+
+    # --- Exportación Prometheus ---
+
+    def render_prometheus(self, extra_gauges=None):
+        """
+        Devuelve todas las métricas en formato de texto de Prometheus.
+        `extra_gauges` permite añadir indicadores de otros servicios:
+        {nombre: (ayuda, valor | {(('etiqueta', 'valor'), ...): valor})}. Los nombres acabados
+        en `_total` son contadores monótonos y se declaran como `counter`.
+        """
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def labels(pairs):
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{k}="{_escape_label(v)}"' for k, v in pairs) + '}'
+
+        def histogram(name, help_text, label_name, series):
+            header(name, 'histogram', help_text)
+            for key, h in series.items():
+                cumulative = h.cumulative(PROMETHEUS_BUCKETS)
+                for le, count in zip(PROMETHEUS_BUCKETS, cumulative):
+                    lines.append(f"{name}_bucket{labels([(label_name, key), ('le', le)])} {count}")
+                lines.append(f"{name}_bucket{labels([(label_name, key), ('le', '+Inf')])} {h.count}")
+                lines.append(f"{name}_sum{labels([(label_name, key)])} {h.total}")
+                lines.append(f"{name}_count{labels([(label_name, key)])} {h.count}")
+
+        with self._lock:
+            header('prompt_compare_requests_total', 'counter', 'Peticiones a los endpoints de consulta.')
+            lines.append(f"prompt_compare_requests_total {self.total_requests}")
+            header('prompt_compare_http_requests_in_flight', 'gauge', 'Peticiones HTTP en curso.')
+            lines.append(f"prompt_compare_http_requests_in_flight {self.in_flight}")
+            header('prompt_compare_model_errors_total', 'counter', 'Errores por modelo.')
+            for (model, kind), count in self.error_kinds.items():
+                lines.append(f"prompt_compare_model_errors_total{labels([('model', model), ('kind', kind)])} {count}")
+            header('prompt_compare_model_coalesced_total', 'counter',
+                   'Llamadas servidas por otra idéntica que ya estaba en curso.')
+            for model, count in self.coalesced_calls.items():
+                lines.append(f"prompt_compare_model_coalesced_total{labels([('model', model)])} {count}")
+            header('prompt_compare_model_tokens_total', 'counter', 'Tokens consumidos por modelo y dirección.')
+            for direction, totals in (('input', self.input_tokens), ('output', self.output_tokens)):
+                for model, count in totals.items():
+                    lines.append(f"prompt_compare_model_tokens_total{labels([('model', model), ('direction', direction)])} {count}")
+            header('prompt_compare_model_generation_seconds_total', 'counter',
+                   'Segundos de generación de las respuestas con tokens de salida conocidos.')
+            for model, seconds in self.generation_seconds.items():
+                lines.append(f"prompt_compare_model_generation_seconds_total{labels([('model', model)])} {seconds}")
+            histogram('prompt_compare_model_response_seconds', 'Latencia total de cada modelo.',
+                      'model', self.response_times)
+            histogram('prompt_compare_model_first_token_seconds', 'Tiempo hasta el primer token por modelo.',
+                      'model', self.first_token_times)
+            histogram('prompt_compare_http_request_duration_seconds', 'Latencia de cada ruta HTTP.',
+                      'route', self.route_latencies)
+
+        summary = self._summary
+        header('prompt_compare_model_response_window_seconds', 'gauge',
+               'Percentiles de latencia por modelo en ventanas deslizantes.')
+        for model, model_summary in summary.get('models', {}).items():
+            for window, window_summary in model_summary['windows'].items():
+                for label, q in QUANTILES:
+                    pairs = [('model', model), ('window', window), ('quantile', q)]
+                    lines.append(f"prompt_compare_model_response_window_seconds{labels(pairs)} {window_summary[label]}")
+
+        for name, (help_text, value) in (extra_gauges or {}).items():
+            header(name, 'counter' if name.endswith('_total') else 'gauge', help_text)
+            if isinstance(value, dict):
+                for pairs, v in value.items():
+                    lines.append(f"{name}{labels(pairs)} {v}")
+            else:
+                lines.append(f"{name} {value}")
+
+        return '\n'.join(lines) + '\n'
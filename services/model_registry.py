@@ -0,0 +1,387 @@
+# services/model_registry.py
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from types import MappingProxyType
+
+from services.http_pool import transport_settings
+from services.provider_limits import provider_name
+from services.singleflight import COALESCE_MODES, DEFAULT_COALESCE_MODE
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_MODEL_KEYS = ('name', 'module_path', 'class_name')
+
+
+def config_fingerprint(model_config):
+    """Huella estable de la configuración de un modelo (detecta entradas modificadas)."""
+    return json.dumps(dict(model_config), sort_keys=True, ensure_ascii=False, default=str)
+
+
+class RegistrySnapshot:
+    """
+    Vista inmutable de models.json ya validada.
+    Las rutas la consultan sin tocar el disco.
+    """
+    __slots__ = ('version', 'loaded_at', 'models', 'enabled_models', 'enabled_names', 'by_name', 'fingerprints',
+                 'providers')
+
+    def __init__(self, version, models, providers=None):
+        self.version = version
+        self.loaded_at = time.time()
+        self.models = tuple(models)
+        self.enabled_models = tuple(m for m in self.models if m.get('enabled', False))
+        self.enabled_names = tuple(m['name'] for m in self.enabled_models)
+        self.by_name = MappingProxyType({m['name']: m for m in self.models})
+        self.fingerprints = frozenset(config_fingerprint(m) for m in self.models)
+        self.providers = MappingProxyType(dict(providers or {}))
+
+
+class ModelRegistry:
+    """
+    Registro de modelos con recarga en caliente.
+
+    Parsea y valida models.json una vez, y un hilo en segundo plano vigila su mtime/inode
+    para recargarlo cuando cambia. También gestiona el ciclo de vida de las instancias:
+    crea un cliente nuevo cuando cambia la entrada de un modelo y cierra el que sustituye.
+    """
+
+    def __init__(self, path='models.json', reload_interval=2.0, close_grace=90.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.close_grace = close_grace
+        self.on_instance_closed = None
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._instances = {}  # huella -> instancia
+        self._file_signature = None
+        self._snapshot = RegistrySnapshot(0, [])
+        self._watcher = None
+        self._stop = threading.Event()
+        self._prewarm_options = None
+        self._prewarm_report = None
+        self._ready = False
+        self._import_times = {}  # módulo del conector -> (segundos, módulos nuevos cargados)
+        self.reload(force=True)
+
+    # --- Carga y validación ---
+
+    def _read_signature(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _validate(self, data):
+        """Devuelve la lista de entradas válidas (inmutables); las inválidas se registran y se omiten."""
+        if not isinstance(data, dict) or not isinstance(data.get('models', []), list):
+            raise ValueError("models.json debe contener un objeto con una lista 'models'.")
+        models = []
+        seen = set()
+        for index, entry in enumerate(data.get('models', [])):
+            if not isinstance(entry, dict):
+                logger.error(f"models.json: la entrada {index} no es un objeto; se omite.")
+                continue
+            missing = [k for k in REQUIRED_MODEL_KEYS if not isinstance(entry.get(k), str) or not entry.get(k)]
+            if missing:
+                logger.error(f"models.json: a la entrada {index} le faltan {missing}; se omite.")
+                continue
+            if entry['name'] in seen:
+                logger.error(f"models.json: nombre de modelo duplicado '{entry['name']}'; se omite.")
+                continue
+            if not isinstance(entry.get('enabled', False), bool):
+                logger.error(f"models.json: 'enabled' de '{entry['name']}' debe ser booleano; se omite.")
+                continue
+            if entry.get('coalesce', DEFAULT_COALESCE_MODE) not in COALESCE_MODES:
+                logger.error(f"models.json: 'coalesce' de '{entry['name']}' debe ser uno de "
+                             f"{COALESCE_MODES}; se omite.")
+                continue
+            max_context = entry.get('max_context_tokens')
+            if max_context is not None and (not isinstance(max_context, int) or isinstance(max_context, bool)
+                                            or max_context <= 0):
+                logger.error(f"models.json: 'max_context_tokens' de '{entry['name']}' debe ser un entero "
+                             f"positivo; se omite.")
+                continue
+            semantic = entry.get('semantic_cache', False)
+            if not isinstance(semantic, bool) and (not isinstance(semantic, (int, float)) or not 0 < semantic <= 1):
+                logger.error(f"models.json: 'semantic_cache' de '{entry['name']}' debe ser booleano o un umbral "
+                             f"entre 0 y 1; se omite.")
+                continue
+            seen.add(entry['name'])
+            models.append(MappingProxyType(dict(entry)))
+        return models
+
+    def _validate_providers(self, data):
+        """Límites por proveedor (sección opcional 'providers'): {nombre: {ajuste: valor}}."""
+        if not isinstance(data.get('providers', {}), dict):
+            raise ValueError("'providers' en models.json debe ser un objeto.")
+        providers = {}
+        for name, settings in data.get('providers', {}).items():
+            if not isinstance(settings, dict):
+                logger.error(f"models.json: los ajustes del proveedor '{name}' no son un objeto; se omiten.")
+                continue
+            if 'transport' in settings:
+                try:
+                    transport_settings(settings['transport'])
+                except ValueError as e:
+                    logger.error(f"models.json: transporte del proveedor '{name}' inválido ({e}); "
+                                 "se usarán los valores por defecto.")
+                    settings = {k: v for k, v in settings.items() if k != 'transport'}
+            providers[name] = MappingProxyType(dict(settings))
+        return providers
+
+    def _with_transport(self, models, providers):
+        """
+        Copia en cada modelo los ajustes de 'transport' de su proveedor (salvo que el modelo
+        traiga los suyos), de modo que un cambio de transporte recrea sus clientes.
+        """
+        resolved = []
+        for model in models:
+            transport = providers.get(provider_name(model), {}).get('transport')
+            if transport is not None and 'transport' not in model:
+                model = MappingProxyType({**model, 'transport': transport})
+            resolved.append(model)
+        return resolved
+
+    def reload(self, force=False):
+        """Recarga models.json si ha cambiado. Devuelve True si se publicó una instantánea nueva."""
+        signature = self._read_signature()
+        if not force and signature == self._file_signature:
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            models = self._validate(data)
+            providers = self._validate_providers(data)
+            models = self._with_transport(models, providers)
+        except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
+            logger.error(f"Error al cargar '{self.path}': {e}")
+            # Se conserva la última configuración válida.
+            self._file_signature = signature
+            return False
+
+        with self._lock:
+            self._file_signature = signature
+            snapshot = RegistrySnapshot(self._snapshot.version + 1, models, providers)
+            self._snapshot = snapshot
+            stale = [fp for fp in self._instances if fp not in snapshot.fingerprints]
+            replaced = [self._instances.pop(fp) for fp in stale]
+
+        for instance in replaced:
+            self._schedule_close(instance)
+        logger.info(f"Registro de modelos cargado (versión {snapshot.version}): "
+                    f"{len(snapshot.enabled_models)} de {len(snapshot.models)} modelos activos.")
+        if self._prewarm_options is not None:
+            # Las entradas nuevas o modificadas se precalientan también tras una recarga.
+            self.prewarm(**self._prewarm_options)
+        return True
+
+    def snapshot(self):
+        """Instantánea inmutable actual (sin E/S)."""
+        return self._snapshot
+
+    # --- Vigilancia del fichero ---
+
+    def start_watching(self):
+        if self._watcher is not None or self.reload_interval <= 0:
+            return
+
+        def watch():
+            while not self._stop.wait(self.reload_interval):
+                try:
+                    self.reload()
+                except Exception as e:
+                    logger.error(f"Error al recargar el registro de modelos: {e}")
+
+        self._watcher = threading.Thread(target=watch, name='model-registry-watcher', daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    # --- Ciclo de vida de las instancias ---
+
+    def get_instance(self, model_config):
+        """
+        Devuelve la instancia del modelo para esta configuración, creándola si hace falta.
+        Una petición que aún usa una instantánea antigua recibe la instancia de la configuración
+        vigente de ese modelo: cada conector retiene un cliente HTTP compartido y solo las
+        instancias cacheadas se cierran.
+        """
+        fingerprint = config_fingerprint(model_config)
+        instance = self._instances.get(fingerprint)
+        if instance is not None:
+            return instance
+        snapshot = self._snapshot
+        if fingerprint not in snapshot.fingerprints and model_config.get('name') in snapshot.by_name:
+            model_config = snapshot.by_name[model_config['name']]
+            fingerprint = config_fingerprint(model_config)
+            instance = self._instances.get(fingerprint)
+            if instance is not None:
+                return instance
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(fingerprint, threading.Lock())
+        with build_lock:
+            instance = self._instances.get(fingerprint)
+            if instance is not None:
+                return instance
+            instance = self._build_instance(model_config)
+            if instance is None:
+                return None
+            with self._lock:
+                self._build_locks.pop(fingerprint, None)
+                # Solo se cachean las instancias de la configuración vigente. Si el modelo ya no
+                # existe (o se recargó mientras se creaba), la instancia sirve a esta llamada y
+                # se cierra tras el margen, como las sustituidas.
+                current = fingerprint in self._snapshot.fingerprints
+                if current:
+                    self._instances[fingerprint] = instance
+            if not current:
+                self._schedule_close(instance)
+            return instance
+
+    # --- Precalentamiento ---
+
+    def prewarm(self, max_workers=8, warm_connections=False):
+        """
+        Importa e inicializa en segundo plano los conectores de los modelos activos y, si
+        `warm_connections`, abre de antemano su conexión con el proveedor. Los módulos de
+        los modelos desactivados no se importan nunca. `readiness()` indica cuándo ha terminado.
+        """
+        self._prewarm_options = {'max_workers': max_workers, 'warm_connections': warm_connections}
+        snapshot = self._snapshot
+        thread = threading.Thread(target=self._run_prewarm, args=(snapshot, max_workers, warm_connections),
+                                  name='model-prewarm', daemon=True)
+        thread.start()
+        return thread
+
+    def _run_prewarm(self, snapshot, max_workers, warm_connections):
+        start = time.perf_counter()
+        report = {'version': snapshot.version, 'finished': False, 'models': {}}
+        with self._lock:
+            self._prewarm_report = report
+
+        # Las importaciones van de una en una: son CPU bajo el GIL (en paralelo no se ganaría tiempo)
+        # y así el desglose por módulo es exacto. La creación de clientes y las conexiones sí van en paralelo.
+        import_errors = {}
+        for module_path in dict.fromkeys(m['module_path'] for m in snapshot.enabled_models):
+            try:
+                self._timed_import(module_path)
+            except Exception as e:
+                import_errors[module_path] = f"Error al importar {module_path}: {e}"
+                logger.error(import_errors[module_path])
+
+        def prepare(model_config):
+            entry = {'import_sec': round(self._import_times.get(model_config['module_path'], (0, 0))[0], 3)}
+            if model_config['module_path'] in import_errors:
+                entry['error'] = import_errors[model_config['module_path']]
+            else:
+                entry.update(self._prewarm_model(model_config, warm_connections))
+            entry['ready'] = 'error' not in entry
+            with self._lock:
+                report['models'][model_config['name']] = entry
+
+        if snapshot.enabled_models:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='prewarm') as pool:
+                list(pool.map(prepare, snapshot.enabled_models))
+        with self._lock:
+            report['total_sec'] = round(time.perf_counter() - start, 3)
+            report['finished'] = True
+            self._ready = True
+
+        breakdown = ', '.join(f"{module} {seconds:.2f} s ({count} módulos)" for module, (seconds, count)
+                              in sorted(self._import_times.items(), key=lambda item: -item[1][0]))
+        failed = [name for name, entry in report['models'].items() if entry.get('error')]
+        logger.info(f"Precalentamiento de la versión {snapshot.version} terminado en {report['total_sec']:.2f} s. "
+                    f"Importaciones: {breakdown or 'ninguna'}.")
+        if failed:
+            logger.warning(f"Modelos que no se pudieron preparar: {failed}.")
+
+    def _timed_import(self, module_path):
+        """Importa el módulo de un conector y anota cuánto costó la primera vez (y cuántos módulos trajo)."""
+        if module_path in sys.modules:
+            return
+        before = len(sys.modules)
+        start = time.perf_counter()
+        import_module(module_path)
+        self._import_times[module_path] = (time.perf_counter() - start, len(sys.modules) - before)
+
+    def _prewarm_model(self, model_config, warm_connections):
+        """Crea la instancia del modelo y, opcionalmente, calienta su conexión."""
+        entry = {}
+        start = time.perf_counter()
+        instance = self.get_instance(model_config)
+        entry['init_sec'] = round(time.perf_counter() - start, 3)
+        if instance is None:
+            entry['error'] = f"No se pudo cargar la clase {model_config['class_name']} desde {model_config['module_path']}."
+        elif instance.initialization_error:
+            entry['error'] = instance.initialization_error
+        elif warm_connections:
+            start = time.perf_counter()
+            try:
+                instance.warmup()
+            except Exception as e:
+                # Una conexión que no se pudo abrir no impide atender peticiones.
+                logger.warning(f"No se pudo calentar la conexión de '{model_config['name']}': {e}")
+            entry['warm_sec'] = round(time.perf_counter() - start, 3)
+        return entry
+
+    def readiness(self):
+        """
+        Estado del precalentamiento. `ready` pasa a True cuando ha terminado el primero (o de
+        inmediato si no se pidió) y no vuelve a False durante los de las recargas.
+        """
+        with self._lock:
+            report = self._prewarm_report
+            return {
+                'ready': self._ready or self._prewarm_options is None,
+                'prewarm': {**report, 'models': dict(report['models'])} if report else None,
+            }
+
+    def live_instances(self):
+        """Instancias vivas de la configuración vigente."""
+        with self._lock:
+            return list(self._instances.values())
+
+    def _build_instance(self, model_config):
+        module_path = model_config['module_path']
+        class_name = model_config['class_name']
+        try:
+            ai_module = import_module(module_path)
+            AIClass = getattr(ai_module, class_name)
+            return AIClass(dict(model_config))
+        except (ImportError, AttributeError) as e:
+            logger.error(f"No se pudo cargar la clase {class_name} desde {module_path}: {e}")
+            return None
+
+    def _schedule_close(self, instance):
+        """Cierra una instancia sustituida tras un margen para que terminen las llamadas en curso."""
+        timer = threading.Timer(self.close_grace, self._close_instance, args=(instance,))
+        timer.daemon = True
+        timer.start()
+
+    def _close_instance(self, instance):
+        try:
+            instance.close()
+            if self.on_instance_closed is not None:
+                self.on_instance_closed(instance)
+            logger.info(f"Cliente de '{instance.name}' cerrado tras un cambio en la configuración.")
+        except Exception as e:
+            logger.warning(f"Error al cerrar el cliente de '{instance.name}': {e}")
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': snapshot.version,
+            'loaded_at': snapshot.loaded_at,
+            'models': len(snapshot.models),
+            'enabled_models': len(snapshot.enabled_models),
+            'live_instances': len(self._instances),
+        }
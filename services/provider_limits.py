@@ -0,0 +1,555 @@
+# services/provider_limits.py
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+from collections import deque
+
+from ai_models.base_model import ProviderError, estimate_tokens
+from services.metrics import WindowedHistogram
+
+logger = logging.getLogger(__name__)
+
+# Ajustes por defecto de un proveedor; se sobrescriben con la sección 'providers' de models.json.
+DEFAULT_PROVIDER_SETTINGS = {
+    'max_in_flight': 16,       # llamadas simultáneas
+    'rpm': None,               # peticiones por minuto (cubo de tokens)
+    'tpm': None,               # tokens por minuto (estimados a partir del prompt y max_tokens)
+    'max_retries': 2,          # reintentos ante 429/5xx/errores de conexión
+    'backoff_base': 0.5,       # segundos; backoff exponencial con jitter completo
+    'backoff_max': 20,
+    'breaker_failures': 5,     # fallos consecutivos que abren el circuito
+    'breaker_cooldown': 30,    # segundos con el circuito abierto antes de probar
+    'half_open_calls': 1,      # llamadas de prueba permitidas en semiabierto
+}
+
+# Intervalo de sondeo de la ruta asíncrona mientras espera un hueco (no bloquea el bucle de eventos).
+_ASYNC_POLL_INTERVAL = 0.02
+
+
+class ProviderUnavailableError(RuntimeError):
+    """El proveedor no admite la llamada: circuito abierto o sin hueco antes del plazo."""
+
+
+class Timers:
+    """
+    Un único hilo que ejecuta funciones cortas al llegar su instante: esperas por los cubos
+    RPM/TPM, backoff entre reintentos y plazos de las llamadas en cola. Así ninguna de esas
+    esperas ocupa un hilo del pool compartido.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay, fn):
+        with self._cond:
+            heapq.heappush(self._heap, (time.time() + delay, next(self._sequence), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='provider-timers', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.time():
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+                _, _, fn = heapq.heappop(self._heap)
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"Error en una tarea programada de los límites de proveedor: {e}")
+
+
+_timers = Timers()
+
+
+class _PendingCall:
+    """Llamada de la ruta del pool mientras pasa por la admisión y sus reintentos."""
+    __slots__ = ('fn', 'args', 'tokens', 'deadline', 'can_retry', 'executor', 'future', 'attempt',
+                 'queued_at', 'inner', 'abandoned')
+
+    def __init__(self, fn, args, tokens, deadline, can_retry, executor):
+        self.fn = fn
+        self.args = args
+        self.tokens = tokens
+        self.deadline = deadline
+        self.can_retry = can_retry
+        self.executor = executor
+        self.future = concurrent.futures.Future()
+        # En ejecución desde el principio: cancelarlo no debe tocar los contadores de cola del pool.
+        self.future.set_running_or_notify_cancel()
+        self.attempt = 0
+        self.queued_at = time.time()
+        self.inner = None       # future del pool mientras se ejecuta un intento
+        self.abandoned = False
+
+
+def estimate_request_tokens(prompt, options):
+    """Tokens que se descuentan del límite TPM: prompt estimado más el máximo de salida pedido."""
+    return estimate_tokens(prompt) + int((options or {}).get('max_tokens') or 0)
+
+
+def provider_name(model_config):
+    """Proveedor de un modelo: la clave 'provider' o, si no está, el módulo del conector."""
+    return model_config.get('provider') or model_config['module_path'].rsplit('.', 1)[-1]
+
+
+class TokenBucket:
+    """
+    Cubo de tokens por minuto que admite deuda: cada reserva se descuenta al momento y
+    devuelve cuánto hay que esperar, de modo que las esperas se reparten en orden de llegada.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= min(amount, self.capacity)
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + min(amount, self.capacity))
+
+
+class CircuitBreaker:
+    """Circuit breaker clásico: cerrado → abierto tras N fallos seguidos → semiabierto tras la espera."""
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, name, failures, cooldown, half_open_calls):
+        self.name = name
+        self.failures = failures
+        self.cooldown = cooldown
+        self.half_open_calls = half_open_calls
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        if self.state == self.OPEN and time.time() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self._probes = 0
+
+    def retry_in(self):
+        with self._lock:
+            self._refresh()
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.cooldown - time.time())
+
+    def allow(self):
+        """Decide si se admite una llamada; en semiabierto solo pasan las de prueba."""
+        with self._lock:
+            self._refresh()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def release_probe(self):
+        """Devuelve una prueba de semiabierto admitida que no llegó a hacerse."""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuito del proveedor '{self.name}' cerrado de nuevo.")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED
+                                                and self.consecutive_failures >= self.failures):
+                self.state = self.OPEN
+                self.opened_at = time.time()
+                self.trips += 1
+                logger.warning(f"Circuito del proveedor '{self.name}' abierto tras "
+                               f"{self.consecutive_failures} fallos consecutivos.")
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'trips': self.trips,
+                'retry_in_sec': round(max(0.0, self.opened_at + self.cooldown - time.time()), 1)
+                if self.state == self.OPEN else 0,
+            }
+
+
+class ProviderGuard:
+    """
+    Límites de un proveedor: llamadas en curso, cubos RPM/TPM, reintentos con backoff
+    exponencial y jitter (respetando Retry-After) y circuit breaker.
+
+    En la ruta del pool (`submit`) la llamada solo se envía al pool compartido cuando ya
+    tiene hueco en el proveedor: mientras tanto espera en una cola propia del proveedor, y
+    las esperas por RPM/TPM y el backoff entre reintentos se programan con un temporizador.
+    Así un proveedor saturado no ocupa hilos del pool que necesitan los demás. La ruta
+    asíncrona (`acall`) envuelve la corrutina que la ejecuta. `deadline` es el instante
+    (time.time()) en el que el llamante deja de esperar, así que ni las esperas ni los
+    reintentos lo sobrepasan.
+    """
+
+    def __init__(self, name, settings):
+        self.name = name
+        self.settings = None
+        self.breaker = None
+        self.in_flight = 0
+        self._waiting = deque()  # _PendingCall en espera de hueco, por orden de llegada
+        self._cond = threading.Condition()
+        self.queue_waits = WindowedHistogram()
+        self.counters = {'calls': 0, 'retries': 0, 'rejected_open': 0, 'rejected_busy': 0, 'failures': 0}
+        self.configure(settings)
+
+    def configure(self, settings):
+        """Aplica los ajustes de models.json conservando el estado del circuito y las estadísticas."""
+        merged = {**DEFAULT_PROVIDER_SETTINGS, **settings}
+        with self._cond:
+            self.settings = dict(settings)
+            self.max_in_flight = max(1, int(merged['max_in_flight']))
+            self.max_retries = max(0, int(merged['max_retries']))
+            self.backoff_base = float(merged['backoff_base'])
+            self.backoff_max = float(merged['backoff_max'])
+            self.rpm_bucket = TokenBucket(merged['rpm']) if merged['rpm'] else None
+            self.tpm_bucket = TokenBucket(merged['tpm']) if merged['tpm'] else None
+            if self.breaker is None:
+                self.breaker = CircuitBreaker(self.name, merged['breaker_failures'],
+                                              merged['breaker_cooldown'], merged['half_open_calls'])
+            else:
+                self.breaker.failures = merged['breaker_failures']
+                self.breaker.cooldown = merged['breaker_cooldown']
+                self.breaker.half_open_calls = merged['half_open_calls']
+        self._drain_waiting()
+
+    # --- Admisión ---
+
+    def _open_error(self):
+        retry_in = self.breaker.retry_in()
+        if retry_in <= 0:
+            return None
+        with self._cond:
+            self.counters['rejected_open'] += 1
+        return ProviderUnavailableError(
+            f"Circuito abierto para el proveedor '{self.name}': se reintentará en {math.ceil(retry_in)} s.")
+
+    def _reject_if_open(self):
+        error = self._open_error()
+        if error is not None:
+            raise error
+
+    def _busy(self):
+        with self._cond:
+            self.counters['rejected_busy'] += 1
+        return ProviderUnavailableError(
+            f"El proveedor '{self.name}' no tiene huecos libres antes del plazo de la llamada.")
+
+    def _try_take_slot(self):
+        with self._cond:
+            # Las llamadas que ya esperan en la cola tienen preferencia.
+            if not self._waiting and self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                return True
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self.in_flight -= 1
+        self._drain_waiting()
+
+    def _drain_waiting(self):
+        """Pasa los huecos libres a las llamadas en cola, por orden de llegada."""
+        while True:
+            with self._cond:
+                while self._waiting and self._waiting[0].abandoned:
+                    self._waiting.popleft()
+                if not self._waiting or self.in_flight >= self.max_in_flight:
+                    return
+                call = self._waiting.popleft()
+                self.in_flight += 1
+            self._reserve_and_dispatch(call)
+
+    def _reserve(self, tokens):
+        """Reserva en los cubos RPM/TPM. Devuelve (espera, función para deshacer la reserva)."""
+        buckets = [(bucket, amount) for bucket, amount in ((self.rpm_bucket, 1), (self.tpm_bucket, tokens))
+                   if bucket is not None and amount]
+        wait = max([bucket.reserve(amount) for bucket, amount in buckets], default=0.0)
+
+        def refund():
+            for bucket, amount in buckets:
+                bucket.refund(amount)
+        return wait, refund
+
+    def _admitted(self, waited_since, refund):
+        """Última comprobación del circuito (consume una prueba en semiabierto) y registro de la espera."""
+        if not self.breaker.allow():
+            refund()
+            self._release_slot()
+            with self._cond:
+                self.counters['rejected_open'] += 1
+            raise ProviderUnavailableError(f"Circuito abierto para el proveedor '{self.name}'.")
+        with self._cond:
+            self.counters['calls'] += 1
+            self.queue_waits.record(time.time() - waited_since, time.time())
+
+    async def _aadmit(self, tokens, deadline):
+        self._reject_if_open()
+        start = time.time()
+        while not self._try_take_slot():
+            if time.time() >= deadline:
+                raise self._busy()
+            await asyncio.sleep(_ASYNC_POLL_INTERVAL)
+        wait, refund = self._reserve(tokens)
+        if time.time() + wait > deadline:
+            refund()
+            self._release_slot()
+            raise self._busy()
+        try:
+            if wait:
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._release_slot()
+            raise
+        self._admitted(start, refund)
+
+    # --- Ruta del pool: admisión sin ocupar hilos ---
+
+    def _fail(self, call, error):
+        if not call.future.done():
+            call.future.set_exception(error)
+
+    def _enqueue(self, call):
+        """Admite un intento: toma un hueco libre o espera en la cola hasta que se libere uno o venza el plazo."""
+        if call.abandoned:
+            return
+        error = self._open_error()
+        if error is not None:
+            self._fail(call, error)
+            return
+        call.queued_at = time.time()
+        if self._try_take_slot():
+            self._reserve_and_dispatch(call)
+            return
+        with self._cond:
+            self._waiting.append(call)
+        _timers.schedule(max(call.deadline - time.time(), 0), lambda: self._expire_waiting(call))
+        # Por si se liberó un hueco entre el intento y la entrada en la cola.
+        self._drain_waiting()
+
+    def _expire_waiting(self, call):
+        with self._cond:
+            try:
+                self._waiting.remove(call)
+            except ValueError:
+                return  # ya admitida o abandonada
+        self._fail(call, self._busy())
+
+    def _reserve_and_dispatch(self, call):
+        """Con el hueco tomado: reserva en los cubos y envía el intento al pool (al momento o tras la espera)."""
+        wait, refund = self._reserve(call.tokens)
+        if time.time() + wait > call.deadline:
+            refund()
+            self._release_slot()
+            self._fail(call, self._busy())
+            return
+        if wait:
+            _timers.schedule(wait, lambda: self._dispatch(call, refund))
+        else:
+            self._dispatch(call, refund)
+
+    def _dispatch(self, call, refund):
+        if call.abandoned:
+            refund()
+            self._release_slot()
+            return
+        try:
+            self._admitted(call.queued_at, refund)
+        except ProviderUnavailableError as e:
+            self._fail(call, e)
+            return
+        try:
+            inner = call.executor.submit(self._run, call)
+        except Exception as e:
+            # Pool saturado: el intento no llega a salir, así que no cuenta para el circuito.
+            refund()
+            self._release_slot()
+            self._fail(call, e)
+            return
+        # Si se cancela mientras espera un hilo (al abandonarla), `_run` no llega a ejecutarse.
+        inner.add_done_callback(lambda inner: inner.cancelled() and self._cancelled(refund))
+        call.inner = inner
+
+    def _run(self, call):
+        """Un intento en un hilo del pool; los reintentos se vuelven a admitir tras el backoff."""
+        if call.abandoned:
+            # Abandonada entre la admisión y el envío: como un cliente que se va, no cuenta como fallo.
+            self._finish(True, float('inf'))
+            return
+        try:
+            result = call.fn(*call.args)
+        except ProviderError as e:
+            self._finish(False, call.deadline)
+            retryable = call.can_retry is None or call.can_retry()
+            delay = self._retry_delay(call.attempt, e, call.deadline) if retryable and not call.abandoned else None
+            if delay is None:
+                self._fail(call, e)
+                return
+            call.attempt += 1
+            _timers.schedule(delay, lambda: self._enqueue(call))
+            return
+        except BaseException as e:
+            self._finish(False, call.deadline)
+            self._fail(call, e)
+            return
+        self._finish(True, call.deadline)
+        if not call.future.done():
+            call.future.set_result(result)
+
+    def _abandon(self, call):
+        """El llamante deja de esperar: sale de la cola y el intento en curso, si lo hay, se abandona en el pool."""
+        call.abandoned = True
+        with self._cond:
+            try:
+                self._waiting.remove(call)
+            except ValueError:
+                pass
+        if call.inner is not None:
+            call.executor.abandon(call.inner, count_timeout=False)
+        self._fail(call, concurrent.futures.TimeoutError())
+
+    def _cancelled(self, refund):
+        """Un intento cancelado en la cola del pool: devuelve la reserva, la prueba y el hueco."""
+        refund()
+        self.breaker.release_probe()
+        self._release_slot()
+
+    def _finish(self, ok, deadline):
+        """Libera el hueco y alimenta el circuito. Terminar fuera de plazo cuenta como fallo."""
+        self._release_slot()
+        if ok and time.time() <= deadline:
+            self.breaker.record_success()
+        else:
+            with self._cond:
+                self.counters['failures'] += 1
+            self.breaker.record_failure()
+
+    def _retry_delay(self, attempt, error, deadline):
+        """Espera antes del siguiente intento, o None si no hay que reintentar."""
+        if attempt >= self.max_retries or self.breaker.retry_in() > 0:
+            return None
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if error.retry_after is not None:
+            delay = error.retry_after + random.uniform(0, self.backoff_base)
+        if time.time() + delay >= deadline:
+            return None
+        with self._cond:
+            self.counters['retries'] += 1
+        logger.info(f"Reintentando la llamada a '{self.name}' en {delay:.2f} s ({error}).")
+        return delay
+
+    # --- Llamadas ---
+
+    def submit(self, executor, fn, *args, tokens=0, deadline=None, can_retry=None):
+        """
+        Ejecuta `fn(*args)` en el pool `executor` dentro de los límites del proveedor y
+        devuelve un `Future` con su resultado. La llamada solo ocupa un hilo del pool mientras
+        se ejecuta un intento. `can_retry()`, si se indica, decide si un `ProviderError` aún
+        se puede reintentar (p. ej. un streaming que todavía no ha entregado texto).
+        Abandonar el future (`ModelCallExecutor.abandon`) la saca de la cola o abandona el
+        intento en curso.
+        """
+        call = _PendingCall(fn, args, tokens, deadline or time.time() + 60, can_retry, executor)
+        call.future._on_abandon = lambda: self._abandon(call)
+        self._enqueue(call)
+        return call.future
+
+    async def acall(self, fn, *args, tokens=0, deadline=None):
+        """Como `call`, pero `fn(*args)` es una corrutina (ruta asíncrona)."""
+        deadline = deadline or time.time() + 60
+        attempt = 0
+        while True:
+            await self._aadmit(tokens, deadline)
+            try:
+                result = await fn(*args)
+            except ProviderError as e:
+                self._finish(False, deadline)
+                delay = self._retry_delay(attempt, e, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Incluye la cancelación por timeout del llamante.
+                self._finish(False, deadline)
+                raise
+            self._finish(True, deadline)
+            return result
+
+    def stats(self, now=None):
+        now = now or time.time()
+        with self._cond:
+            return {
+                **self.breaker.stats(),
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'waiting': len(self._waiting),
+                **self.counters,
+                'queue_wait_sec': self.queue_waits.summary(now),
+            }
+
+
+class ProviderLimits:
+    """Un `ProviderGuard` por proveedor, reconfigurado en caliente cuando cambia models.json."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._guards = {}
+
+    def guard_for(self, model_config, providers):
+        """`providers` es la sección 'providers' de la instantánea vigente del registro."""
+        name = provider_name(model_config)
+        settings = dict(providers.get(name, {}))
+        guard = self._guards.get(name)
+        if guard is not None and guard.settings == settings:
+            return guard
+        with self._lock:
+            guard = self._guards.get(name)
+            if guard is None:
+                guard = self._guards[name] = ProviderGuard(name, settings)
+            elif guard.settings != settings:
+                guard.configure(settings)
+                logger.info(f"Límites del proveedor '{name}' actualizados: {settings}")
+            return guard
+
+    def stats(self):
+        now = time.time()
+        return {name: guard.stats(now) for name, guard in list(self._guards.items())}
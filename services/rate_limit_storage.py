@@ -0,0 +1,92 @@
+# services/rate_limit_storage.py
+import os
+import sqlite3
+import threading
+import time
+
+from limits.storage import Storage
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+# Cada cuántos segundos se borran como mucho los contadores caducados.
+_PURGE_INTERVAL = 60
+
+
+class SQLiteStorage(Storage):
+    """
+    Almacenamiento de `limits` en un fichero SQLite local (modo WAL), para que los contadores
+    de flask_limiter se compartan entre varios procesos de la misma máquina.
+
+    URI: `sqlite:///ruta/relativa.sqlite3` o `sqlite:////ruta/absoluta.sqlite3`. Solo admite
+    la estrategia de ventana fija (la que usa la aplicación); cada incremento es una única
+    sentencia UPSERT, atómica entre procesos.
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        self.path = uri[len('sqlite:///'):] if uri and uri.startswith('sqlite:///') else 'cache/ratelimit.sqlite3'
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=float(options.get('timeout', 5)), check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(_SCHEMA)
+        self._next_purge = 0
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        with self._lock:
+            # Si la ventana anterior ya caducó, el contador vuelve a empezar con una caducidad nueva.
+            row = self._db.execute(
+                'INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET '
+                'value = CASE WHEN expires_at <= ? THEN excluded.value ELSE value + excluded.value END, '
+                'expires_at = CASE WHEN expires_at <= ? THEN excluded.expires_at ELSE expires_at END '
+                'RETURNING value',
+                (key, amount, now + expiry, now, now)).fetchone()
+            if now >= self._next_purge:
+                self._next_purge = now + _PURGE_INTERVAL
+                self._db.execute('DELETE FROM counters WHERE expires_at <= ?', (now,))
+        return row[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT value FROM counters WHERE key = ? AND expires_at > ?',
+                                   (key, time.time())).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT expires_at FROM counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else time.time()
+
+    def check(self):
+        try:
+            with self._lock:
+                self._db.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._lock:
+            return self._db.execute('DELETE FROM counters').rowcount
+
+    def clear(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM counters WHERE key = ?', (key,))
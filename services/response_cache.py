@@ -0,0 +1,190 @@
+# services/response_cache.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Opciones que controlan el comportamiento de la aplicación y no cambian la respuesta del modelo,
+# por lo que no forman parte de la clave de caché.
+NON_SEMANTIC_OPTIONS = {'analytics', 'cache', 'coalesce', 'context', 'deadline_ms', 'first_k', 'semantic_cache'}
+
+
+def normalize_prompt(prompt):
+    """Normaliza el prompt para la clave: recorta y colapsa espacios en blanco (en cada mensaje si es una lista)."""
+    if isinstance(prompt, list):
+        return [[message['role'], ' '.join(message['content'].split())] for message in prompt]
+    return ' '.join(prompt.split())
+
+
+def is_cacheable(options):
+    """
+    Una respuesta solo se cachea si es determinista (temperature == 0)
+    o si el llamante lo pide explícitamente con `options['cache'] = True`.
+    `options['cache'] = False` desactiva la caché aunque la temperatura sea 0.
+    """
+    options = options or {}
+    if 'cache' in options:
+        return bool(options['cache'])
+    try:
+        return float(options.get('temperature')) == 0.0
+    except (TypeError, ValueError):
+        return False
+
+
+def make_cache_key(model_config, prompt, options):
+    """Clave estable a partir del conector, el modelo de la API, el prompt normalizado y las opciones."""
+    semantic_options = {k: v for k, v in (options or {}).items() if k not in NON_SEMANTIC_OPTIONS}
+    payload = json.dumps([
+        model_config.get('module_path'),
+        model_config.get('model_name_api', model_config.get('name')),
+        normalize_prompt(prompt),
+        semantic_options,
+    ], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Caché de respuestas en dos niveles con TTL.
+
+    - Nivel 1: LRU en memoria, acotado por número de entradas y por bytes.
+    - Nivel 2: SQLite local persistente; sus aciertos se promocionan a memoria.
+    """
+
+    def __init__(self, path='cache/response_cache.sqlite3', max_entries=1000,
+                 max_bytes=64 * 1024 * 1024, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()  # key -> (response, expires_at, size)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._stores_since_prune = 0
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+        self._open_db()
+
+    def _open_db(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)')
+            self._db.commit()
+            self._prune_disk()
+        except sqlite3.Error as e:
+            logger.error(f"No se pudo abrir la caché en disco '{self.path}': {e}. Se usará solo la caché en memoria.")
+            self._db = None
+
+    def get(self, key):
+        """Devuelve la respuesta cacheada o None."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, expires_at, size = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.counters['memory_hits'] += 1
+                    return response
+                self._memory.pop(key)
+                self._memory_bytes -= size
+                self.counters['expirations'] += 1
+
+        row = None
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    row = self._db.execute(
+                        'SELECT response, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Error al leer la caché en disco: {e}")
+
+        if row is not None and row[1] > now:
+            with self._lock:
+                self.counters['disk_hits'] += 1
+            self._put_memory(key, row[0], row[1])
+            return row[0]
+
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def set(self, key, response):
+        """Guarda una respuesta en ambos niveles."""
+        expires_at = time.time() + self.ttl
+        self._put_memory(key, response, expires_at)
+        with self._lock:
+            self.counters['stores'] += 1
+            self._stores_since_prune += 1
+            prune = self._stores_since_prune >= 500
+            if prune:
+                self._stores_since_prune = 0
+        if self._db is None:
+            return
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO responses (key, response, created_at, expires_at) VALUES (?, ?, ?, ?)',
+                    (key, response, time.time(), expires_at))
+                self._db.commit()
+            if prune:
+                self._prune_disk()
+        except sqlite3.Error as e:
+            logger.warning(f"Error al escribir en la caché en disco: {e}")
+
+    def _put_memory(self, key, response, expires_at):
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= previous[2]
+            self._memory[key] = (response, expires_at, size)
+            self._memory_bytes += size
+            while self._memory and (len(self._memory) > self.max_entries or self._memory_bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._memory.popitem(last=False)
+                self._memory_bytes -= evicted_size
+                self.counters['evictions'] += 1
+
+    def _prune_disk(self):
+        """Elimina del disco las entradas caducadas."""
+        with self._db_lock:
+            deleted = self._db.execute('DELETE FROM responses WHERE expires_at <= ?', (time.time(),)).rowcount
+            self._db.commit()
+        if deleted:
+            with self._lock:
+                self.counters['expirations'] += deleted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+            hits = self.counters['memory_hits'] + self.counters['disk_hits']
+            return {
+                **self.counters,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+            }
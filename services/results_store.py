@@ -0,0 +1,210 @@
+# services/results_store.py
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ('never', 'rotate', 'batch')
+COMPRESSIONS = (None, 'gzip', 'zstd')
+
+_STOP = object()
+
+
+class ResultsStore:
+    """
+    Almacén de resultados con escritura diferida (write-behind) y solo de anexado.
+
+    La petición solo encola el registro; un hilo en segundo plano lo agrupa en lotes y
+    lo anexa como una línea JSON a segmentos `results/AAAA-MM-DD/segment-*.jsonl`,
+    que rotan por tamaño, antigüedad o cambio de día. Cada registro lleva un `id` único,
+    así que dos peticiones iguales en el mismo segundo ya no se pisan.
+    """
+
+    def __init__(self, base_dir='results', max_segment_bytes=64 * 1024 * 1024, max_segment_age=3600,
+                 compression=None, fsync='never', max_queue=10000, batch_size=200,
+                 flush_interval=1.0, backpressure_timeout=0.5):
+        if compression == 'zstd':
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                logger.warning("Compresión 'zstd' solicitada pero el paquete 'zstandard' no está instalado; se usará gzip.")
+                compression = 'gzip'
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Compresión no soportada: {compression}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Política de fsync no soportada: {fsync}")
+
+        self.base_dir = base_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_age = max_segment_age
+        self.compression = compression
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure_timeout = backpressure_timeout
+        self.listeners = []  # callables(record, segment_path) avisados tras cada escritura
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._segment = None  # (ruta, fichero, fichero_bruto, fecha, abierto_en)
+        self._segment_bytes = 0
+        self._sequence = 0
+        self.counters = {'enqueued': 0, 'written': 0, 'dropped': 0, 'batches': 0, 'segments': 0, 'write_errors': 0}
+        self._thread = threading.Thread(target=self._run, name='results-writer', daemon=True)
+        self._thread.start()
+
+    # --- API para las peticiones ---
+
+    def enqueue(self, record):
+        """
+        Encola un registro sin bloquear. Si la cola está llena se aplica backpressure:
+        se espera como mucho `backpressure_timeout` y, si sigue llena, el registro se descarta.
+        Devuelve el id del registro o None si se descartó.
+        """
+        record.setdefault('id', uuid.uuid4().hex)
+        record.setdefault('timestamp', datetime.now().isoformat())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            try:
+                self._queue.put(record, timeout=self.backpressure_timeout)
+            except queue.Full:
+                with self._lock:
+                    self.counters['dropped'] += 1
+                logger.error(f"Cola de resultados llena: se descarta el registro {record['id']}.")
+                return None
+        with self._lock:
+            self.counters['enqueued'] += 1
+        return record['id']
+
+    # --- Hilo de escritura ---
+
+    def _run(self):
+        while True:
+            batch = []
+            stop = False
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+                while not stop and len(batch) < self.batch_size:
+                    item = self._queue.get_nowait()
+                    if item is _STOP:
+                        stop = True
+                    else:
+                        batch.append(item)
+            except queue.Empty:
+                pass
+
+            if batch:
+                self._write_batch(batch)
+            elif self._segment and time.time() - self._segment[4] > self.max_segment_age:
+                self._close_segment()
+            if stop:
+                self._close_segment()
+                return
+
+    def _segment_path(self, date_str):
+        date_dir = os.path.join(self.base_dir, date_str)
+        os.makedirs(date_dir, exist_ok=True)
+        self._sequence += 1
+        suffix = {None: '', 'gzip': '.gz', 'zstd': '.zst'}[self.compression]
+        name = f"segment-{datetime.now().strftime('%H-%M-%S')}-{os.getpid()}-{self._sequence:04d}.jsonl{suffix}"
+        return os.path.join(date_dir, name)
+
+    def _open_segment(self, date_str):
+        path = self._segment_path(date_str)
+        raw = open(path, 'ab')
+        if self.compression == 'gzip':
+            writer = gzip.GzipFile(fileobj=raw, mode='ab')
+        elif self.compression == 'zstd':
+            import zstandard
+            writer = zstandard.ZstdCompressor().stream_writer(raw)
+        else:
+            writer = raw
+        self._segment = (path, writer, raw, date_str, time.time())
+        self._segment_bytes = 0
+        with self._lock:
+            self.counters['segments'] += 1
+        logger.info(f"Nuevo segmento de resultados: {path}")
+
+    def _close_segment(self):
+        if not self._segment:
+            return
+        path, writer, raw, _, _ = self._segment
+        try:
+            if self.compression == 'gzip':
+                writer.close()  # Escribe el trailer gzip; no cierra el fichero subyacente.
+            elif self.compression == 'zstd':
+                import zstandard
+                writer.flush(zstandard.FLUSH_FRAME)
+            raw.flush()
+            if self.fsync in ('rotate', 'batch'):
+                os.fsync(raw.fileno())
+            raw.close()
+        except Exception as e:
+            logger.error(f"Error al cerrar el segmento {path}: {e}")
+        self._segment = None
+
+    def _write_batch(self, batch):
+        date_str = datetime.now().strftime("%Y-%m-%d")
+        try:
+            if self._segment and (self._segment[3] != date_str
+                                  or self._segment_bytes >= self.max_segment_bytes
+                                  or time.time() - self._segment[4] > self.max_segment_age):
+                self._close_segment()
+            if not self._segment:
+                self._open_segment(date_str)
+
+            path, writer, raw, _, _ = self._segment
+            payload = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in batch).encode('utf-8')
+            writer.write(payload)
+            writer.flush()
+            raw.flush()
+            if self.fsync == 'batch':
+                os.fsync(raw.fileno())
+            self._segment_bytes += len(payload)
+            with self._lock:
+                self.counters['written'] += len(batch)
+                self.counters['batches'] += 1
+        except Exception as e:
+            with self._lock:
+                self.counters['write_errors'] += 1
+            logger.error(f"Error al escribir {len(batch)} resultados: {e}")
+            self._close_segment()
+            return
+
+        for record in batch:
+            for listener in self.listeners:
+                try:
+                    listener(record, path)
+                except Exception as e:
+                    logger.warning(f"Error en un oyente del almacén de resultados: {e}")
+
+    # --- Ciclo de vida ---
+
+    def close(self, timeout=10):
+        """Vacía la cola y cierra el segmento actual (se llama al apagar la aplicación)."""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout=timeout)
+        logger.info("Almacén de resultados vaciado y cerrado.")
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'queued': self._queue.qsize(),
+                'current_segment': self._segment[0] if self._segment else None,
+            }
+
@@ -0,0 +1,425 @@
+# services/semantic_cache.py
+import difflib
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from services.response_cache import make_cache_key
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEMANTIC_THRESHOLD = 0.95
+
+_NGRAM_SIZES = (3, 4, 5)
+_HASH_PRIME = np.uint64(1099511628211)
+_HASH_MIX = np.uint64(0x9E3779B97F4A7C15)
+_CODE_BITS = 64
+_FORMAT_VERSION = 2
+# Palabras (con sus apóstrofos: "don't") y cada signo suelto, operadores incluidos.
+_TOKEN = re.compile(r"\w+(?:'\w+)*|[^\w\s]")
+# Lo único que puede cambiar entre dos prompts para compartir respuesta: signos de puntuación,
+# artículos y fórmulas de cortesía. Todo lo demás (palabras, números, operadores y negaciones)
+# tiene que aparecer igual y en el mismo orden.
+_IGNORABLE = frozenset('. , ; : ! ? ¿ ¡ " \' …'.split() + [
+    'a', 'an', 'the', 'please', 'kindly',
+    'el', 'la', 'los', 'las', 'lo', 'un', 'una', 'unos', 'unas', 'porfa',
+])
+# "por favor" cuenta como una sola fórmula de cortesía ("por" suelto sí es contenido).
+_POR_FAVOR = re.compile(r'\bpor favor\b')
+# Retoques ignorables como mucho entre dos prompts que comparten respuesta.
+MAX_PROMPT_EDITS = 2
+
+
+def semantic_threshold(model_config, options, default=DEFAULT_SEMANTIC_THRESHOLD):
+    """
+    Similitud mínima para servir una llamada desde la caché semántica, o None si no se usa.
+
+    Un modelo la activa con 'semantic_cache' en models.json: true (umbral `default`) o un
+    número entre 0 y 1 con su propio umbral. `options.semantic_cache = true` la activa
+    también para los demás modelos y `false` la desactiva.
+    """
+    configured = model_config.get('semantic_cache', False)
+    requested = (options or {}).get('semantic_cache')
+    if requested is False or (configured is False and requested is not True):
+        return None
+    return default if isinstance(configured, bool) else float(configured)
+
+
+def semantic_scope(model_config, options):
+    """Ámbito de búsqueda: la clave de caché sin el prompt (mismo conector, modelo y opciones)."""
+    return make_cache_key(model_config, '', options)
+
+
+def normalize_text(text):
+    """Minúsculas y espacios colapsados. La puntuación y los operadores se conservan: cambian la pregunta."""
+    return ' '.join(text.lower().split())
+
+
+def prompt_tokens(text):
+    """Palabras y signos del prompt normalizado, en orden."""
+    return _TOKEN.findall(_POR_FAVOR.sub('porfa', normalize_text(text)))
+
+
+def same_question(stored, asked, max_edits=MAX_PROMPT_EDITS):
+    """
+    True si dos prompts piden lo mismo: las mismas palabras con contenido en el mismo orden
+    (una palabra cambiada, movida, añadida o quitada, negaciones incluidas, ya es otra
+    pregunta) y, como mucho, `max_edits` signos de puntuación, artículos o fórmulas de
+    cortesía distintos. La similitud de los vectores solo preselecciona candidatos: los
+    n-gramas apenas distinguen 'cats' de 'bats' o un orden de palabras de otro.
+    """
+    stored_tokens, asked_tokens = prompt_tokens(stored), prompt_tokens(asked)
+    if stored_tokens == asked_tokens:
+        return True
+    if ([t for t in stored_tokens if t not in _IGNORABLE]
+            != [t for t in asked_tokens if t not in _IGNORABLE]):
+        return False
+    matcher = difflib.SequenceMatcher(None, stored_tokens, asked_tokens, autojunk=False)
+    edits = sum(max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal')
+    return edits <= max_edits
+
+
+def embed(text, dim=512):
+    """
+    Vector de n-gramas de caracteres (3 a 5) del texto normalizado, con hashing firmado en
+    `dim` posiciones y norma L2 = 1. Es local y determinista (no depende de la semilla de
+    `hash()`), así que los vectores guardados en disco siguen valiendo tras reiniciar.
+    """
+    normalized = normalize_text(text)
+    vector = np.zeros(dim, dtype=np.float32)
+    if not normalized:
+        return vector
+    chars = np.frombuffer(f' {normalized} '.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    for size in _NGRAM_SIZES:
+        count = len(chars) - size + 1
+        if count <= 0:
+            continue
+        hashes = np.full(count, size, dtype=np.uint64)
+        for offset in range(size):
+            hashes = hashes * _HASH_PRIME + chars[offset:offset + count]
+        hashes *= _HASH_MIX
+        positions = (hashes >> np.uint64(32)) % np.uint64(dim)
+        signs = ((hashes >> np.uint64(16)) & np.uint64(1)).astype(np.float32) * 2 - 1
+        vector += np.bincount(positions.astype(np.int64), weights=signs, minlength=dim).astype(np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _popcount(values):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return np.unpackbits(values.view(np.uint8)).reshape(len(values), -1).sum(axis=1)
+
+
+class SemanticCache:
+    """
+    Caché de respuestas para prompts casi idénticos (espacios, mayúsculas o retoques menores).
+
+    Cada prompt se guarda como un vector de n-gramas (`embed`) en una matriz float16 de
+    tamaño fijo junto a su firma SimHash de 64 bits (signo contra 64 hiperplanos aleatorios
+    fijos). Una búsqueda calcula la distancia de Hamming con todas las firmas del mismo
+    ámbito (modelo más opciones), toma las `candidates` más cercanas y solo a esas les
+    calcula la similitud coseno exacta: un vecino más cercano aproximado cuyo coste apenas
+    crece con el número de entradas. El acierto exige una similitud >= `threshold` y, además,
+    que los dos prompts pidan lo mismo palabra por palabra (`same_question`).
+
+    Las entradas caducan a los `ttl` segundos y, con la caché llena, se reutiliza el hueco
+    de la entrada caducada o menos usada. Todo se guarda en un `.npz` sin pickle (escritura
+    atómica desde un hilo cada `save_interval` segundos si hubo cambios, y al cerrar, combinada
+    con lo que hayan guardado otros procesos) y se carga con una sola lectura al arrancar.
+    """
+
+    def __init__(self, path='cache/semantic_cache.npz', max_entries=10000, ttl=86400, dim=512,
+                 candidates=32, save_interval=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.dim = dim
+        self.candidates = candidates
+        self.save_interval = save_interval
+        self._planes = np.random.default_rng(_FORMAT_VERSION).standard_normal((dim, _CODE_BITS)).astype(np.float32)
+        self._bit_weights = np.uint64(1) << np.arange(_CODE_BITS, dtype=np.uint64)
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float16)
+        self._codes = np.zeros(max_entries, dtype=np.uint64)
+        self._scope_ids = np.full(max_entries, -1, dtype=np.int32)  # -1 = hueco libre
+        self._scope_index = {}  # ámbito -> id
+        self._expires = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._prompts = [''] * max_entries
+        self._responses = [''] * max_entries
+        self._size = 0  # huecos usados alguna vez (los libres están siempre al final)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._saver = None
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expirations': 0, 'saves': 0}
+        self._load()
+
+    # --- Búsqueda y escritura ---
+
+    def _code(self, vector):
+        bits = (vector @ self._planes) > 0
+        return np.uint64(np.bitwise_or.reduce(self._bit_weights[bits])) if bits.any() else np.uint64(0)
+
+    def _nearest(self, scope_id, vector, code, prompt, threshold, now):
+        """
+        Hueco y similitud de la entrada vigente del ámbito más parecida (aproximada) con
+        similitud >= `threshold` que pide lo mismo que `prompt` (`same_question`), o (None, 0).
+        """
+        size = self._size
+        slots = np.flatnonzero((self._scope_ids[:size] == scope_id) & (self._expires[:size] > now))
+        if not len(slots):
+            return None, 0.0
+        if len(slots) > self.candidates:
+            distances = _popcount(self._codes[slots] ^ code)
+            slots = slots[np.argpartition(distances, self.candidates - 1)[:self.candidates]]
+        similarities = self._vectors[slots].astype(np.float32) @ vector
+        for index in np.argsort(-similarities):
+            if similarities[index] < threshold:
+                break
+            slot = int(slots[index])
+            if same_question(self._prompts[slot], prompt):
+                return slot, float(similarities[index])
+        return None, 0.0
+
+    def lookup(self, scope, prompt, threshold):
+        """
+        Respuesta del prompt guardado más parecido del mismo ámbito, o None.
+        Devuelve (respuesta, prompt guardado, similitud).
+        """
+        vector = embed(prompt, self.dim)
+        code = self._code(vector)
+        now = time.time()
+        with self._lock:
+            scope_id = self._scope_index.get(scope)
+            match = None
+            if scope_id is not None:
+                slot, similarity = self._nearest(scope_id, vector, code, prompt, threshold, now)
+                if slot is not None:
+                    self._last_used[slot] = now
+                    match = (self._responses[slot], self._prompts[slot], round(min(similarity, 1.0), 4))
+            self.counters['hits' if match else 'misses'] += 1
+        return match
+
+    def add(self, scope, prompt, response):
+        """Guarda la respuesta de un prompt en su ámbito (sustituye a una entrada casi igual ya guardada)."""
+        vector = embed(prompt, self.dim)
+        if not vector.any():
+            return
+        code = self._code(vector)
+        now = time.time()
+        with self._lock:
+            scope_id = self._scope_index.setdefault(scope, len(self._scope_index))
+            slot = self._free_slot(scope_id, vector, code, prompt, now)
+            self._vectors[slot] = vector
+            self._codes[slot] = code
+            self._scope_ids[slot] = scope_id
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._prompts[slot] = prompt
+            self._responses[slot] = response
+            self.counters['stores'] += 1
+            self._dirty = True
+
+    def _free_slot(self, scope_id, vector, code, prompt, now):
+        """Hueco para una entrada nueva: el de un duplicado, uno sin usar, uno caducado o el menos usado."""
+        slot, _ = self._nearest(scope_id, vector, code, prompt, 0.999, now)
+        if slot is not None:
+            return slot
+        size = self._size
+        if size < self.max_entries:
+            self._size += 1
+            return size
+        expired = np.flatnonzero(self._expires[:size] <= now)
+        if len(expired):
+            self.counters['expirations'] += 1
+            return int(expired[0])
+        self.counters['evictions'] += 1
+        return int(np.argmin(self._last_used[:size]))
+
+    # --- Persistencia ---
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            entries = _read_entries(self.path, self.dim)
+            if entries is None:
+                logger.warning(f"La caché semántica '{self.path}' es de otro formato; se empieza vacía.")
+                return
+            entries = _newest(entries, entries['expires'] > time.time(), self.max_entries)
+            count = len(entries['prompts'])
+            self._vectors[:count] = entries['vectors']
+            self._codes[:count] = entries['codes']
+            self._expires[:count] = entries['expires']
+            self._last_used[:count] = entries['last_used']
+            for slot, scope in enumerate(entries['scopes']):
+                self._scope_ids[slot] = self._scope_index.setdefault(scope, len(self._scope_index))
+                self._prompts[slot] = entries['prompts'][slot]
+                self._responses[slot] = entries['responses'][slot]
+            self._size = count
+            logger.info(f"Caché semántica cargada: {count} entradas desde '{self.path}'.")
+        except Exception as e:
+            logger.error(f"No se pudo cargar la caché semántica '{self.path}': {e}. Se empieza vacía.")
+            self._scope_ids[:] = -1
+            self._scope_index = {}
+            self._size = 0
+
+    def save(self):
+        """
+        Escribe la caché en disco si ha cambiado desde el último guardado. Con varios procesos
+        (WEB_WORKERS) sobre el mismo fichero, cada uno lo lee bajo un bloqueo y añade a las
+        suyas las entradas vigentes que guardaron los demás, así que no se pisan.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            used = np.flatnonzero(self._scope_ids[:self._size] >= 0)
+            scopes = sorted(self._scope_index, key=self._scope_index.get)
+            entries = {
+                'vectors': self._vectors[used].copy(),
+                'codes': self._codes[used].copy(),
+                'expires': self._expires[used].copy(),
+                'last_used': self._last_used[used].copy(),
+                'scopes': [scopes[self._scope_ids[slot]] for slot in used],
+                'prompts': [self._prompts[slot] for slot in used],
+                'responses': [self._responses[slot] for slot in used],
+            }
+            self._dirty = False
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with _file_lock(self.path + '.lock'):
+                entries = self._merge_saved(entries)
+                tmp_path = self.path + '.tmp.npz'
+                _write_entries(tmp_path, entries)
+                os.replace(tmp_path, self.path)
+            with self._lock:
+                self.counters['saves'] += 1
+        except OSError as e:
+            with self._lock:
+                self._dirty = True
+            logger.error(f"No se pudo guardar la caché semántica '{self.path}': {e}")
+
+    def _merge_saved(self, entries):
+        """Añade las entradas vigentes del fichero que no están entre las propias (las propias mandan)."""
+        if not os.path.exists(self.path):
+            return entries
+        try:
+            saved = _read_entries(self.path, self.dim)
+        except Exception as e:
+            logger.warning(f"No se pudo leer la caché semántica '{self.path}' para combinarla: {e}")
+            return entries
+        if saved is None:
+            return entries
+        own = set(zip(entries['scopes'], entries['prompts']))
+        keep = np.array([expires > time.time() and key not in own
+                         for expires, key in zip(saved['expires'], zip(saved['scopes'], saved['prompts']))],
+                        dtype=bool)
+        if not keep.any():
+            return entries
+        saved = _newest(saved, keep, len(keep))
+        combined = {name: np.concatenate([entries[name], saved[name]]) if isinstance(entries[name], np.ndarray)
+                    else entries[name] + saved[name] for name in entries}
+        return _newest(combined, np.ones(len(combined['prompts']), dtype=bool), self.max_entries)
+
+    def start(self):
+        """Arranca el hilo que guarda la caché cada `save_interval` segundos."""
+        if not self.path or self.save_interval <= 0 or self._saver is not None:
+            return
+        self._saver = threading.Thread(target=self._save_loop, name='semantic-cache-saver', daemon=True)
+        self._saver.start()
+
+    def _save_loop(self):
+        while not self._stop.wait(self.save_interval):
+            self.save()
+
+    def close(self):
+        self._stop.set()
+        self.save()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': round(self.counters['hits'] / lookups, 3) if lookups else 0,
+                'entries': int(np.count_nonzero(self._expires[:self._size] > time.time())),
+                'max_entries': self.max_entries,
+            }
+
+
+@contextmanager
+def _file_lock(path):
+    """Bloqueo exclusivo entre procesos (en sistemas sin `fcntl` solo hay un proceso)."""
+    with open(path, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def _read_entries(path, dim):
+    """Entradas de un `.npz` por columnas, con el ámbito y los textos de cada una, o None si es de otro formato."""
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['version']) != _FORMAT_VERSION or data['vectors'].shape[1] != dim:
+            return None
+        scopes = [str(scope) for scope in data['scopes']]
+        return {
+            'vectors': data['vectors'],
+            'codes': data['codes'],
+            'expires': data['expires'],
+            'last_used': data['last_used'],
+            'scopes': [scopes[scope_id] for scope_id in data['scope_ids']],
+            'prompts': _decode_texts(data['prompt_offsets'], data['prompt_data']),
+            'responses': _decode_texts(data['response_offsets'], data['response_data']),
+        }
+
+
+def _newest(entries, mask, limit):
+    """Las entradas de `mask`, como mucho `limit` (las usadas más recientemente)."""
+    keep = np.flatnonzero(mask)
+    if len(keep) > limit:
+        keep = np.sort(keep[np.argsort(entries['last_used'][keep])[-limit:]])
+    return {name: column[keep] if isinstance(column, np.ndarray) else [column[index] for index in keep]
+            for name, column in entries.items()}
+
+
+def _write_entries(path, entries):
+    scopes = sorted(set(entries['scopes']))
+    scope_index = {scope: index for index, scope in enumerate(scopes)}
+    arrays = {
+        'version': np.array(_FORMAT_VERSION),
+        'vectors': entries['vectors'],
+        'codes': entries['codes'],
+        'scope_ids': np.array([scope_index[scope] for scope in entries['scopes']], dtype=np.int32),
+        'scopes': np.array(scopes, dtype=str),
+        'expires': entries['expires'],
+        'last_used': entries['last_used'],
+    }
+    arrays['prompt_offsets'], arrays['prompt_data'] = _encode_texts(entries['prompts'])
+    arrays['response_offsets'], arrays['response_data'] = _encode_texts(entries['responses'])
+    np.savez(path, **arrays)
+
+
+def _encode_texts(texts):
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.concatenate([[0], np.cumsum([len(text) for text in encoded])]).astype(np.int64)
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def _decode_texts(offsets, data):
+    raw = data.tobytes()
+    return [raw[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
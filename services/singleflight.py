@@ -0,0 +1,156 @@
+# services/singleflight.py
+import asyncio
+import concurrent.futures
+import copy
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Valores de la clave 'coalesce' de un modelo en models.json.
+COALESCE_MODES = ('deterministic', 'always', 'never')
+DEFAULT_COALESCE_MODE = 'deterministic'
+
+
+def should_coalesce(model_config, options):
+    """
+    Decide si una llamada puede compartir la de otra petición idéntica en curso.
+
+    Con 'deterministic' (por defecto) solo se agrupan las llamadas con temperature == 0,
+    porque dos respuestas a temperatura alta no tienen por qué coincidir; `options.coalesce
+    = true` lo permite también para las demás y `false` lo impide. 'always' agrupa todas
+    salvo `options.coalesce = false` y 'never' ninguna.
+    """
+    mode = model_config.get('coalesce', DEFAULT_COALESCE_MODE)
+    options = options or {}
+    if mode == 'never' or options.get('coalesce') is False:
+        return False
+    if mode == 'always' or options.get('coalesce') is True:
+        return True
+    try:
+        return float(options.get('temperature')) == 0.0
+    except (TypeError, ValueError):
+        return False
+
+
+class _Flight:
+    __slots__ = ('upstream', 'waiters')
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas idénticas concurrentes (mismo modelo, prompt y opciones) en una sola
+    llamada al proveedor, al estilo del singleflight de Go.
+
+    La primera llamada de una clave hace la consulta real; las que llegan mientras sigue
+    en curso se enganchan a ella y reciben una copia de su `ModelResult` (o su excepción).
+    Cada espera conserva su propio plazo: si una vence, las demás siguen esperando, y la
+    llamada real solo se abandona cuando se han ido todas. Hay una tabla para la ruta
+    síncrona (futures del pool) y otra para la asíncrona (tareas del bucle compartido).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}        # clave -> _Flight con un concurrent.futures.Future
+        self._async_flights = {}  # clave -> _Flight con una asyncio.Task (solo desde el bucle)
+        self.on_orphaned = None   # fn(future) cuando la llamada real se queda sin nadie esperando
+        self.counters = {'upstream_calls': 0, 'coalesced_calls': 0, 'orphaned_calls': 0}
+
+    # --- Ruta síncrona ---
+
+    def submit(self, key, start):
+        """
+        Devuelve (future, agrupada). `start()` envía la llamada real y devuelve su future;
+        solo se invoca si no hay otra igual en curso. El future devuelto es propio de este
+        llamante: al abandonarlo (`ModelCallExecutor.abandon`) solo se descuenta su espera.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            coalesced = flight is not None and not flight.upstream.done()
+            if not coalesced:
+                flight = _Flight(start())
+                self._flights[key] = flight
+                self.counters['upstream_calls'] += 1
+            else:
+                self.counters['coalesced_calls'] += 1
+            flight.waiters += 1
+        if not coalesced:
+            # Fuera del cerrojo: si la llamada ya ha terminado, la devolución se ejecuta aquí mismo.
+            flight.upstream.add_done_callback(lambda future: self._finished(key, flight))
+
+        waiter = concurrent.futures.Future()
+        # En ejecución desde el principio: cancelarlo no debe tocar los contadores de cola del pool.
+        waiter.set_running_or_notify_cancel()
+        waiter._on_abandon = lambda: self._leave(key, flight, waiter)
+
+        def deliver(upstream):
+            if waiter.done():
+                return
+            try:
+                waiter.set_result(copy.copy(upstream.result()))
+            except Exception as e:
+                waiter.set_exception(e)
+
+        flight.upstream.add_done_callback(deliver)
+        return waiter, coalesced
+
+    def _finished(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def _leave(self, key, flight, waiter):
+        """Un llamante deja de esperar; si era el último, la llamada real se abandona."""
+        with self._lock:
+            flight.waiters -= 1
+            orphaned = flight.waiters == 0 and not flight.upstream.done()
+            if orphaned:
+                self.counters['orphaned_calls'] += 1
+                if self._flights.get(key) is flight:
+                    # Las llamadas que lleguen después empiezan una nueva en vez de heredar una sin plazo.
+                    del self._flights[key]
+        if orphaned and self.on_orphaned is not None:
+            self.on_orphaned(flight.upstream)
+
+    # --- Ruta asíncrona ---
+
+    async def run(self, key, make_coro):
+        """
+        Versión asíncrona: devuelve (resultado, agrupada). `make_coro()` crea la corrutina de
+        la llamada real. Si se cancela esta espera (p. ej. por `asyncio.wait_for`), la llamada
+        real sigue mientras quede alguien esperándola y se cancela con el último.
+        """
+        flight = self._async_flights.get(key)
+        coalesced = flight is not None and not flight.upstream.done()
+        if not coalesced:
+            flight = _Flight(asyncio.ensure_future(make_coro()))
+            self._async_flights[key] = flight
+            flight.upstream.add_done_callback(
+                lambda task: self._async_flights.pop(key) if self._async_flights.get(key) is flight else None)
+        with self._lock:
+            self.counters['coalesced_calls' if coalesced else 'upstream_calls'] += 1
+        flight.waiters += 1
+        try:
+            result = await asyncio.shield(flight.upstream)
+        except asyncio.CancelledError:
+            if not flight.upstream.done() and flight.waiters == 1:
+                with self._lock:
+                    self.counters['orphaned_calls'] += 1
+                if self._async_flights.get(key) is flight:
+                    del self._async_flights[key]
+                flight.upstream.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+        return copy.copy(result), coalesced
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'in_flight': len(self._flights) + len(self._async_flights),
+            }
@@ -0,0 +1,244 @@
+# services/sweeps.py
+import concurrent.futures
+import itertools
+import json
+import os
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+
+# Opciones que admite la rejilla de un barrido (las que entienden todos los conectores).
+SWEEP_OPTIONS = ('temperature', 'max_tokens')
+
+# Columnas numéricas de un barrido guardado y su tipo; las de texto se guardan aparte.
+_NUMERIC_COLUMNS = {
+    'temperature': np.float32,      # NaN si la rejilla no la fija
+    'max_tokens': np.int32,         # -1 si la rejilla no lo fija
+    'repeat': np.int16,
+    'latency': np.float32,          # segundos; NaN si no se conoce
+    'input_tokens': np.int32,       # -1 si el proveedor no lo informa
+    'output_tokens': np.int32,
+    'chars': np.int32,
+    'cached': np.bool_,
+}
+# Columnas de texto con pocos valores distintos: se guardan como códigos más su diccionario.
+_CATEGORICAL_COLUMNS = ('model', 'error_kind', 'finish_reason')
+
+
+def sweep_grid(grid, max_values=50):
+    """
+    Valida la rejilla {"temperature": [...], "max_tokens": [...]} y la devuelve normalizada.
+    Lanza ValueError con un mensaje para el cliente.
+    """
+    if not isinstance(grid, dict) or not grid:
+        raise ValueError("'grid' debe ser un objeto con listas de valores para " + ' / '.join(SWEEP_OPTIONS) + '.')
+    unknown = set(grid) - set(SWEEP_OPTIONS)
+    if unknown:
+        raise ValueError(f"Opciones de la rejilla no admitidas: {sorted(unknown)}.")
+    normalized = {}
+    for option in SWEEP_OPTIONS:
+        if option not in grid:
+            continue
+        values = grid[option]
+        if not isinstance(values, list) or not values or len(values) > max_values:
+            raise ValueError(f"'grid.{option}' debe ser una lista de 1 a {max_values} valores.")
+        for value in values:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"'grid.{option}' solo admite números.")
+            if option == 'temperature' and not 0 <= value <= 2:
+                raise ValueError("Las temperaturas de la rejilla deben estar entre 0 y 2.")
+            if option == 'max_tokens' and (not isinstance(value, int) or value <= 0):
+                raise ValueError("Los valores de 'grid.max_tokens' deben ser enteros positivos.")
+        normalized[option] = list(dict.fromkeys(values))
+    return normalized
+
+
+def expand_grid(models, grid, repeats=1):
+    """Celdas del barrido: una por modelo, combinación de la rejilla y repetición."""
+    options = list(grid)
+    cells = []
+    for values in itertools.product(*(grid[option] for option in options)):
+        for model in models:
+            for repeat in range(repeats):
+                cells.append({'model': model, **dict(zip(options, values)), 'repeat': repeat})
+    return cells
+
+
+class SweepScheduler:
+    """
+    Reparte las llamadas de un barrido entre proveedores.
+
+    Cada proveedor tiene su propia cola de celdas y, en cada vuelta, se envía una llamada
+    a cada proveedor con hueco (por turnos), de modo que un proveedor lento o saturado no
+    retiene a los demás. Un proveedor tiene hueco si el barrido tiene menos llamadas en
+    curso que su 'max_in_flight' y él mismo no está ya al límite (por ejemplo, por las
+    peticiones interactivas). En total hay como mucho `max_in_flight` llamadas en curso,
+    para dejar sitio en el pool compartido al resto de peticiones.
+    """
+
+    def __init__(self, max_in_flight=16, poll_interval=0.25, timeout=60):
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def run(self, cells, provider_of, budget_of, submit, collect, on_result, should_stop=None):
+        """
+        Ejecuta `cells` ([(índice, celda)]). `provider_of(celda)` da el proveedor,
+        `budget_of(proveedor)` su (límite, llamadas en curso), `submit(celda)` envía la
+        llamada (un `ModelCall`) y `collect(llamada)` recoge su resultado, que se entrega a
+        `on_result(índice, celda, resultado)`. `should_stop()` permite detener el barrido;
+        las llamadas en curso se devuelven para abandonarlas.
+        """
+        queues = OrderedDict()
+        for index, cell in cells:
+            queues.setdefault(provider_of(cell), deque()).append((index, cell))
+        in_flight = {}  # future -> (índice, celda, llamada, proveedor)
+        per_provider = dict.fromkeys(queues, 0)
+
+        while queues or in_flight:
+            if should_stop is not None and should_stop():
+                return [call for _, _, call, _ in in_flight.values()]
+            dispatched = True
+            while dispatched and queues and len(in_flight) < self.max_in_flight:
+                dispatched = False
+                for provider in list(queues):
+                    if len(in_flight) >= self.max_in_flight:
+                        break
+                    limit, busy = budget_of(provider)
+                    if per_provider[provider] >= limit or busy >= limit:
+                        continue
+                    index, cell = queues[provider].popleft()
+                    if not queues[provider]:
+                        del queues[provider]
+                    call = submit(cell)
+                    in_flight[call.future] = (index, cell, call, provider)
+                    per_provider[provider] += 1
+                    dispatched = True
+
+            if not in_flight:
+                # Todos los proveedores pendientes están al límite por otras peticiones.
+                time.sleep(self.poll_interval)
+                continue
+            done, _ = concurrent.futures.wait(list(in_flight), timeout=self.poll_interval,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            now = time.time()
+            for future, (index, cell, call, provider) in list(in_flight.items()):
+                if future in done or now - call.start_time >= self.timeout:
+                    del in_flight[future]
+                    per_provider[provider] -= 1
+                    on_result(index, cell, collect(call))
+        return []
+
+
+def sweep_row(cell, result):
+    """Fila de un barrido: la celda más las métricas del `ModelResult` (el texto solo si no hubo error)."""
+    return {
+        'model': cell['model'],
+        'temperature': cell.get('temperature'),
+        'max_tokens': cell.get('max_tokens'),
+        'repeat': cell['repeat'],
+        'latency': result.latency,
+        'input_tokens': result.input_tokens,
+        'output_tokens': result.output_tokens,
+        'chars': len(result.text) if result.ok else 0,
+        'cached': result.cached,
+        'error_kind': result.error_kind,
+        'finish_reason': result.finish_reason,
+        'text': result.text,
+    }
+
+
+def write_sweep(path, rows, meta):
+    """
+    Guarda las filas de un barrido en un único `.npz` por columnas (sin pickle): columnas
+    numéricas, columnas categóricas como códigos más su diccionario y los textos como
+    bytes UTF-8 concatenados más sus desplazamientos. `meta` va como JSON.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    arrays = {}
+    for column, dtype in _NUMERIC_COLUMNS.items():
+        missing = np.nan if np.issubdtype(dtype, np.floating) else (-1 if dtype is not np.bool_ else False)
+        arrays[column] = np.array([missing if row[column] is None else row[column] for row in rows], dtype=dtype)
+    for column in _CATEGORICAL_COLUMNS:
+        values = ['' if row[column] is None else str(row[column]) for row in rows]
+        categories, codes = np.unique(np.array(values, dtype=str), return_inverse=True) if values else \
+            (np.array([], dtype=str), np.array([], dtype=np.int64))
+        arrays[f'{column}_categories'] = categories
+        arrays[f'{column}_codes'] = codes.astype(np.int16)
+    encoded = [row['text'].encode('utf-8') for row in rows]
+    arrays['text_offsets'] = np.concatenate([[0], np.cumsum([len(text) for text in encoded])]).astype(np.int64)
+    arrays['text_data'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    arrays['meta'] = np.array(json.dumps(meta, ensure_ascii=False))
+    tmp_path = path + '.tmp.npz'
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_sweep(path, texts=False):
+    """Columnas de un barrido guardado con `write_sweep` (los textos solo con `texts=True`) y su `meta`."""
+    with np.load(path, allow_pickle=False) as data:
+        columns = {column: data[column] for column in _NUMERIC_COLUMNS}
+        for column in _CATEGORICAL_COLUMNS:
+            columns[column] = data[f'{column}_categories'][data[f'{column}_codes']]
+        if texts:
+            offsets, raw = data['text_offsets'], data['text_data'].tobytes()
+            columns['text'] = [raw[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+        meta = json.loads(str(data['meta']))
+    return columns, meta
+
+
+def _stats(values):
+    values = values[~np.isnan(values)]
+    if not len(values):
+        return None
+    p50, p95 = np.percentile(values, [50, 95])
+    return {
+        'mean': round(float(values.mean()), 3),
+        'p50': round(float(p50), 3),
+        'p95': round(float(p95), 3),
+        'min': round(float(values.min()), 3),
+        'max': round(float(values.max()), 3),
+    }
+
+
+def summarize(columns):
+    """
+    Resumen por celda de la rejilla (modelo × temperatura × max_tokens): llamadas, errores,
+    estadísticas de latencia, de longitud de la respuesta (caracteres y tokens de salida)
+    y tokens por segundo. Solo cuentan para latencia y longitud las llamadas sin error.
+    """
+    if not len(columns['model']):
+        return []
+    models, model_codes = np.unique(columns['model'], return_inverse=True)
+    keys = np.column_stack([model_codes, np.nan_to_num(columns['temperature'], nan=-1.0),
+                            columns['max_tokens']]).astype(np.float64)
+    cells, groups = np.unique(keys, axis=0, return_inverse=True)
+    groups = groups.ravel()
+    ok = columns['error_kind'] == ''
+    latency = columns['latency'].astype(np.float64)
+    output_tokens = np.where(columns['output_tokens'] >= 0, columns['output_tokens'], np.nan).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tokens_per_sec = np.where(~columns['cached'] & (latency > 0), output_tokens / latency, np.nan)
+
+    summary = []
+    for index, (model_code, temperature, max_tokens) in enumerate(cells):
+        in_cell = groups == index
+        good = in_cell & ok
+        errors = columns['error_kind'][in_cell & ~ok]
+        kinds, counts = np.unique(errors, return_counts=True)
+        summary.append({
+            'model': str(models[int(model_code)]),
+            'temperature': None if temperature < 0 else round(float(temperature), 3),
+            'max_tokens': None if max_tokens < 0 else int(max_tokens),
+            'calls': int(in_cell.sum()),
+            'errors': int((in_cell & ~ok).sum()),
+            'error_kinds': {str(kind): int(count) for kind, count in zip(kinds, counts)},
+            'latency_sec': _stats(latency[good]),
+            'chars': _stats(columns['chars'][good].astype(np.float64)),
+            'output_tokens': _stats(output_tokens[good]),
+            'tokens_per_sec': _stats(tokens_per_sec[good]),
+        })
+    return summary
@@ -0,0 +1,330 @@
+# services/tracing.py
+import contextvars
+import heapq
+import inspect
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Span activo del hilo o de la tarea asyncio actual (None si la petición no se muestrea).
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class _NoopSpan:
+    """Lo que devuelve `Tracer.span()` fuera de una traza: no mide ni guarda nada."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    """Tramo de una traza: nombre, inicio/fin (ns de reloj de pared), hilo y atributos."""
+
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start_ns', 'end_ns', 'attributes',
+                 'thread_id', 'thread_name', 'error', '_token')
+
+    def __init__(self, trace, name, parent_id=None, attributes=None, start_ns=None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        thread = threading.current_thread()
+        self.thread_id = thread.ident
+        self.thread_name = thread.name
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, end_ns=None):
+        self.end_ns = end_ns or time.time_ns()
+        self.trace.add(self)
+
+    # Uso como gestor de contexto: el span pasa a ser el activo mientras dura el bloque.
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current.reset(self._token)
+        self.end()
+        return False
+
+    @property
+    def duration(self):
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+
+class Trace:
+    """Spans terminados de una petición; pueden llegar desde varios hilos."""
+
+    __slots__ = ('trace_id', 'spans', 'closed', '_lock')
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            # Los spans que terminan después de la petición (modelos rezagados) ya no se exportan.
+            if not self.closed:
+                self.spans.append(span)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            return list(self.spans)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_span(span):
+    attributes = {**span.attributes, 'thread.id': span.thread_id, 'thread.name': span.thread_name}
+    otlp = {
+        'traceId': span.trace.trace_id,
+        'spanId': span.span_id,
+        'name': span.name,
+        'kind': 2 if span.parent_id is None else 1,  # SERVER para la raíz, INTERNAL para el resto
+        'startTimeUnixNano': str(span.start_ns),
+        'endTimeUnixNano': str(span.end_ns),
+        'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()],
+        'status': {'code': 2, 'message': span.error} if span.error else {'code': 0},
+    }
+    if span.parent_id:
+        otlp['parentSpanId'] = span.parent_id
+    return otlp
+
+
+def span_tree(spans):
+    """Árbol anidado de spans con desplazamientos y duraciones en milisegundos (para /debug/slow)."""
+    if not spans:
+        return None
+    origin = min(span.start_ns for span in spans)
+    nodes = {}
+    for span in sorted(spans, key=lambda s: s.start_ns):
+        nodes[span.span_id] = {
+            'name': span.name,
+            'start_ms': round((span.start_ns - origin) / 1e6, 3),
+            'duration_ms': round((span.end_ns - span.start_ns) / 1e6, 3),
+            'thread': f"{span.thread_name} ({span.thread_id})",
+            **({'attributes': span.attributes} if span.attributes else {}),
+            **({'error': span.error} if span.error else {}),
+            'children': [],
+        }
+    roots = []
+    for span in sorted(spans, key=lambda s: s.start_ns):
+        parent = nodes.get(span.parent_id)
+        (parent['children'] if parent else roots).append(nodes[span.span_id])
+    return roots[0] if len(roots) == 1 else {'name': 'trace', 'children': roots}
+
+
+class Tracer:
+    """
+    Trazas ligeras por petición: un árbol de spans con tiempo de pared e hilo de cada tramo.
+
+    Solo se traza la fracción `sample_rate` de las peticiones. Fuera de una traza,
+    `span()` devuelve un objeto vacío tras leer una ContextVar, de modo que con el muestreo
+    desactivado el coste es despreciable. Cada traza terminada se escribe como una línea
+    JSON en formato OTLP (`resourceSpans`, el mismo que acepta un OpenTelemetry Collector)
+    en un fichero rotado por tamaño, desde un hilo aparte; además se conservan en memoria
+    las `slow_keep` peticiones más lentas con su desglose completo (/debug/slow).
+
+    El span activo vive en una ContextVar: los hilos del pool y las corrutinas del bucle
+    compartido no la heredan, así que el trabajo que se envía a otro hilo se envuelve con
+    `wrap()` y las corrutinas con `bind()`.
+    """
+
+    def __init__(self, sample_rate=0.0, slow_keep=20, path=None, max_bytes=10 * 1024 * 1024, backups=5,
+                 service_name='ai-prompt-compare'):
+        self.sample_rate = sample_rate
+        self.slow_keep = slow_keep
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        self._slowest = []  # montículo de (duración, secuencia, traza resumida)
+        self._sequence = itertools.count()
+        self.counters = {'sampled': 0, 'exported': 0, 'export_errors': 0}
+        self._queue = None
+        self._listener = None
+        if path and sample_rate > 0:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups,
+                                                           encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._queue = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(self._queue, handler)
+            self._listener.start()
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0
+
+    # --- Trazas ---
+
+    def start_trace(self, name, attributes=None):
+        """Abre la traza de una petición si toca muestrearla. Devuelve el span raíz o None."""
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+        root = Span(Trace(), name, attributes=attributes)
+        _current.set(root)
+        return root
+
+    def finish_trace(self, root):
+        """Cierra la traza: la exporta al fichero y la guarda si está entre las más lentas."""
+        _current.set(None)
+        root.end()
+        spans = root.trace.close()
+        duration = root.duration
+        with self._lock:
+            self.counters['sampled'] += 1
+            if self.slow_keep > 0 and (len(self._slowest) < self.slow_keep or duration > self._slowest[0][0]):
+                entry = (duration, next(self._sequence), {
+                    'trace_id': root.trace.trace_id,
+                    'name': root.name,
+                    'started_at': root.start_ns / 1e9,
+                    'duration_sec': round(duration, 3),
+                    'spans': span_tree(spans),
+                })
+                if len(self._slowest) < self.slow_keep:
+                    heapq.heappush(self._slowest, entry)
+                else:
+                    heapq.heapreplace(self._slowest, entry)
+        if self._queue is not None:
+            self._export(spans)
+
+    def _export(self, spans):
+        try:
+            line = json.dumps({'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': self.service_name}},
+                    {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}},
+                ]},
+                'scopeSpans': [{'scope': {'name': __name__}, 'spans': [_otlp_span(span) for span in spans]}],
+            }]}, ensure_ascii=False, default=str)
+            self._queue.put(logging.makeLogRecord({'msg': line}))
+            with self._lock:
+                self.counters['exported'] += 1
+        except Exception as e:
+            with self._lock:
+                self.counters['export_errors'] += 1
+            logger.error(f"Error al exportar la traza: {e}")
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    # --- Spans ---
+
+    def current(self):
+        return _current.get()
+
+    def span(self, name, **attributes):
+        """Span hijo del activo, para usar con `with`. Fuera de una traza no hace nada."""
+        parent = _current.get()
+        if parent is None:
+            return _NOOP
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    def wrap(self, fn, name, queue_span=None, **attributes):
+        """
+        Envuelve `fn` para ejecutarla en otro hilo como span `name` hijo del span actual.
+        Con `queue_span`, el tiempo desde el envío hasta que un hilo la recoge se registra
+        como otro span (la espera en la cola del pool).
+        """
+        parent = _current.get()
+        if parent is None:
+            return fn
+        submitted_ns = time.time_ns()
+
+        def run(*args, **kwargs):
+            if queue_span:
+                Span(parent.trace, queue_span, parent.span_id, start_ns=submitted_ns).end()
+            token = _current.set(parent)
+            try:
+                with Span(parent.trace, name, parent.span_id, attributes):
+                    return fn(*args, **kwargs)
+            finally:
+                _current.reset(token)
+
+        return run
+
+    def traced(self, fn, name, **attributes):
+        """
+        Envuelve `fn` (síncrona o corrutina) en un span hijo del que esté activo al llamarla.
+        Fuera de una traza devuelve `fn` tal cual.
+        """
+        if _current.get() is None:
+            return fn
+
+        def run(*args, **kwargs):
+            with self.span(name, **attributes):
+                return fn(*args, **kwargs)
+
+        async def arun(*args, **kwargs):
+            with self.span(name, **attributes):
+                return await fn(*args, **kwargs)
+
+        return arun if inspect.iscoroutinefunction(fn) else run
+
+    def bind(self, coro):
+        """Hace que una corrutina que se ejecutará en otro hilo (bucle compartido) herede el span actual."""
+        parent = _current.get()
+        if parent is None:
+            return coro
+
+        async def run():
+            # Cada tarea asyncio tiene su propia copia del contexto: fijarlo aquí no afecta a otras.
+            _current.set(parent)
+            return await coro
+
+        return run()
+
+    # --- Consulta ---
+
+    def slowest(self):
+        """Las peticiones trazadas más lentas, de más a menos lenta."""
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._slowest, reverse=True)]
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self.counters,
+                'sample_rate': self.sample_rate,
+                'slow_kept': len(self._slowest),
+            }
@@ -0,0 +1,209 @@
+# services/workers.py
+import json
+import logging
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from services.metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# Variables de entorno con las que el supervisor identifica a cada proceso trabajador.
+WORKER_ID_ENV = 'APP_WORKER_ID'
+WORKER_FD_ENV = 'APP_WORKER_FD'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    metrics TEXT NOT NULL,
+    stats TEXT NOT NULL,
+    PRIMARY KEY (worker_id, pid)
+);
+"""
+
+
+class WorkerSupervisor:
+    """
+    Proceso supervisor del modo multiproceso (WEB_WORKERS > 1).
+
+    Abre el puerto una sola vez y lanza N copias del script (`python app.py`) que heredan el
+    socket y aceptan conexiones sobre él, de modo que el kernel reparte las peticiones. Cada
+    trabajador inicializa y precalienta sus propios clientes. Si uno muere se relanza (con
+    espera creciente si muere nada más arrancar) y SIGTERM/SIGINT se reenvían a todos.
+    """
+
+    def __init__(self, workers, host, port, argv=None, restart_delay=1.0, max_restart_delay=30.0,
+                 shutdown_timeout=30.0):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.argv = argv or [sys.executable] + sys.argv
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        self._stop = threading.Event()
+        self._processes = {}  # id de trabajador -> (Popen, lanzado_en, espera_siguiente)
+
+    def _spawn(self, worker_id, sock, delay):
+        env = dict(os.environ, **{WORKER_ID_ENV: str(worker_id), WORKER_FD_ENV: str(sock.fileno())})
+        process = subprocess.Popen(self.argv, env=env, pass_fds=(sock.fileno(),))
+        self._processes[worker_id] = (process, time.monotonic(), delay)
+        logger.info(f"Trabajador {worker_id} lanzado (pid {process.pid}).")
+
+    def run(self):
+        """Bloquea hasta recibir SIGTERM/SIGINT. Devuelve el código de salida del supervisor."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(1024)
+        sock.set_inheritable(True)
+
+        def request_stop(signum, frame):
+            self._stop.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        logger.info(f"Supervisor (pid {os.getpid()}) con {self.workers} trabajadores en http://{self.host}:{self.port}")
+        for worker_id in range(self.workers):
+            self._spawn(worker_id, sock, self.restart_delay)
+
+        while not self._stop.wait(0.5):
+            for worker_id, (process, started_at, delay) in list(self._processes.items()):
+                code = process.poll()
+                if code is None:
+                    continue
+                # Un trabajador que muere nada más arrancar (error de configuración) no se relanza en bucle.
+                lived = time.monotonic() - started_at
+                delay = self.restart_delay if lived > 10 else min(delay * 2, self.max_restart_delay)
+                logger.error(f"El trabajador {worker_id} (pid {process.pid}) terminó con código {code}; "
+                             f"se relanza en {delay:.0f} s.")
+                if self._stop.wait(delay):
+                    break
+                self._spawn(worker_id, sock, delay)
+
+        self._shutdown()
+        sock.close()
+        return 0
+
+    def _shutdown(self):
+        processes = [process for process, _, _ in self._processes.values() if process.poll() is None]
+        for process in processes:
+            process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in processes:
+            try:
+                process.wait(timeout=max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"El trabajador con pid {process.pid} no terminó a tiempo; se mata.")
+                process.kill()
+        logger.info("Supervisor detenido.")
+
+
+class WorkerBoard:
+    """
+    Tablón compartido (SQLite local en modo WAL) con el que los trabajadores agregan sus métricas.
+
+    Cada trabajador publica cada `interval` segundos sus contadores e histogramas
+    (`Metrics.export_state()`) y una instantánea de sus recursos propios (pool, caché, pools
+    HTTP, proveedores...) y, en la misma pasada, lee las filas de los demás para recalcular
+    las métricas agregadas que sirven /status y /metrics. Las filas de los trabajadores que
+    ya terminaron se conservan para que los contadores no retrocedan; un trabajador se
+    considera vivo si ha publicado en los últimos `stale_after` segundos.
+    """
+
+    def __init__(self, path, worker_id, interval=1.0, stale_after=None):
+        self.path = path
+        self.worker_id = str(worker_id)
+        self.interval = interval
+        self.stale_after = stale_after or max(5.0, 5 * interval)
+        self._lock = threading.Lock()
+        self._db = self._connect(path)
+        self._metrics = None
+        self._workers = []
+        self._thread = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _connect(path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.executescript(_SCHEMA)
+        db.commit()
+        return db
+
+    @classmethod
+    def reset(cls, path):
+        """Vacía el tablón; lo llama el supervisor al arrancar para no sumar ejecuciones anteriores."""
+        db = cls._connect(path)
+        db.execute('DELETE FROM workers')
+        db.commit()
+        db.close()
+
+    def publish(self, metrics_state, stats):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO workers (worker_id, pid, updated_at, metrics, stats) '
+                             'VALUES (?, ?, ?, ?, ?)',
+                             (self.worker_id, os.getpid(), time.time(), json.dumps(metrics_state),
+                              json.dumps(stats, default=str)))
+            self._db.commit()
+
+    def collect(self):
+        """Filas de todos los trabajadores: [{worker, pid, updated_at, live, metrics, stats}]."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute('SELECT worker_id, pid, updated_at, metrics, stats FROM workers '
+                                    'ORDER BY worker_id, updated_at').fetchall()
+        return [{
+            'worker': worker_id,
+            'pid': pid,
+            'updated_at': updated_at,
+            'live': now - updated_at <= self.stale_after,
+            'metrics': json.loads(metrics),
+            'stats': json.loads(stats),
+        } for worker_id, pid, updated_at, metrics, stats in rows]
+
+    def refresh(self, metrics, stats_fn):
+        self.publish(metrics.export_state(), stats_fn())
+        rows = self.collect()
+        self._metrics = Metrics.merged([dict(row['metrics'], live=row['live']) for row in rows])
+        self._workers = [{key: row[key] for key in ('worker', 'pid', 'updated_at', 'stats')}
+                         for row in rows if row['live']]
+
+    def start(self, metrics, stats_fn):
+        """Publica y agrega una vez y después cada `interval` segundos en segundo plano."""
+        if self._thread is not None:
+            return
+        self.refresh(metrics, stats_fn)
+
+        def loop():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.refresh(metrics, stats_fn)
+                except Exception as e:
+                    logger.error(f"Error al agregar las métricas de los trabajadores: {e}")
+
+        self._thread = threading.Thread(target=loop, name='worker-board', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def metrics(self):
+        """`Metrics` agregadas de todos los trabajadores (resumen y exportación Prometheus)."""
+        return self._metrics
+
+    def workers(self):
+        """Trabajadores vivos con la última instantánea de sus recursos propios."""
+        return self._workers
@@ -0,0 +1,64 @@
+# tests/test_comparisons.py
+import time
+
+from ai_models.base_model import ModelResult
+from services.comparisons import ComparisonTracker
+
+
+def make_trackers(tmp_path):
+    # Dos trabajadores con el mismo fichero.
+    path = str(tmp_path / 'comparisons.sqlite3')
+    return ComparisonTracker(path, sweep_interval=3600), ComparisonTracker(path, sweep_interval=3600)
+
+
+def test_another_tracker_sees_partial_and_late_results(tmp_path):
+    owner, other = make_trackers(tmp_path)
+    completed = []
+    comparison_id = owner.start('prompt', {'A': ModelResult('hola', latency=0.5)}, {'B': object()},
+                                time.time() + 60, on_expire=None, on_complete=completed.append)
+
+    results, pending = other.get(comparison_id)
+    assert results['A'].text == 'hola' and results['A'].latency == 0.5
+    assert pending == ['B']
+
+    assert owner.claim(comparison_id, 'B')
+    owner.resolve(comparison_id, 'B', ModelResult('adiós', output_tokens=3))
+    results, pending = other.get(comparison_id)
+    assert results['B'].text == 'adiós' and results['B'].output_tokens == 3
+    assert pending == []
+    assert [comparison.id for comparison in completed] == [comparison_id]
+    assert other.stats()['tracked'] == 1 and other.stats()['pending'] == 0
+
+
+def test_unknown_comparison(tmp_path):
+    _, other = make_trackers(tmp_path)
+    assert other.get('no-existe') is None
+
+
+def test_only_the_owner_expires_its_pending_models(tmp_path):
+    owner, other = make_trackers(tmp_path)
+    expired = []
+
+    def on_expire(model_name, handle):
+        expired.append(model_name)
+        return ModelResult.failure('timeout', 'timeout')
+
+    comparison_id = owner.start('prompt', {}, {'A': object()}, time.time() - 1, on_expire, None)
+    other.sweep()
+    assert expired == [] and other.get(comparison_id)[1] == ['A']
+    owner.sweep()
+    assert expired == ['A']
+    results, pending = other.get(comparison_id)
+    assert results['A'].error_kind == 'timeout' and pending == []
+    # La respuesta tardía ya no se recoge.
+    assert not owner.claim(comparison_id, 'A')
+
+
+def test_finished_comparisons_expire_after_retention(tmp_path):
+    owner, other = make_trackers(tmp_path)
+    owner.retention = other.retention = 0
+    comparison_id = owner.start('prompt', {}, {'A': object()}, time.time() + 60, None, None)
+    owner.resolve(comparison_id, 'A', ModelResult('hola'))
+    time.sleep(0.01)
+    other.sweep()
+    assert owner.get(comparison_id) is None
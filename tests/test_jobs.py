@@ -0,0 +1,54 @@
+# tests/test_jobs.py
+import pytest
+
+from services.jobs import JobLost, JobQueue
+
+
+def make_queues(tmp_path):
+    # Dos procesos con el mismo fichero (para la cola, el mismo pid con otro token es otro proceso).
+    path = str(tmp_path / 'jobs.sqlite3')
+    first, second = JobQueue(path), JobQueue(path)
+    for queue in (first, second):
+        queue.register('compare', lambda job: None)
+    return first, second
+
+
+def test_a_job_taken_over_by_another_process_stops_the_stale_runner(tmp_path):
+    first, second = make_queues(tmp_path)
+    job_id = first.submit('ana', 'compare', {'prompt': 'hola'})['id']
+    stale = first._claim()
+    assert stale.id == job_id
+
+    # `second` ve la concesión de `first` como huérfana, devuelve el trabajo a la cola y lo reserva.
+    second._recover()
+    current = second._claim()
+    assert current.id == job_id
+    current.report(step=1)
+
+    with pytest.raises(JobLost):
+        stale.report(step=99)
+    first._finish(job_id, 'done', result={'de': 'first'})
+    assert first.counters['completed'] == 0
+
+    second._finish(job_id, 'done', result={'de': 'second'})
+    job = second.get(job_id)
+    assert job['status'] == 'done'
+    assert job['progress'] == {'step': 1}
+    assert job['result'] == {'de': 'second'}
+
+
+def test_lost_job_is_not_marked_failed_by_the_stale_runner(tmp_path):
+    first, second = make_queues(tmp_path)
+
+    def runner(job):
+        job.report(step=1)
+
+    first.register('compare', runner)
+    job_id = first.submit('ana', 'compare', {'prompt': 'hola'})['id']
+    stale = first._claim()
+    second._recover()
+    assert second._claim().id == job_id
+    first._run(stale)
+    job = second.get(job_id)
+    assert job['status'] == 'running' and job['progress'] == {}
+    assert first.counters['failed'] == 0 and first.counters['cancelled'] == 0
@@ -0,0 +1,62 @@
+# tests/test_provider_limits.py
+import threading
+import time
+
+from services.executor import ModelCallExecutor
+from services.provider_limits import ProviderGuard
+
+
+def wait_until(condition, timeout=5.0):
+    end = time.time() + timeout
+    while not condition():
+        if time.time() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_abandoning_an_attempt_queued_in_the_pool_frees_its_slot():
+    executor = ModelCallExecutor(max_workers=1)
+    guard = ProviderGuard('proveedor', {'max_in_flight': 4, 'rpm': 60})
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return 'ok'
+
+    running = guard.submit(executor, slow)
+    queued = guard.submit(executor, slow)
+    # Los dos tienen hueco en el proveedor, pero el segundo espera un hilo del pool.
+    assert wait_until(lambda: executor.stats()['queued'] == 1)
+    assert guard.stats()['in_flight'] == 2
+    tokens_before = guard.rpm_bucket.tokens
+
+    executor.abandon(queued)
+    assert guard.stats()['in_flight'] == 1
+    assert guard.rpm_bucket.tokens == tokens_before + 1
+
+    release.set()
+    assert running.result(timeout=5) == 'ok'
+    assert wait_until(lambda: guard.stats()['in_flight'] == 0)
+    assert guard.stats()['failures'] == 0
+    executor.shutdown()
+
+
+def test_abandoning_a_running_attempt_frees_its_slot_when_it_ends():
+    executor = ModelCallExecutor(max_workers=1)
+    guard = ProviderGuard('proveedor', {'max_in_flight': 4})
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'ok'
+
+    future = guard.submit(executor, slow)
+    assert started.wait(5)
+    executor.abandon(future)
+    assert guard.stats()['in_flight'] == 1
+    release.set()
+    assert wait_until(lambda: guard.stats()['in_flight'] == 0)
+    executor.shutdown()
@@ -0,0 +1,167 @@
+# tests/test_semantic_cache.py
+import pytest
+
+from services.semantic_cache import DEFAULT_SEMANTIC_THRESHOLD, SemanticCache, embed, same_question
+
+SCOPE = 'modelo'
+
+# Pares de prompts que piden cosas distintas: la caché nunca debe servir la respuesta de uno al otro.
+DIFFERENT_QUESTIONS = [
+    ("Is 5 > 3?", "Is 5 < 3?"),
+    ("2+2", "2*2"),
+    ("Summarize the following article in 3 bullet points: The economy grew last quarter.",
+     "Summarize the following article in 5 bullet points: The economy grew last quarter."),
+    ("Write a Python function that sorts a list of integers in ascending order.",
+     "Write a Python function that sorts a list of integers in descending order."),
+    ("Convert 100 USD to EUR.", "Convert 1000 USD to EUR."),
+    ("What happened in 1914?", "What happened in 1941?"),
+]
+
+# Pares con casi todos los n-gramas en común (similitud >= 0,95) que piden otra cosa.
+WORD_SWAPS = [
+    ("In Python, lists are mutable and tuples are immutable. Explain why.",
+     "In Python, tuples are mutable and lists are immutable. Explain why."),
+    ("Translate from English to Spanish: good morning", "Translate from Spanish to English: good morning"),
+]
+NEGATIONS = [
+    ("Summarize the economic debate of the last election focusing on taxation.",
+     "Summarize the economic debate of the last election not focusing on taxation."),
+    ("Explain why we should use global variables in this module.",
+     "Explain why we should not use global variables in this module."),
+    ("Write a short poem about winter that rhymes.", "Write a short poem about winter that doesn't rhyme."),
+    ("Resume el debate económico de las últimas elecciones centrándote en los impuestos.",
+     "Resume el debate económico de las últimas elecciones sin centrarte en los impuestos."),
+]
+ONE_WORD_SUBSTITUTIONS = [
+    ("Write a short story about two cats who live in an old lighthouse by the sea.",
+     "Write a short story about two bats who live in an old lighthouse by the sea."),
+    ("What is the time complexity of inserting into a balanced binary search tree?",
+     "What is the time complexity of deleting from a balanced binary search tree?"),
+    ("Explain the difference between TCP and UDP for a beginner.",
+     "Explain the difference between TCP and UDP for an expert."),
+]
+
+# Pares que solo difieren en un número: no aciertan ni con un umbral bajo.
+DIFFERENT_NUMBERS = [
+    ("Summarize the following article in 3 bullet points: The economy grew last quarter.",
+     "Summarize the following article in 5 bullet points: The economy grew last quarter."),
+    ("Convert 100 USD to EUR.", "Convert 1000 USD to EUR."),
+    ("What happened in 1914?", "What happened in 1941?"),
+]
+
+# Variantes triviales (espacios y mayúsculas) que sí deben acertar.
+SAME_QUESTIONS = [
+    ("What is the capital of France?", "what is   the capital of FRANCE?"),
+    ("Summarize in 3 bullet points: The economy grew.", "  summarize in 3 bullet points:\nthe economy grew. "),
+]
+
+# Retoques de puntuación, artículos o cortesía: piden lo mismo.
+MINOR_EDITS = [
+    ("What is the capital of France?", "What is the capital of France"),
+    ("Please explain the difference between TCP and UDP.", "Explain the difference between TCP and UDP"),
+    ("Resume el artículo en tres puntos.", "Por favor resume el artículo en tres puntos."),
+]
+
+
+def make_cache():
+    return SemanticCache(path=None, max_entries=100)
+
+
+@pytest.mark.parametrize('stored, asked', DIFFERENT_QUESTIONS)
+def test_different_questions_do_not_hit(stored, asked):
+    cache = make_cache()
+    cache.add(SCOPE, stored, 'respuesta')
+    assert cache.lookup(SCOPE, asked, DEFAULT_SEMANTIC_THRESHOLD) is None
+
+
+@pytest.mark.parametrize('stored, asked', WORD_SWAPS + NEGATIONS + ONE_WORD_SUBSTITUTIONS)
+def test_close_prompts_asking_something_else_do_not_hit(stored, asked):
+    # Con los n-gramas solos acertarían con el umbral de la búsqueda.
+    assert float(embed(stored) @ embed(asked)) >= 0.5
+    assert not same_question(stored, asked)
+    cache = make_cache()
+    cache.add(SCOPE, stored, 'respuesta')
+    assert cache.lookup(SCOPE, asked, 0.5) is None
+
+
+@pytest.mark.parametrize('stored, asked', MINOR_EDITS)
+def test_minor_edits_are_the_same_question(stored, asked):
+    assert same_question(stored, asked)
+    assert same_question(asked, stored)
+
+
+def test_too_many_minor_edits_are_not_the_same_question():
+    assert not same_question("Please, explain the theory.", "Explain theory")
+
+
+@pytest.mark.parametrize('stored, asked', DIFFERENT_NUMBERS)
+def test_different_numbers_never_hit_even_with_a_low_threshold(stored, asked):
+    cache = make_cache()
+    cache.add(SCOPE, stored, 'respuesta')
+    assert cache.lookup(SCOPE, asked, 0.5) is None
+
+
+def test_operators_and_punctuation_change_the_embedding():
+    assert float(embed("Is 5 > 3?") @ embed("Is 5 < 3?")) < 0.9
+    assert float(embed("2+2") @ embed("2*2")) < 0.9
+
+
+@pytest.mark.parametrize('stored, asked', SAME_QUESTIONS)
+def test_whitespace_and_casing_hit(stored, asked):
+    cache = make_cache()
+    cache.add(SCOPE, stored, 'respuesta')
+    match = cache.lookup(SCOPE, asked, DEFAULT_SEMANTIC_THRESHOLD)
+    assert match is not None
+    response, matched_prompt, similarity = match
+    assert response == 'respuesta'
+    assert matched_prompt == stored
+    assert similarity == pytest.approx(1.0, abs=1e-3)
+
+
+def test_scopes_are_isolated():
+    cache = make_cache()
+    cache.add(SCOPE, "What is the capital of France?", 'respuesta')
+    assert cache.lookup('otro modelo', "What is the capital of France?", DEFAULT_SEMANTIC_THRESHOLD) is None
+
+
+def test_persistence_round_trip(tmp_path):
+    path = str(tmp_path / 'semantic.npz')
+    cache = SemanticCache(path=path, max_entries=10)
+    cache.add(SCOPE, "What is the capital of France?", 'París')
+    cache.save()
+    reloaded = SemanticCache(path=path, max_entries=10)
+    match = reloaded.lookup(SCOPE, "what is the capital of france?", DEFAULT_SEMANTIC_THRESHOLD)
+    assert match is not None and match[0] == 'París'
+
+
+def test_workers_saving_the_same_file_keep_each_others_entries(tmp_path):
+    path = str(tmp_path / 'semantic.npz')
+    first = SemanticCache(path=path, max_entries=10)
+    second = SemanticCache(path=path, max_entries=10)
+    first.add(SCOPE, "What is the capital of France?", 'París')
+    second.add(SCOPE, "What is the capital of Spain?", 'Madrid')
+    second.add('otro modelo', "What is the capital of France?", 'Paris')
+    first.save()
+    second.save()
+    first.add(SCOPE, "What is the capital of Italy?", 'Roma')
+    first.save()
+    reloaded = SemanticCache(path=path, max_entries=10)
+    assert reloaded.stats()['entries'] == 4
+    assert reloaded.lookup(SCOPE, "What is the capital of France?", DEFAULT_SEMANTIC_THRESHOLD)[0] == 'París'
+    assert reloaded.lookup(SCOPE, "What is the capital of Spain?", DEFAULT_SEMANTIC_THRESHOLD)[0] == 'Madrid'
+    assert reloaded.lookup(SCOPE, "What is the capital of Italy?", DEFAULT_SEMANTIC_THRESHOLD)[0] == 'Roma'
+    assert reloaded.lookup('otro modelo', "What is the capital of France?", DEFAULT_SEMANTIC_THRESHOLD)[0] == 'Paris'
+
+
+def test_merged_file_keeps_the_most_recently_used_entries(tmp_path):
+    path = str(tmp_path / 'semantic.npz')
+    first = SemanticCache(path=path, max_entries=2)
+    second = SemanticCache(path=path, max_entries=2)
+    first.add(SCOPE, "What is the capital of France?", 'París')
+    first.save()
+    second.add(SCOPE, "What is the capital of Spain?", 'Madrid')
+    second.add(SCOPE, "What is the capital of Italy?", 'Roma')
+    second.save()
+    reloaded = SemanticCache(path=path, max_entries=2)
+    assert reloaded.stats()['entries'] == 2
+    assert reloaded.lookup(SCOPE, "What is the capital of France?", DEFAULT_SEMANTIC_THRESHOLD) is None